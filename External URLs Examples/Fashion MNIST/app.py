@@ -1,29 +1,16 @@
+import os
 import sys
-from flask import Flask
-from flask_restful import Api,Resource,reqparse
-import tensorflow as tf
-import numpy as np
-import h5py
-import json
+
+#the reusable prediction server is in the root folder of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from predictserver import create_app, load_predict_function
 
 cli = sys.modules['flask.cli']
 cli.show_server_banner = lambda *x: None
-app = Flask(__name__)
-api = Api(app)
-
-
-class Predict(Resource):
-   
-    def post(self):
-        parser = reqparse.RequestParser()
-        parser.add_argument("inputs", required=True)
-        args = parser.parse_args()
-        inputs = np.array(json.loads(args.get("inputs")))
-        model = tf.keras.models.load_model("BIVXEXG62V.h5")
-        return model.predict(inputs).tolist()
 
+#the model is loaded once, and concurrent requests are merged into batches
+app = create_app(load_predict_function("BIVXEXG62V.h5", backend="TF2"))
 
-api.add_resource(Predict, '/Predict')
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=6000)
+    app.run(host="0.0.0.0", port=6000, threaded=True)
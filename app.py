@@ -1,43 +1,60 @@
 import sys
 import os
-from flask import Flask, send_from_directory,request
+import time
+_startup = time.perf_counter()
+from flask import Flask, send_from_directory
 from flask_restful import Api
 
 from viewer import ViewExplanation
-from resources.explainers.tabular.dicePublic import DicePublic 
-from resources.explainers.tabular.dicePrivate import DicePrivate
-from resources.explainers.tabular.lime import Lime
-from resources.explainers.tabular.shapKernelLocal import ShapKernelLocal
-from resources.explainers.tabular.shapKernelGlobal import ShapKernelGlobal
-from resources.explainers.tabular.shapTreeLocal import ShapTreeLocal
-from resources.explainers.tabular.shapTreeGlobal import ShapTreeGlobal
-from resources.explainers.tabular.shapDeepLocal import ShapDeepLocal
-from resources.explainers.tabular.shapDeepGlobal import ShapDeepGlobal
-from resources.explainers.tabular.anchors import Anchors
-from resources.explainers.tabular.ale import Ale
-from resources.explainers.tabular.importance import Importance
-from resources.explainers.images.lime import LimeImage
-from resources.explainers.images.anchors import AnchorsImage
-from resources.explainers.images.counterfactuals import CounterfactualsImage
-from resources.explainers.images.gradcamTorch import GradCamTorch
-from resources.explainers.text.lime import LimeText
+from artifactstatus import Artifacts
+from artifactstore import get_store
+from responseformats import register_representations
+from jobstatus import JobStatus
+from jobs import JobManager
+from resultcache import ResultCache
+from cachestatus import CacheStatus
+from metricsstatus import Metrics
+import metrics
+from explainerregistry import select_explainers, register_explainers, warm_up, print_import_report
+import config
 
 
 MODEL_FOLDER="Models"
 UPLOAD_FOLDER="Uploads"
-if len(sys.argv) > 3 :
+
+#options (--enable=, --backends=, --warmup, --import-report) override the values from config
+enabled = config.EXPLAINERS_ENABLED
+backends = config.EXPLAINERS_BACKENDS
+warmup = config.EXPLAINERS_WARMUP
+report = config.IMPORT_REPORT
+argv = [sys.argv[0]]
+for arg in sys.argv[1:]:
+    if arg.startswith("--enable="):
+        enabled = [x for x in arg[len("--enable="):].split(",") if x.strip()]
+    elif arg.startswith("--backends="):
+        backends = [x for x in arg[len("--backends="):].split(",") if x.strip()]
+    elif arg=="--warmup":
+        warmup = True
+    elif arg=="--import-report":
+        report = True
+    elif arg.startswith("--"):
+        raise Exception("Unknown option '" + arg + "'")
+    else:
+        argv.append(arg)
+
+if len(argv) > 3 :
     raise Exception("Too many arguments passed to the program")
 else:
-    if len(sys.argv) >= 2 :
-        if os.path.exists(sys.argv[1]):
-            if os.path.isdir(sys.argv[1]):
-                print("Using existing directory '" +sys.argv[1]+ "'")
+    if len(argv) >= 2 :
+        if os.path.exists(argv[1]):
+            if os.path.isdir(argv[1]):
+                print("Using existing directory '" +argv[1]+ "'")
             else:
-                raise Exception("A non-directory file named '" + sys.argv[1]+ "' already exists. Please use another name.")
+                raise Exception("A non-directory file named '" + argv[1]+ "' already exists. Please use another name.")
         else:
-            os.mkdir(sys.argv[1])
-            print("The '" +sys.argv[1]+ "' directory was created.")
-        MODEL_FOLDER=sys.argv[1]
+            os.mkdir(argv[1])
+            print("The '" +argv[1]+ "' directory was created.")
+        MODEL_FOLDER=argv[1]
     else:
         if os.path.exists(MODEL_FOLDER):
             if os.path.isdir(MODEL_FOLDER):
@@ -48,16 +65,16 @@ else:
             os.mkdir(MODEL_FOLDER)
             print("The '" +MODEL_FOLDER+ "' default directory was created.")
 
-    if len(sys.argv) == 3:
-        if os.path.exists(sys.argv[2]):
-            if os.path.isdir(sys.argv[2]):
-                print("Using existing directory '" +sys.argv[2]+ "'")
+    if len(argv) == 3:
+        if os.path.exists(argv[2]):
+            if os.path.isdir(argv[2]):
+                print("Using existing directory '" +argv[2]+ "'")
             else:
-                raise Exception("A non-directory file named '" + sys.argv[2]+ "' already exists. Please use another name.")
+                raise Exception("A non-directory file named '" + argv[2]+ "' already exists. Please use another name.")
         else:
-            os.mkdir(sys.argv[2])
-            print("The '" +sys.argv[2]+ "' directory was created.")
-        UPLOAD_FOLDER=sys.argv[2]
+            os.mkdir(argv[2])
+            print("The '" +argv[2]+ "' directory was created.")
+        UPLOAD_FOLDER=argv[2]
     else:
         if os.path.exists(UPLOAD_FOLDER):
             if os.path.isdir(UPLOAD_FOLDER):
@@ -73,25 +90,29 @@ cli = sys.modules['flask.cli']
 cli.show_server_banner = lambda *x: None
 app = Flask(__name__)
 api = Api(app)
+register_representations(app, api)
+metrics.init_app(app)
+
+api.add_resource(ViewExplanation, '/ViewExplanation/<string:filename>',resource_class_kwargs={"upload_folder":UPLOAD_FOLDER})
+api.add_resource(Artifacts, '/Artifacts', resource_class_kwargs={"upload_folder":UPLOAD_FOLDER})
+get_store(UPLOAD_FOLDER).start_janitor()
+
+job_manager = JobManager(config.JOBS_FOLDER or os.path.join(UPLOAD_FOLDER, ".jobs"), config.JOBS_MAX_WORKERS, config.JOBS_START_METHOD,
+                         ttl=config.JOBS_TTL)
+api.add_resource(JobStatus, '/Jobs/<string:job_id>', resource_class_kwargs={"job_manager": job_manager})
+
+result_cache = None
+if config.RESULT_CACHE:
+    result_cache = ResultCache(config.RESULT_CACHE_FOLDER or os.path.join(UPLOAD_FOLDER, ".results"))
+api.add_resource(CacheStatus, '/Cache', resource_class_kwargs={"result_cache": result_cache})
+api.add_resource(Metrics, '/metrics')
 
-api.add_resource(ViewExplanation, '/ViewExplanation/<string:filename>')
-api.add_resource(DicePublic, '/Tabular/DicePublic',resource_class_kwargs=path_dict)
-api.add_resource(DicePrivate, '/Tabular/DicePrivate',resource_class_kwargs=path_dict)
-api.add_resource(Lime, '/Tabular/LIME',resource_class_kwargs=path_dict)
-api.add_resource(ShapKernelLocal, '/Tabular/KernelSHAPLocal',resource_class_kwargs=path_dict)
-api.add_resource(ShapKernelGlobal, '/Tabular/KernelSHAPGlobal',resource_class_kwargs=path_dict)
-api.add_resource(ShapTreeLocal, '/Tabular/TreeSHAPLocal',resource_class_kwargs=path_dict)
-api.add_resource(ShapTreeGlobal, '/Tabular/TreeSHAPGlobal',resource_class_kwargs=path_dict)
-api.add_resource(ShapDeepLocal, '/Tabular/DeepSHAPLocal',resource_class_kwargs=path_dict)
-api.add_resource(ShapDeepGlobal, '/Tabular/DeepSHAPGlobal',resource_class_kwargs=path_dict)
-api.add_resource(Anchors, '/Tabular/Anchors',resource_class_kwargs=path_dict)
-api.add_resource(Ale, '/Tabular/ALE',resource_class_kwargs=path_dict)
-api.add_resource(Importance, '/Tabular/Importance',resource_class_kwargs=path_dict)
-api.add_resource(LimeImage, '/Images/LIME',resource_class_kwargs=path_dict)
-api.add_resource(AnchorsImage, '/Images/Anchors',resource_class_kwargs=path_dict)
-api.add_resource(CounterfactualsImage, '/Images/Counterfactuals',resource_class_kwargs=path_dict)
-api.add_resource(GradCamTorch, '/Images/GradCamTorch',resource_class_kwargs=path_dict)
-api.add_resource(LimeText, '/Text/LIME',resource_class_kwargs=path_dict)
+explainers = select_explainers(enabled, backends)
+register_explainers(api, explainers, job_manager, result_cache, **path_dict)
+if warmup:
+    warm_up(explainers)
+if report:
+    print_import_report(time.perf_counter() - _startup)
 
 
 @api.representation('image/png')
@@ -106,5 +127,18 @@ def output_file_html(data, code, headers):
     data["filename"],mimetype="text/html",as_attachment=True)
     return response
 
+#profiles of the explainers (see profiling.py)
+@api.representation('text/plain')
+def output_file_text(data, code, headers):
+    response = send_from_directory(UPLOAD_FOLDER,
+    data["filename"],mimetype="text/plain",as_attachment=True)
+    return response
+
+@api.representation('application/octet-stream')
+def output_file_binary(data, code, headers):
+    response = send_from_directory(UPLOAD_FOLDER,
+    data["filename"],mimetype="application/octet-stream",as_attachment=True)
+    return response
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000)
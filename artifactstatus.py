@@ -0,0 +1,34 @@
+from flask_restful import Resource, reqparse
+from flask import request
+from artifactstore import get_store
+
+
+class Artifacts(Resource):
+
+    def __init__(self, upload_folder):
+        self.store = get_store(upload_folder)
+
+    def _args(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("id")
+        parser.add_argument("endpoint")
+        return parser.parse_args()
+
+    def get(self):
+        #the artifacts are only listed for a model id or an endpoint, e.g. ?id=XGBTCENSUS&endpoint=/Tabular/LIME
+        args = self._args()
+        response = {"stats": self.store.stats()}
+        if args.get("id")!=None or args.get("endpoint")!=None:
+            artifacts = self.store.artifacts(args.get("id"), args.get("endpoint"))
+            for artifact in artifacts:
+                artifact["files"] = [request.host_url + "ViewExplanation/" + f for f in self.store.files(artifact["name"])]
+            response["artifacts"] = artifacts
+        return response
+
+    def delete(self):
+        args = self._args()
+        if args.get("id")==None and args.get("endpoint")==None:
+            return {"message": "An 'id' or an 'endpoint' must be given."}, 400
+        for artifact in self.store.artifacts(args.get("id"), args.get("endpoint")):
+            self.store.delete(artifact["name"])
+        return {"stats": self.store.stats()}
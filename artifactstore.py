@@ -0,0 +1,196 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import config
+
+## Store of the files (plots) created by the explainers. Each artifact is a set of files sharing a base name,
+## e.g. X_Tabular_LIME.png and X_Tabular_LIME.html, kept in a shard directory chosen by the hash of the name
+## (<upload folder>/ab/cd/) so no directory grows too large. An sqlite index records the model id and endpoint
+## of every artifact and when it was last viewed. A background janitor deletes the artifacts that were not
+## viewed within ARTIFACTS_TTL seconds and the least recently viewed ones while the store is larger than
+## ARTIFACTS_MAX_BYTES. Files written by previous versions directly in the upload folder are still served.
+
+INDEX_FILE = ".artifacts.sqlite"
+PENDING_FOLDER = ".pending"
+
+
+def _shard(name):
+    digest = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(digest[:2], digest[2:4])
+
+
+class ArtifactStore:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._janitor = None
+        self.expired = 0
+        self.evicted = 0
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS artifacts (name TEXT PRIMARY KEY, model_id TEXT, endpoint TEXT, "
+                       "created REAL, accessed REAL, size INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS artifacts_model ON artifacts (model_id, endpoint)")
+            db.execute("CREATE INDEX IF NOT EXISTS artifacts_accessed ON artifacts (accessed)")
+
+    def _connect(self):
+        #one connection per thread and process (sqlite connections cannot be shared by forked processes)
+        db = getattr(self._local, "db", None)
+        if db==None or self._local.pid!=os.getpid():
+            os.makedirs(self.folder, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.folder, INDEX_FILE), timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def base_path(self, name):
+        #path of the files of the artifact without their extension
+        return os.path.join(self.folder, _shard(name), name)
+
+    def pending_path(self, name):
+        #data of the plots that are rendered when they are first viewed (see lazyplots.py)
+        return os.path.join(self.folder, PENDING_FOLDER, _shard(name), name + ".pkl")
+
+    def add(self, name, endpoint, model_id=None):
+        #registers a new artifact. Returns the folder where its files are written
+        folder = os.path.dirname(self.base_path(name))
+        os.makedirs(folder, exist_ok=True)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, NULL)", (name, model_id, endpoint, now, now))
+        return folder
+
+    def changed(self, name):
+        #the size of the artifact is measured again by the next run of the janitor
+        with self._connect() as db:
+            db.execute("UPDATE artifacts SET size=NULL WHERE name=?", (name,))
+
+    def file_path(self, filename):
+        #path of a file of the store relative to the upload folder, or None if it does not exist
+        name = os.path.splitext(filename)[0]
+        path = os.path.join(_shard(name), filename)
+        if os.path.isfile(os.path.join(self.folder, path)):
+            return path
+        if os.path.isfile(os.path.join(self.folder, filename)):
+            return filename
+        return None
+
+    def resolve(self, filename):
+        #path relative to the upload folder of a file that is being viewed
+        name = os.path.splitext(filename)[0]
+        with self._connect() as db:
+            indexed = db.execute("UPDATE artifacts SET accessed=? WHERE name=?", (time.time(), name)).rowcount > 0
+        path = os.path.join(_shard(name), filename)
+        if indexed and os.path.isfile(os.path.join(self.folder, path)):
+            return path
+        if os.path.isfile(os.path.join(self.folder, filename)):
+            return filename
+        return None
+
+    def files(self, name):
+        folder = os.path.dirname(self.base_path(name))
+        try:
+            return sorted(entry.name for entry in os.scandir(folder) if entry.name.startswith(name + ".") and entry.is_file())
+        except FileNotFoundError:
+            return []
+
+    def _size(self, name):
+        folder = os.path.dirname(self.base_path(name))
+        paths = [os.path.join(folder, f) for f in self.files(name)] + [self.pending_path(name)]
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def delete(self, name):
+        folder = os.path.dirname(self.base_path(name))
+        for path in [os.path.join(folder, f) for f in self.files(name)] + [self.pending_path(name)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self._connect() as db:
+            db.execute("DELETE FROM artifacts WHERE name=?", (name,))
+
+    def artifacts(self, model_id=None, endpoint=None):
+        query = "SELECT name, model_id, endpoint, created, accessed, size FROM artifacts"
+        conditions = [(c, v) for c, v in (("model_id=?", model_id), ("endpoint=?", endpoint)) if v!=None]
+        if conditions:
+            query += " WHERE " + " AND ".join(c for c, _ in conditions)
+        rows = self._connect().execute(query + " ORDER BY created", [v for _, v in conditions]).fetchall()
+        return [dict(zip(("name", "id", "endpoint", "created", "accessed", "size"), row)) for row in rows]
+
+    def collect(self, ttl=None, max_bytes=None):
+        #deletes the expired artifacts and the least recently viewed ones above the size budget (0 disables them)
+        ttl = config.ARTIFACTS_TTL if ttl==None else ttl
+        max_bytes = config.ARTIFACTS_MAX_BYTES if max_bytes==None else max_bytes
+        db = self._connect()
+        for (name,) in db.execute("SELECT name FROM artifacts WHERE size IS NULL").fetchall():
+            with db:
+                db.execute("UPDATE artifacts SET size=? WHERE name=?", (self._size(name), name))
+        expired = 0
+        if ttl:
+            for (name,) in db.execute("SELECT name FROM artifacts WHERE accessed < ?", (time.time() - ttl,)).fetchall():
+                self.delete(name)
+                expired += 1
+        evicted = 0
+        if max_bytes:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            if total > max_bytes:
+                for name, size in db.execute("SELECT name, size FROM artifacts ORDER BY accessed").fetchall():
+                    if total <= max_bytes:
+                        break
+                    self.delete(name)
+                    total -= size or 0
+                    evicted += 1
+        with self._lock:
+            self.expired += expired
+            self.evicted += evicted
+        return {"expired": expired, "evicted": evicted}
+
+    def start_janitor(self, interval=None):
+        interval = config.ARTIFACTS_JANITOR_INTERVAL if interval==None else interval
+        if self._janitor!=None or interval<=0 or not (config.ARTIFACTS_TTL or config.ARTIFACTS_MAX_BYTES):
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.collect()
+                except Exception as e:
+                    print("The artifact janitor failed: " + str(e))
+
+        self._janitor = threading.Thread(target=run, name="artifact-janitor", daemon=True)
+        self._janitor.start()
+
+    def stats(self):
+        count, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        with self._lock:
+            return {
+                "artifacts": count,
+                "bytes": size,
+                "max_bytes": config.ARTIFACTS_MAX_BYTES,
+                "ttl": config.ARTIFACTS_TTL,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(upload_folder):
+    key = os.path.abspath(upload_folder)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = ArtifactStore(upload_folder)
+        return _stores[key]
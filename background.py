@@ -0,0 +1,71 @@
+import numpy as np
+import config
+
+## Summaries of the training data used as the background of the KernelSHAP explainers. Every coalition is
+## evaluated over all the background rows, so a few weighted k-means centroids or a stratified sample make
+## the explanations much cheaper than the whole training set. Summaries are computed once per data file.
+
+METHODS = ("kmeans", "sample", "full")
+
+#targets with more distinct values than this are considered continuous and not used for stratification
+MAX_STRATA = 50
+
+
+class Background:
+
+    def __init__(self, data, method, rows, training_rows, weights=None, seed=None):
+        self.data = data
+        self.method = method
+        self.rows = rows
+        self.training_rows = training_rows
+        self.weights = weights
+        self.seed = seed
+
+    def metadata(self):
+        return {"method": self.method, "size": self.rows, "training_rows": self.training_rows,
+                "seed": self.seed, "weights": None if self.weights is None else self.weights.tolist()}
+
+
+def _stratified_indices(target, size, seed):
+    rng = np.random.RandomState(seed)
+    values, inverse = np.unique(target, return_inverse=True)
+    if len(values) > MAX_STRATA or len(values) < 2:
+        return np.sort(rng.choice(len(target), size, replace=False))
+    #proportional allocation, with at least one row of every class
+    counts = np.bincount(inverse)
+    quotas = np.maximum(1, np.floor(counts * size / len(target)).astype(int))
+    while quotas.sum() > size:
+        quotas[np.argmax(quotas)] -= 1
+    remainders = counts * size / len(target) - quotas
+    for i in np.argsort(-remainders)[:max(0, size - quotas.sum())]:
+        quotas[i] += 1
+    indices = [rng.choice(np.flatnonzero(inverse==i), min(q, c), replace=False) for i, (q, c) in enumerate(zip(quotas, counts))]
+    return np.sort(np.concatenate(indices))
+
+
+def _summarize(data, method, size, seed):
+    import shap
+    n = len(data.features)
+    if method=="full" or n <= size:
+        return Background(data.feature_frame(), "full", n, n)
+    if method=="kmeans" and not data.features.dtype.hasobject:
+        summary = shap.kmeans(np.asarray(data.features, dtype=np.float64), size)
+        return Background(summary, "kmeans", len(summary.data), n, weights=summary.weights)
+    #k-means centroids are meaningless for categorical features, so mixed data falls back to sampling
+    indices = _stratified_indices(data.target, size, seed)
+    return Background(data.feature_frame().iloc[indices], "sample", len(indices), n, seed=seed)
+
+
+def get_background(data, params_json=None):
+    #params_json may override the configured method ('background_method') and row budget ('background_size')
+    params_json = params_json or {}
+    method = params_json.get("background_method", config.SHAP_BACKGROUND_METHOD)
+    size = int(params_json.get("background_size", config.SHAP_BACKGROUND_SIZE))
+    seed = int(params_json.get("background_seed", 0))
+    if method not in METHODS:
+        raise Exception("Unknown background method '" + str(method) + "'. Use one of: " + ", ".join(METHODS) + ".")
+    if size < 1:
+        raise Exception("The background size must be a positive integer.")
+    if method=="full":
+        size = len(data.features)
+    return data.cached(("background", method, size, seed), lambda: _summarize(data, method, size, seed))
@@ -0,0 +1,144 @@
+import time
+import queue
+import threading
+import numpy as np
+
+## Dynamic micro-batching: concurrent calls to a prediction function are queued, merged into a single
+## batch (up to max_batch_size rows, or whatever arrived within max_wait seconds), predicted with one call
+## and the outputs are split back to each caller.
+
+
+class _Request:
+
+    def __init__(self, X, context):
+        self.X = X
+        self.context = context
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+
+    def __init__(self, func, max_batch_size=256, max_wait=0.005, name="micro-batcher", context=None, observe=None):
+        #context: function called in the thread of each queued call, e.g. to capture the request it belongs to
+        #observe: function called on the batcher thread after each batch as observe(calls, start_ns, seconds),
+        #calls being the (context, rows) of the calls of the batch
+        self.func = func
+        self.context = context
+        self.observe = observe
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.batches = 0
+        self.rows = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def __call__(self, X):
+        X = np.asarray(X)
+        if len(X) >= self.max_batch_size:
+            #nothing to gain from waiting for other requests
+            with self._lock:
+                self.calls += 1
+                self.batches += 1
+                self.rows += len(X)
+            return self.func(X)
+        request = _Request(X, self.context() if self.context!=None else None)
+        with self._lock:
+            if self._closed:
+                return self.func(X)
+            self._queue.put(request)
+        request.done.wait()
+        if request.error!=None:
+            raise request.error
+        return request.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_rows": self.rows / self.batches if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait": self.max_wait,
+            }
+
+    def close(self):
+        #stops the thread once the queued calls are predicted, the later calls are predicted directly
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+
+    def detach(self):
+        #in a forked process the thread of the batcher does not exist, the calls are predicted directly
+        self._lock = threading.Lock()
+        self._closed = True
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        if requests[0]==None:
+            return None
+        rows = len(requests[0].X)
+        deadline = time.perf_counter() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request==None:
+                #predicted with the next batch, after which the thread stops
+                self._queue.put(None)
+                break
+            requests.append(request)
+            rows += len(request.X)
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            if requests==None:
+                return
+            #only inputs with the same row shape and type can be stacked together
+            groups = {}
+            for request in requests:
+                groups.setdefault((request.X.shape[1:], request.X.dtype.str), []).append(request)
+            for group in groups.values():
+                self._predict(group)
+
+    def _predict(self, group):
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        try:
+            if len(group)==1:
+                outputs = [np.asarray(self.func(group[0].X))]
+            else:
+                X = np.concatenate([request.X for request in group], axis=0)
+                Y = np.asarray(self.func(X))
+                outputs = np.split(Y, np.cumsum([len(request.X) for request in group])[:-1])
+            for request, output in zip(group, outputs):
+                request.result = output
+        except Exception as e:
+            for request in group:
+                request.error = e
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.calls += len(group)
+                self.batches += 1
+                self.rows += sum(len(request.X) for request in group)
+            if self.observe!=None:
+                try:
+                    self.observe([(request.context, len(request.X)) for request in group], start_ns, seconds)
+                except Exception as e:
+                    print("Could not record the batch: " + str(e))
+            for request in group:
+                request.done.set()
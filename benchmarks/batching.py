@@ -0,0 +1,198 @@
+"""Benchmark of the micro-batching of predictions (PREDICT_BATCHING) under concurrent load.
+
+The same case of the explainer suite (see explainers.py) is run twice, each time in its own process: once with
+PREDICT_BATCHING=0 and once with PREDICT_BATCHING=1. In each run, --threads threads post --requests explanation
+requests each through the Flask test client, every request with its own instance, so the requests are computed
+concurrently. The result and prediction caches are disabled, so both runs send the same rows to the model.
+
+The default case, image LIME, predicts its 1000 perturbed images in calls of 10, through the 'url' parameter
+of a stand-in prediction server (see standins.py), so each call pays an HTTP round trip. The benchmark reports
+the throughput and latency of the explanations, and the number of calls received by the model, for both runs.
+
+Usage (from the root of the repository):
+    python benchmarks/batching.py [--case Images/LIME:RESNETPT50] [--threads 8] [--requests 2]
+                                  [--max-size 512] [--max-wait 0.002] [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import traceback
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from explainers import ROOT, MODELS, CASES, RESULT_PREFIX, build_form, prepare_model_folder
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--case", default="Images/LIME:RESNETPT50", help="name of a case of explainers.py")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=2, help="requests of each client")
+    parser.add_argument("--max-size", type=int, default=512, help="PREDICT_BATCH_MAX_SIZE of the batched run")
+    parser.add_argument("--max-wait", type=float, default=0.002, help="PREDICT_BATCH_MAX_WAIT of the batched run")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds after which a run is stopped")
+    parser.add_argument("--output", help="file where the results are saved as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--model-folder", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else None
+
+
+## Child process: one run
+
+def run(c, model_folder, threads, requests):
+    work = tempfile.mkdtemp(prefix="benchmark")
+    os.environ["RESULT_CACHE"] = "0"
+    os.environ["PREDICT_CACHE"] = "0"
+    os.environ["METRICS"] = "1"
+    os.environ["DATA_CACHE_FOLDER"] = os.path.join(work, "datacache")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    sys.argv = ["app.py", model_folder, os.path.join(work, "uploads")]
+    stand_in = None
+    try:
+        import app
+        import metrics
+        import predictbatching
+        from standins import StandIn
+        finished = []
+        metrics.register_listener(finished.append)
+        client = app.app.test_client()
+        if c.stand_in!=None:
+            kind, value = c.stand_in
+            stand_in = StandIn(kind, MODELS, value) if kind=="model" else StandIn(kind, n_classes=value)
+        url = stand_in.url if stand_in!=None else None
+
+        #a first request loads the model, the data and the explainer
+        response = client.post(c.route, data=build_form(c, model_folder, url))
+        if response.status_code!=200:
+            raise Exception("Status " + str(response.status_code) + ": " + response.get_data(as_text=True)[:500])
+        del finished[:]
+        before = stand_in.stats()["latency"] if stand_in!=None else None
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def client_thread(index):
+            #the test client is not shared between threads
+            own_client = app.app.test_client()
+            for i in range(requests):
+                form = build_form(c, model_folder, url, variant=1 + index * requests + i)
+                start = time.perf_counter()
+                response = own_client.post(c.route, data=form)
+                seconds = time.perf_counter() - start
+                with lock:
+                    if response.status_code==200:
+                        latencies.append(seconds)
+                    else:
+                        errors.append(response.get_data(as_text=True)[:200])
+
+        workers = [threading.Thread(target=client_thread, args=(i,)) for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        explained = [m for m in finished if m.labels["endpoint"]==c.route]
+        result = {
+            "status": "ok",
+            "requests": len(latencies),
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "seconds": elapsed,
+            "throughput": len(latencies) / elapsed if elapsed > 0 else None,
+            "mean_seconds": sum(latencies) / len(latencies) if latencies else None,
+            "p50_seconds": _percentile(latencies, 0.5),
+            "p95_seconds": _percentile(latencies, 0.95),
+            "predict_calls": sum(m.predict_calls for m in explained),
+            "predict_rows": sum(m.predict_rows for m in explained),
+            "batching": predictbatching.stats(),
+        }
+        if stand_in!=None:
+            after = stand_in.stats()["latency"]
+            result["model_calls"] = after["requests"] - before["requests"]
+            result["model_rows"] = after["rows"] - before["rows"]
+        return result
+    except Exception as e:
+        return {"status": "error", "error": (type(e).__name__ + ": " + str(e))[:1000], "traceback": traceback.format_exc()[-4000:]}
+    finally:
+        if stand_in!=None:
+            stand_in.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+## Parent process
+
+def run_in_child(args, model_folder, batching):
+    env = dict(os.environ, PREDICT_BATCHING="1" if batching else "0",
+               PREDICT_BATCH_MAX_SIZE=str(args.max_size), PREDICT_BATCH_MAX_WAIT=str(args.max_wait))
+    command = [sys.executable, os.path.abspath(__file__), "--child", args.case, "--model-folder", model_folder,
+               "--threads", str(args.threads), "--requests", str(args.requests)]
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=args.timeout,
+                                 universal_newlines=True, env=env)
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "error": "timed out after " + str(args.timeout) + " seconds"}
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {"status": "error", "error": "the run exited with code " + str(process.returncode), "traceback": process.stderr[-4000:]}
+
+
+def _format(value, pattern="%.3f"):
+    return pattern % value if value!=None else "-"
+
+
+def main():
+    args = parse_args()
+    cases = {c.name: c for c in CASES}
+    if args.case not in cases:
+        sys.exit("Unknown case " + args.case + ", see python benchmarks/explainers.py --list")
+    if args.child:
+        result = run(cases[args.child], args.model_folder, args.threads, args.requests)
+        print(RESULT_PREFIX + json.dumps(result, default=str))
+        return
+
+    model_folder = tempfile.mkdtemp(prefix="benchmark-models")
+    try:
+        prepare_model_folder(model_folder)
+        print("%s: %d threads x %d requests" % (args.case, args.threads, args.requests))
+        results = {}
+        for name, batching in (("unbatched", False), ("batched", True)):
+            result = results[name] = run_in_child(args, model_folder, batching)
+            if result["status"]!="ok":
+                print("%-10s %s" % (name, result["error"]))
+                if "traceback" in result:
+                    print(result["traceback"])
+                continue
+            print("%-10s %6s req/s  mean %7ss  p95 %7ss  model calls %6s  rows %8s  errors %d" % (
+                name, _format(result["throughput"], "%.2f"), _format(result["mean_seconds"]),
+                _format(result["p95_seconds"]), result.get("model_calls", result["predict_calls"]),
+                result.get("model_rows", result["predict_rows"]), result["errors"]))
+    finally:
+        shutil.rmtree(model_folder, ignore_errors=True)
+
+    if all(r["status"]=="ok" and r["throughput"] for r in results.values()):
+        gain = results["batched"]["throughput"] / results["unbatched"]["throughput"]
+        results["throughput_gain"] = gain
+        print("throughput gain: x%.2f (mean batch of %.1f rows)" % (gain, results["batched"]["batching"]["mean_batch_rows"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"case": args.case, "threads": args.threads, "requests": args.requests,
+                       "max_size": args.max_size, "max_wait": args.max_wait, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""Benchmark suite of the explainers against the bundled models.
+
+Every case posts one explanation request to an explainer resource through the Flask test client and views its
+plot, first cold and then --repeat times warm (the result cache is disabled, so every request is computed).
+Each case runs in its own process, so the imports, the caches and the peak memory of a case do not leak into
+the next one. The models without a model file (images and text) and the '<id>_URL' copies of the tabular
+models are predicted through the 'url' parameter by a local stand-in prediction server (see standins.py).
+
+For each case the suite records the wall time of the requests, the time of each stage of the request and the
+calls to the prediction function made in each stage (from metrics.py), and the peak RSS of the process.
+The results are saved as JSON, and compared with a previous results file given with --baseline: a case
+regresses when its time, memory or prediction calls grow by more than --threshold.
+
+Cases whose dependencies are not installed (e.g. alibi, dice_ml, tensorflow, torch) are reported as skipped.
+
+Usage (from the root of the repository):
+    python benchmarks/explainers.py [--cases 'Tabular/*SHAP*'] [--repeat 3] [--output results.json]
+                                    [--baseline previous.json] [--threshold 0.25]
+    python benchmarks/explainers.py --list
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import argparse
+import importlib.util
+import platform
+import tempfile
+import traceback
+import subprocess
+from collections import namedtuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS = os.path.join(ROOT, "Models")
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+#inputs: 'instance' (first row of the training data), 'instances' (first rows), 'dataset' (no instance),
+#'features' (instance built from the feature ranges of the model description), 'image', 'grayscale' or 'text'
+#stand_in: None (model file), ('model', <id of the model served>), ('image', <classes>) or ('text', <classes>)
+Case = namedtuple("Case", ["name", "route", "model", "inputs", "params", "stand_in"])
+
+
+def case(route, model, inputs, params=None, stand_in=None):
+    return Case(route.strip("/") + ":" + model, route, model, inputs, params or {}, stand_in)
+
+
+CASES = [
+    case("/Tabular/TreeSHAPLocal", "XGBTCENSUS", "instance"),
+    case("/Tabular/TreeSHAPLocal", "CERVCANCER", "instance"),
+    case("/Tabular/TreeSHAPLocal", "PSYCHOLOGY", "instance"),
+    case("/Tabular/TreeSHAPGlobal", "XGBTCENSUS", "dataset"),
+    case("/Tabular/TreeSHAPLocalBatch", "XGBTCENSUS", "instances"),
+    case("/Tabular/KernelSHAPLocal", "XGBTCENSUS", "instance"),
+    case("/Tabular/KernelSHAPLocal", "XGBTCENSUS_URL", "instance", stand_in=("model", "XGBTCENSUS")),
+    case("/Tabular/KernelSHAPGlobal", "XGBTCENSUS", "dataset", {"background_method": "kmeans", "background_size": 20}),
+    case("/Tabular/KernelSHAPGlobal", "CERVCANCER_URL", "dataset", {"background_method": "kmeans", "background_size": 20}, stand_in=("model", "CERVCANCER")),
+    case("/Tabular/KernelSHAPLocalBatch", "XGBTCENSUS", "instances"),
+    case("/Tabular/LIME", "XGBTCENSUS", "instance", {"seed": 0}),
+    case("/Tabular/LIME", "CERVCANCER", "instance", {"seed": 0}),
+    case("/Tabular/LIME", "PSYCHOLOGY", "instance", {"seed": 0}),
+    case("/Tabular/LIME", "XGBTCENSUS_URL", "instance", {"seed": 0}, stand_in=("model", "XGBTCENSUS")),
+    case("/Tabular/LIMEBatch", "XGBTCENSUS", "instances"),
+    case("/Tabular/Anchors", "CERVCANCER", "instance", {"seed": 0}),
+    case("/Tabular/AnchorsBatch", "CERVCANCER", "instances"),
+    case("/Tabular/ALE", "XGBTCENSUS", "dataset"),
+    case("/Tabular/Importance", "XGBTCENSUS", "dataset"),
+    case("/Tabular/DicePublic", "CERVCANCER", "instance"),
+    case("/Tabular/DicePrivate", "INCOMETF00", "features"),
+    case("/Tabular/DeepSHAPLocal", "TITANICTFW", "instance"),
+    case("/Tabular/DeepSHAPGlobal", "TITANICTFW", "dataset"),
+    case("/Tabular/DeepSHAPLocalBatch", "TITANICTFW", "instances"),
+    case("/Images/LIME", "RESNETPT50", "image", stand_in=("image", 10)),
+    case("/Images/Anchors", "RESNETPT50", "image", stand_in=("image", 10)),
+    case("/Images/Counterfactuals", "FASHION000", "grayscale", stand_in=("image", 10)),
+    case("/Images/GradCamTorch", "RESNETPT50", "image"),
+    case("/Text/LIME", "NEWSGROUPS", "text", stand_in=("text", 20)),
+]
+
+BATCH_SIZE = 8
+TEXT = ("The new graphics card renders the game at a higher frame rate, but the driver crashes when the "
+        "window is resized. Has anyone found a fix for this on the mac or should I go back to the old one?")
+
+#regressions smaller than these are considered noise whatever the threshold
+MIN_SECONDS = 0.05
+MIN_RSS_MB = 20
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cases", action="append", help="pattern of the case names to run, e.g. 'Tabular/LIME*' (can be repeated)")
+    parser.add_argument("--repeat", type=int, default=3, help="warm requests after the first one")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds after which a case is stopped")
+    parser.add_argument("--output", help="results file (defaults to benchmarks/results/explainers-<date>.json)")
+    parser.add_argument("--baseline", help="results file of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative growth above which a case regresses")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--model-folder", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+## Model folder
+
+def prepare_model_folder(folder):
+    #the bundled models, plus the '<id>_URL' copies of the models served by stand-ins: their description
+    #and training data, without the model file
+    for name in os.listdir(MODELS):
+        _link(os.path.join(MODELS, name), os.path.join(folder, name))
+    for c in CASES:
+        if c.stand_in!=None and c.stand_in[0]=="model" and not os.path.exists(os.path.join(folder, c.model)):
+            source = c.stand_in[1]
+            os.makedirs(os.path.join(folder, c.model))
+            for suffix in (".json", "_data.pkl"):
+                if os.path.exists(os.path.join(MODELS, source, source + suffix)):
+                    _link(os.path.join(MODELS, source, source + suffix), os.path.join(folder, c.model, c.model + suffix))
+
+
+def _link(source, target):
+    try:
+        os.symlink(source, target)
+    except OSError:
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy(source, target)
+
+
+## Child process: runs one case
+
+def build_form(c, model_folder, url, variant=0):
+    #variant: index of the instance (row of the training data or seed of the image) used in the request
+    import numpy as np
+    form = {"id": c.model}
+    if c.inputs in ("instance", "instances"):
+        from datacache import get_training_data
+        data = get_training_data(c.model, model_folder)
+        if data==None:
+            raise Exception("The model " + c.model + " has no training data.")
+        start = variant * BATCH_SIZE % max(1, len(data.features) - BATCH_SIZE + 1) if c.inputs=="instances" else variant % len(data.features)
+        rows = data.feature_frame().iloc[start:start + BATCH_SIZE].values.tolist()
+        form[c.inputs] = json.dumps(rows[0] if c.inputs=="instance" else rows)
+    elif c.inputs=="features":
+        with open(os.path.join(model_folder, c.model, c.model + ".json")) as f:
+            features = json.load(f)["features"]
+        form["instance"] = json.dumps([values[0] for values in features.values()])
+    elif c.inputs in ("image", "grayscale"):
+        shape = (64, 64, 3) if c.inputs=="image" else (28, 28)
+        form["instance"] = json.dumps(np.random.RandomState(variant).randint(0, 256, shape).tolist())
+    elif c.inputs=="text":
+        form["instance"] = TEXT
+    if c.params:
+        form["params"] = json.dumps(c.params)
+    if url!=None:
+        form["url"] = url
+    return form
+
+
+def _summary(request_metrics):
+    if request_metrics==None:
+        return {}
+    return {
+        "server_seconds": request_metrics.seconds,
+        "stages": dict(request_metrics.stages),
+        "predict_calls": request_metrics.predict_calls,
+        "predict_rows": request_metrics.predict_rows,
+        "predicts_by_stage": {k: {"calls": v[0], "rows": v[1]} for k, v in request_metrics.predicts_by_stage.items()},
+    }
+
+
+def _peak_rss_mb(who):
+    import resource
+    peak = resource.getrusage(who).ru_maxrss
+    #kilobytes on Linux, bytes on macOS
+    return peak / 1024**2 if sys.platform=="darwin" else peak / 1024
+
+
+def run_case(c, model_folder, repeat):
+    import resource
+    work = tempfile.mkdtemp(prefix="benchmark")
+    os.environ["RESULT_CACHE"] = "0"
+    os.environ["METRICS"] = "1"
+    os.environ["DATA_CACHE_FOLDER"] = os.path.join(work, "datacache")
+    os.environ.setdefault("SCREENSHOT_RENDERER", "fast")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    sys.argv = ["app.py", model_folder, os.path.join(work, "uploads")]
+    stand_in = None
+    try:
+        import app
+        import metrics
+        from standins import StandIn
+        #the exceptions of the explainers reach the benchmark instead of becoming a 500 response
+        app.app.config["PROPAGATE_EXCEPTIONS"] = True
+        finished = []
+        metrics.register_listener(finished.append)
+        client = app.app.test_client()
+        if c.stand_in!=None:
+            kind, value = c.stand_in
+            if kind=="model":
+                stand_in = StandIn("model", MODELS, value)
+            else:
+                stand_in = StandIn(kind, n_classes=value)
+        form = build_form(c, model_folder, stand_in.url if stand_in!=None else None)
+        startup_rss = _peak_rss_mb(resource.RUSAGE_SELF)
+
+        runs = []
+        for _ in range(repeat + 1):
+            del finished[:]
+            start = time.perf_counter()
+            response = client.post(c.route, data=form)
+            seconds = time.perf_counter() - start
+            if response.status_code!=200:
+                raise Exception("Status " + str(response.status_code) + ": " + response.get_data(as_text=True)[:500])
+            body = response.get_json(silent=True) or {}
+            view_seconds = None
+            if isinstance(body, dict) and isinstance(body.get("plot_png"), str):
+                start = time.perf_counter()
+                view = client.get("/ViewExplanation/" + body["plot_png"].rsplit("/", 1)[1], headers={"Accept": "image/png"})
+                view_seconds = time.perf_counter() - start
+                if view.status_code!=200:
+                    raise Exception("The plot could not be viewed (status " + str(view.status_code) + ")")
+            explained = next((m for m in finished if m.labels["endpoint"]==c.route), None)
+            viewed = next((m for m in finished if m.labels["endpoint"]=="/ViewExplanation"), None)
+            run = dict(seconds=seconds, view_seconds=view_seconds, **_summary(explained))
+            if viewed!=None:
+                run["view_stages"] = dict(viewed.stages)
+            runs.append(run)
+
+        result = {
+            "status": "ok",
+            "cold": runs[0],
+            "warm": _warm_summary(runs[1:]) if len(runs) > 1 else None,
+            "startup_rss_mb": startup_rss,
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+        if stand_in!=None:
+            result["stand_in"] = stand_in.stats()
+        return result
+    except ImportError as e:
+        if e.name!=None and importlib.util.find_spec(e.name.split(".")[0])==None:
+            return {"status": "skipped", "error": "missing dependency: " + str(e)}
+        return {"status": "error", "error": "ImportError: " + str(e), "traceback": traceback.format_exc()[-4000:]}
+    except Exception as e:
+        return {"status": "error", "error": (type(e).__name__ + ": " + str(e))[:1000], "traceback": traceback.format_exc()[-4000:]}
+    finally:
+        if stand_in!=None:
+            stand_in.stop()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def _median(values):
+    values = sorted(v for v in values if v!=None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def _warm_summary(runs):
+    stages = sorted(set(s for run in runs for s in run.get("stages", {})))
+    return {
+        "seconds": _median([run["seconds"] for run in runs]),
+        "min_seconds": min(run["seconds"] for run in runs),
+        "view_seconds": _median([run["view_seconds"] for run in runs]),
+        "stages": {s: _median([run.get("stages", {}).get(s, 0.0) for run in runs]) for s in stages},
+        "predict_calls": _median([run.get("predict_calls") for run in runs]),
+        "predict_rows": _median([run.get("predict_rows") for run in runs]),
+        "predicts_by_stage": runs[-1].get("predicts_by_stage", {}),
+        "runs": [run["seconds"] for run in runs],
+    }
+
+
+## Parent process
+
+def run_in_child(c, model_folder, repeat, timeout):
+    command = [sys.executable, os.path.abspath(__file__), "--child", c.name, "--model-folder", model_folder, "--repeat", str(repeat)]
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        return {"status": "error", "error": "timed out after " + str(timeout) + " seconds"}
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {"status": "error", "error": "the case exited with code " + str(process.returncode), "traceback": process.stderr[-4000:]}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _format(value, pattern="%.3f"):
+    return pattern % value if value!=None else "-"
+
+
+def print_results(results):
+    print("%-45s %-8s %9s %9s %9s %8s %10s %9s" % ("case", "status", "cold s", "warm s", "view s", "predicts", "rows", "peak MB"))
+    for name, r in results.items():
+        warm = r.get("warm") or {}
+        cold = r.get("cold") or {}
+        print("%-45s %-8s %9s %9s %9s %8s %10s %9s" % (name, r["status"], _format(cold.get("seconds")), _format(warm.get("seconds")),
+                                                      _format(warm.get("view_seconds")), _format(warm.get("predict_calls"), "%d"),
+                                                      _format(warm.get("predict_rows"), "%d"), _format(r.get("peak_rss_mb"), "%.0f")))
+        if r["status"]!="ok":
+            print("    " + r["error"].splitlines()[0][:150])
+
+
+def compare(results, baseline, threshold):
+    #returns the list of regressions (case, measure, baseline value, current value)
+    measures = [("cold seconds", lambda r: r["cold"]["seconds"], MIN_SECONDS),
+                ("warm seconds", lambda r: (r.get("warm") or {}).get("seconds"), MIN_SECONDS),
+                ("view seconds", lambda r: (r.get("warm") or {}).get("view_seconds"), MIN_SECONDS),
+                ("predict calls", lambda r: (r.get("warm") or r["cold"]).get("predict_calls"), 0),
+                ("predict rows", lambda r: (r.get("warm") or r["cold"]).get("predict_rows"), 0),
+                ("peak RSS MB", lambda r: r["peak_rss_mb"], MIN_RSS_MB)]
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous==None or previous["status"]!="ok":
+            continue
+        if current["status"]!="ok":
+            regressions.append((name, "status", previous["status"], current["status"]))
+            continue
+        for measure, value, minimum in measures:
+            before, after = value(previous), value(current)
+            if before!=None and after!=None and after > before * (1 + threshold) and after - before > minimum:
+                regressions.append((name, measure, before, after))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    cases = {c.name: c for c in CASES}
+    if args.child:
+        result = run_case(cases[args.child], args.model_folder, args.repeat)
+        print(RESULT_PREFIX + json.dumps(result))
+        return
+
+    selected = [c for c in CASES if not args.cases or any(fnmatch.fnmatch(c.name, p) for p in args.cases)]
+    if args.list:
+        for c in selected:
+            print(c.name + ("  (url stand-in)" if c.stand_in!=None else ""))
+        return
+    if not selected:
+        sys.exit("No case matches " + ", ".join(args.cases))
+
+    model_folder = tempfile.mkdtemp(prefix="benchmark_models")
+    try:
+        prepare_model_folder(model_folder)
+        results = {}
+        for c in selected:
+            start = time.time()
+            results[c.name] = run_in_child(c, model_folder, args.repeat, args.timeout)
+            print("%-45s %-8s (%.1f s)" % (c.name, results[c.name]["status"], time.time() - start), flush=True)
+    finally:
+        shutil.rmtree(model_folder, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "cases": results,
+    }
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", "explainers-" + time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print()
+    print_results(results)
+    print("\nresults saved to " + output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["cases"], args.threshold)
+        print("\ncompared with " + args.baseline + " (commit " + str(baseline.get("commit")) + ", threshold " + str(args.threshold) + ")")
+        for name, measure, before, after in regressions:
+            print("  REGRESSION %-45s %-14s %s -> %s" % (name, measure, before, after))
+        if regressions:
+            sys.exit(1)
+        print("  no regressions")
+
+
+if __name__ == "__main__":
+    main()
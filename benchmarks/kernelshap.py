@@ -0,0 +1,101 @@
+"""Benchmark of the shared pool of KernelSHAP worker processes (see shapparallel.py).
+
+The Shapley values of the first --rows rows of the training data of a tabular model are computed by --requests
+concurrent threads, as concurrent /Tabular/KernelSHAPGlobal requests would, first in the calling threads
+(n_jobs=1) and then with the shared pool of --workers worker processes. The background is summarized with
+k-means to --background rows. The first pooled round, which starts the pool and loads the payloads of the
+workers, is reported separately from the warm rounds.
+
+The benchmark reports the wall time of each mode, the speedup of the pool and the number of worker processes
+alive at the end, which stays at --workers whatever the number of concurrent requests.
+
+Usage (from the root of the repository):
+    python benchmarks/kernelshap.py [--model XGBTCENSUS] [--rows 64] [--requests 2] [--workers 4]
+                                    [--background 20] [--repeat 2] [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default="XGBTCENSUS", help="id of a tabular model of the Models folder")
+    parser.add_argument("--rows", type=int, default=64, help="rows explained by each request")
+    parser.add_argument("--requests", type=int, default=2, help="concurrent requests")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes of the shared pool")
+    parser.add_argument("--background", type=int, default=20, help="rows of the k-means background")
+    parser.add_argument("--repeat", type=int, default=2, help="warm rounds of each mode")
+    parser.add_argument("--output", help="file where the results are saved as JSON")
+    return parser.parse_args()
+
+
+def run_round(predict_func, background, X, requests, n_jobs):
+    from shapparallel import kernel_shap_values
+    errors = []
+
+    def request():
+        try:
+            kernel_shap_values(predict_func, background, X, {}, n_jobs=n_jobs)
+        except Exception as e:
+            errors.append(type(e).__name__ + ": " + str(e))
+
+    threads = [threading.Thread(target=request) for _ in range(requests)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise Exception(errors[0])
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    os.environ["SHAP_PARALLEL_WORKERS"] = str(args.workers)
+    os.environ["PREDICT_CACHE"] = "0"
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    warnings.filterwarnings("ignore")
+    import shapparallel
+    from datacache import get_training_data
+    from modelregistry import get_model, get_predict_function
+    from background import get_background
+
+    data = get_training_data(args.model, "Models")
+    predict_func = get_predict_function(get_model(args.model, "Models"), None)
+    background = get_background(data, {"background_method": "kmeans", "background_size": args.background}).data
+    X = data.feature_frame().iloc[:args.rows]
+    print("%s: %d requests x %d rows, %d workers, %d CPUs" % (args.model, args.requests, len(X), args.workers, os.cpu_count()))
+
+    results = {"serial": [], "pool_cold": None, "pool": []}
+    for _ in range(args.repeat):
+        results["serial"].append(run_round(predict_func, background, X, args.requests, 1))
+    results["pool_cold"] = run_round(predict_func, background, X, args.requests, None)
+    for _ in range(args.repeat):
+        results["pool"].append(run_round(predict_func, background, X, args.requests, None))
+    results["worker_processes"] = len(shapparallel._executor._processes)
+    shapparallel.shutdown()
+
+    serial = min(results["serial"])
+    pool = min(results["pool"])
+    results["speedup"] = serial / pool
+    print("serial      %7.2fs" % serial)
+    print("pool (cold) %7.2fs" % results["pool_cold"])
+    print("pool        %7.2fs" % pool)
+    print("speedup: x%.2f, %d worker processes" % (results["speedup"], results["worker_processes"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"model": args.model, "rows": len(X), "requests": args.requests, "workers": args.workers,
+                       "cpus": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""HTTP load generator replaying a mix of explanation requests against a running server.
+
+Requests are built from the bundled models with the cases of the benchmark suite (see explainers.py) and sent
+at a target rate (open loop: a slow server does not slow down the arrivals, so queueing shows in the
+latencies, which are measured from the moment each request was due). The report gives the throughput, the
+error rate and the p50/p95/p99 latencies of each request type, and the memory of the server over time: read
+from the process tree of the server when it is started by the load generator (--start), or from the
+process_resident_memory_bytes gauge of its /metrics endpoint otherwise.
+
+The mix is a comma-separated list of <case>=<weight>, e.g. the default
+    Tabular/TreeSHAPLocal:XGBTCENSUS=20,Tabular/LIME:XGBTCENSUS=5,Tabular/KernelSHAPGlobal:XGBTCENSUS=1,Images/LIME:RESNETPT50=1
+The instances vary from request to request (rows of the training data, random images), so the result cache of
+the server is only hit when an instance comes round again. The '<id>_URL' cases need a server started with --start,
+whose model folder includes them.
+
+Usage (from the root of the repository):
+    python benchmarks/loadgen.py --start "python app.py {models} {uploads}" [--rate 5] [--duration 60]
+    python benchmarks/loadgen.py --start "python serve.py {models} {uploads} --workers=4" [--rate 5] [--duration 60]
+    python benchmarks/loadgen.py --url http://127.0.0.1:5000 [--mix ...] [--concurrency 32] [--output report.json]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import random
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from explainers import ROOT, CASES, build_form, prepare_model_folder
+from standins import StandIn
+
+DEFAULT_MIX = "Tabular/TreeSHAPLocal:XGBTCENSUS=20,Tabular/LIME:XGBTCENSUS=5,Tabular/KernelSHAPGlobal:XGBTCENSUS=1,Images/LIME:RESNETPT50=1"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="base URL of the server")
+    parser.add_argument("--start", help="command starting the server, with the {models} and {uploads} placeholders, e.g. \"python app.py {models} {uploads}\"")
+    parser.add_argument("--server-log", help="file receiving the output of the server started with --start")
+    parser.add_argument("--models", default=os.path.join(ROOT, "Models"), help="model folder of the server (ignored with --start)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma-separated <case>=<weight> (see python benchmarks/explainers.py --list)")
+    parser.add_argument("--rate", type=float, default=5, help="requests per second")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times instead of a constant rate")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of load")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds at the start whose requests are not included in the statistics")
+    parser.add_argument("--concurrency", type=int, default=32, help="maximum requests in flight")
+    parser.add_argument("--timeout", type=float, default=300, help="timeout of each request in seconds")
+    parser.add_argument("--view", action="store_true", help="also download the plot of each response, which renders it")
+    parser.add_argument("--variants", type=int, default=64, help="distinct instances per request type")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between two progress lines and memory samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file for the report and the time series")
+    return parser.parse_args()
+
+
+def parse_mix(mix):
+    cases = {c.name: c for c in CASES}
+    weights = []
+    for item in mix.split(","):
+        name, _, weight = item.strip().rpartition("=")
+        if name not in cases:
+            raise SystemExit("Unknown case '" + name + "'. The cases are listed by: python benchmarks/explainers.py --list")
+        weights.append((cases[name], float(weight)))
+    return weights
+
+
+## Server memory
+
+def _proc_rss(pid):
+    try:
+        with open("/proc/" + str(pid) + "/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _proc_children(pid):
+    children = []
+    try:
+        for task in os.listdir("/proc/" + str(pid) + "/task"):
+            with open("/proc/" + str(pid) + "/task/" + task + "/children") as f:
+                children.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_rss(pid):
+    #resident memory of the process and its descendants (worker processes), in bytes
+    total = 0
+    pending = [pid]
+    while pending:
+        p = pending.pop()
+        total += _proc_rss(p)
+        pending.extend(_proc_children(p))
+    return total
+
+
+def scrape_rss(session, url):
+    #sum of the process_resident_memory_bytes gauges of /metrics, None if the server does not expose them
+    try:
+        text = session.get(url.rstrip("/") + "/metrics", timeout=10).text
+    except Exception:
+        return None
+    values = [float(line.split()[-1]) for line in text.splitlines() if line.startswith("process_resident_memory_bytes")]
+    return sum(values) if values else None
+
+
+## Load
+
+class Recorder:
+
+    def __init__(self):
+        self.results = []
+        self._lock = threading.Lock()
+
+    def add(self, name, due, latency, status, error):
+        with self._lock:
+            self.results.append((name, due, latency, status, error))
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.results)
+
+
+def _percentiles(latencies):
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+    return {"p50": percentile(50), "p95": percentile(95), "p99": percentile(99), "max": latencies[-1],
+            "mean": sum(latencies) / len(latencies)}
+
+
+def summarize(results, seconds):
+    summary = {}
+    groups = defaultdict(list)
+    for result in results:
+        groups[result[0]].append(result)
+        groups["all"].append(result)
+    for name, group in groups.items():
+        errors = [r for r in group if r[4]!=None]
+        summary[name] = dict(requests=len(group), errors=len(errors), error_rate=len(errors) / len(group),
+                             throughput=(len(group) - len(errors)) / seconds,
+                             latency=_percentiles([r[2] for r in group if r[4]==None]))
+        kinds = defaultdict(int)
+        for r in errors:
+            kinds[r[4]] += 1
+        if kinds:
+            summary[name]["error_kinds"] = dict(kinds)
+    return summary
+
+
+def run_load(args, url, requests_by_case, weights, memory):
+    import requests
+    local = threading.local()
+    recorder = Recorder()
+    pending = queue.Queue(maxsize=args.concurrency * 4)
+    rng = random.Random(args.seed)
+    stop = threading.Event()
+    start = time.perf_counter()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def send(c, form, due):
+        s = session()
+        try:
+            response = s.post(url + c.route, data=form, timeout=args.timeout)
+            error = None if response.status_code==200 else "status " + str(response.status_code)
+            if error==None and args.view:
+                body = response.json()
+                if isinstance(body, dict) and isinstance(body.get("plot_png"), str):
+                    view = s.get(url + "/ViewExplanation/" + body["plot_png"].rsplit("/", 1)[1], headers={"Accept": "image/png"}, timeout=args.timeout)
+                    if view.status_code!=200:
+                        error = "view status " + str(view.status_code)
+            status = response.status_code
+        except Exception as e:
+            status, error = None, type(e).__name__
+        recorder.add(c.name, due - start, time.perf_counter() - due, status, error)
+
+    def worker():
+        while True:
+            item = pending.get()
+            if item==None:
+                return
+            send(*item)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for w in workers:
+        w.start()
+
+    def progress():
+        reported = 0
+        while not stop.wait(args.interval):
+            results = recorder.snapshot()
+            window = results[reported:]
+            reported = len(results)
+            rss = memory()
+            elapsed = time.perf_counter() - start
+            latencies = _percentiles([r[2] for r in window if r[4]==None])
+            sample = {"time": elapsed, "completed": len(results), "window_requests": len(window),
+                      "window_errors": sum(1 for r in window if r[4]!=None), "window_p95": latencies.get("p95"), "rss_bytes": rss}
+            series.append(sample)
+            print("%7.1f s  %6d done  %5.1f req/s  %4d errors  p95 %7s s  server RSS %s" % (
+                elapsed, len(results), len(window) / args.interval, sample["window_errors"],
+                "%.3f" % latencies["p95"] if latencies else "-", "%.0f MB" % (rss / 1024**2) if rss!=None else "-"), flush=True)
+
+    series = []
+    reporter = threading.Thread(target=progress, daemon=True)
+    reporter.start()
+
+    #open loop: the requests are queued at their due time whatever the state of the previous ones
+    cases = [c for c, _ in weights]
+    counts = defaultdict(int)
+    due = start
+    while due - start < args.duration:
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        c = rng.choices(cases, [w for _, w in weights])[0]
+        forms = requests_by_case[c.name]
+        pending.put((c, forms[counts[c.name] % len(forms)], due))
+        counts[c.name] += 1
+        due += rng.expovariate(args.rate) if args.poisson else 1 / args.rate
+    for _ in workers:
+        pending.put(None)
+    for w in workers:
+        w.join()
+    stop.set()
+    reporter.join()
+    return recorder.snapshot(), series, time.perf_counter() - start
+
+
+def wait_for_server(url, process, log=None, timeout=300):
+    import requests
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process!=None and process.poll()!=None:
+            if log!=None:
+                log.flush()
+                with open(log.name) as f:
+                    print(f.read()[-4000:])
+            raise SystemExit("The server exited with code " + str(process.returncode))
+        try:
+            requests.get(url + "/Cache", timeout=5)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    raise SystemExit("The server did not answer within " + str(timeout) + " seconds")
+
+
+def main():
+    args = parse_args()
+    weights = parse_mix(args.mix)
+    url = args.url.rstrip("/")
+    work = tempfile.mkdtemp(prefix="loadgen")
+    os.environ.setdefault("DATA_CACHE_FOLDER", os.path.join(work, "datacache"))
+    server = None
+    server_log = None
+    stand_ins = {}
+    try:
+        model_folder = args.models
+        if args.start:
+            #the server gets the bundled models and the '<id>_URL' copies used with the stand-ins
+            model_folder = os.path.join(work, "models")
+            os.makedirs(model_folder)
+            prepare_model_folder(model_folder)
+            command = args.start.format(models=model_folder, uploads=os.path.join(work, "uploads"))
+            server_log = open(args.server_log or os.path.join(work, "server.log"), "w")
+            server = subprocess.Popen(shlex.split(command), cwd=ROOT, stdout=server_log, stderr=subprocess.STDOUT)
+        for c, _ in weights:
+            if c.stand_in!=None and c.stand_in not in stand_ins:
+                kind, value = c.stand_in
+                stand_ins[c.stand_in] = StandIn("model", os.path.join(ROOT, "Models"), value) if kind=="model" else StandIn(kind, n_classes=value)
+
+        requests_by_case = {}
+        for c, _ in weights:
+            stand_in = stand_ins.get(c.stand_in)
+            requests_by_case[c.name] = [build_form(c, model_folder, stand_in.url if stand_in!=None else None, variant)
+                                        for variant in range(args.variants)]
+
+        wait_for_server(url, server, server_log)
+        import requests
+        metrics_session = requests.Session()
+        if server!=None and os.path.isdir("/proc/" + str(server.pid)):
+            memory = lambda: process_tree_rss(server.pid)
+        else:
+            memory = lambda: scrape_rss(metrics_session, url)
+
+        print("%s: %s at %.1f requests/s for %.0f s" % (url, args.mix, args.rate, args.duration), flush=True)
+        results, series, elapsed = run_load(args, url, requests_by_case, weights, memory)
+        measured = [r for r in results if r[1] >= args.warmup]
+        summary = summarize(measured, max(1e-9, elapsed - args.warmup))
+
+        print()
+        print("%-45s %8s %7s %8s %9s %9s %9s %9s" % ("request", "requests", "errors", "req/s", "p50 s", "p95 s", "p99 s", "max s"))
+        for name in sorted(summary, key=lambda n: (n=="all", n)):
+            s = summary[name]
+            latency = s["latency"]
+            print("%-45s %8d %6.1f%% %8.2f %9s %9s %9s %9s" % (name, s["requests"], s["error_rate"] * 100, s["throughput"],
+                                                               *("%.3f" % latency[p] if p in latency else "-" for p in ("p50", "p95", "p99", "max"))))
+            for kind, count in s.get("error_kinds", {}).items():
+                print("    %d x %s" % (count, kind))
+        rss = [sample["rss_bytes"] for sample in series if sample["rss_bytes"]!=None]
+        if rss:
+            print("server RSS: %.0f MB at the start, %.0f MB at the end, %.0f MB at most" % (rss[0] / 1024**2, rss[-1] / 1024**2, max(rss) / 1024**2))
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"url": url, "mix": args.mix, "rate": args.rate, "poisson": args.poisson, "duration": args.duration,
+                           "warmup": args.warmup, "concurrency": args.concurrency, "summary": summary, "series": series}, f, indent=1)
+            print("report saved to " + args.output)
+        if summary.get("all", {}).get("errors"):
+            sys.exit(1)
+    finally:
+        for stand_in in stand_ins.values():
+            stand_in.stop()
+        if server!=None:
+            server.terminate()
+            try:
+                server.wait(30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if server_log!=None:
+            server_log.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
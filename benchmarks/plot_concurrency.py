@@ -0,0 +1,90 @@
+"""Stress test of the plotting endpoints under concurrent requests.
+
+Sends the same explanation requests to several plotting endpoints from many threads at once and checks that
+every request got its own, uncorrupted plot: the PNGs of identical requests must be byte-identical to the one
+rendered by a single request, and no pyplot figure may be left open afterwards.
+
+Usage (from the root of the repository):
+    python benchmarks/plot_concurrency.py [--model XGBTCENSUS] [--threads 8] [--rounds 4] [--lazy]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default="XGBTCENSUS", help="id of a tabular model in the Models folder")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=4, help="requests per endpoint and thread")
+    parser.add_argument("--lazy", action="store_true", help="render the plots when they are viewed instead of in the explanation request")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    #every request must draw its own plot
+    os.environ["RESULT_CACHE"] = "0"
+    os.environ["PLOTS_LAZY"] = "1" if args.lazy else "0"
+    os.environ.setdefault("SCREENSHOT_RENDERER", "fast")
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    upload_folder = tempfile.mkdtemp(prefix="plot_concurrency")
+    sys.argv = ["app.py", "Models", upload_folder]
+    import app
+    import matplotlib.pyplot as plt
+    from datacache import get_training_data
+
+    data = get_training_data(args.model, "Models")
+    instance = json.dumps(data.features[0].tolist())
+    requests = {
+        "TreeSHAPLocal waterfall": ("/Tabular/TreeSHAPLocal", {"id": args.model, "instance": instance}),
+        "TreeSHAPLocal bar": ("/Tabular/TreeSHAPLocal", {"id": args.model, "instance": instance, "params": json.dumps({"plot_type": "bar"})}),
+        "TreeSHAPLocal decision": ("/Tabular/TreeSHAPLocal", {"id": args.model, "instance": instance, "params": json.dumps({"plot_type": "decision"})}),
+        "LIME": ("/Tabular/LIME", {"id": args.model, "instance": instance, "params": json.dumps({"seed": 0})}),
+    }
+    client = app.app.test_client()
+
+    def run(name):
+        route, form = requests[name]
+        response = client.post(route, data=form)
+        if response.status_code!=200:
+            raise Exception(name + " failed with status " + str(response.status_code) + ": " + response.get_data(as_text=True)[:500])
+        url = response.json["plot_png"]
+        view = client.get("/ViewExplanation/" + url.rsplit("/", 1)[1], headers={"Accept": "image/png"})
+        if view.status_code!=200:
+            raise Exception("The plot of " + name + " could not be viewed (status " + str(view.status_code) + ")")
+        return name, view.data
+
+    #reference plots, rendered one request at a time
+    reference = dict(run(name) for name in requests)
+
+    jobs = [name for name in requests for _ in range(args.threads * args.rounds)]
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(run, jobs))
+    elapsed = time.time() - start
+
+    mismatches = {}
+    for name, png in results:
+        if png!=reference[name]:
+            mismatches[name] = mismatches.get(name, 0) + 1
+    open_figures = plt.get_fignums()
+
+    print("%d requests in %.2f s with %d threads (%.1f requests/s), %d threads alive" % (len(jobs), elapsed, args.threads, len(jobs) / elapsed, threading.active_count()))
+    for name in requests:
+        print("  %-24s %d/%d plots identical to the reference" % (name, jobs.count(name) - mismatches.get(name, 0), jobs.count(name)))
+    print("open pyplot figures: %d" % len(open_figures))
+    if mismatches or open_figures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
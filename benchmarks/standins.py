@@ -0,0 +1,118 @@
+"""Local stand-ins for the prediction servers used through the 'url' parameter of the explainers.
+
+Each stand-in is the reference prediction server (predictserver.py) started in its own process on a free
+port of 127.0.0.1, so its memory and CPU are not counted in the process being measured. The prediction
+function is either a model from the model folder, or a deterministic function of the inputs for the bundled
+models that only ship their description (images and text).
+"""
+import os
+import sys
+import json
+import zlib
+import multiprocessing
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def model_predictor(model_folder, model_id):
+    #prediction function of a model file of the model folder, as the explainers would use it
+    from getmodelfiles import get_model_paths
+    from modelregistry import load_model_file
+    model_path, model_info_path, _ = get_model_paths(model_id, model_folder)
+    with open(model_info_path) as f:
+        backend = json.load(f).get("backend")
+    _, predic_func, _ = load_model_file(model_path, backend)
+
+    def predict(X):
+        return np.asarray(predic_func(X))
+    return predict
+
+
+def image_predictor(n_classes, seed=0):
+    #class probabilities computed from the mean and spread of each channel of the images
+    weights = {}
+
+    def predict(X):
+        X = np.asarray(X, dtype=np.float32)
+        X = X.reshape(len(X), -1, X.shape[-1] if X.ndim==4 else 1) / 255
+        features = np.concatenate([X.mean(axis=1), X.std(axis=1)], axis=1)
+        if features.shape[1] not in weights:
+            weights[features.shape[1]] = np.random.RandomState(seed).normal(scale=4, size=(features.shape[1], n_classes))
+        return _softmax(features @ weights[features.shape[1]])
+    return predict
+
+
+def text_predictor(n_classes):
+    #class probabilities computed from the words of the texts, each word voting for a class
+    def predict(X):
+        scores = np.zeros((len(X), n_classes))
+        for i, text in enumerate(X):
+            for word in str(text).lower().split():
+                scores[i, zlib.crc32(word.encode()) % n_classes] += 1
+        return _softmax(scores * 0.5)
+    return predict
+
+
+def _predictor(kind, model_folder, model_id, n_classes):
+    if kind=="model":
+        return model_predictor(model_folder, model_id)
+    if kind=="image":
+        return image_predictor(n_classes)
+    if kind=="text":
+        return text_predictor(n_classes)
+    raise ValueError("Unknown kind of stand-in: " + kind)
+
+
+def _serve(kind, model_folder, model_id, n_classes, max_batch_size, connection):
+    sys.path.insert(0, ROOT)
+    from werkzeug.serving import make_server
+    from predictserver import create_app
+    try:
+        app = create_app(_predictor(kind, model_folder, model_id, n_classes), max_batch_size=max_batch_size)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+    except Exception as e:
+        connection.send(("error", repr(e)))
+        return
+    connection.send(("port", server.server_port))
+    server.serve_forever()
+
+
+class StandIn:
+
+    def __init__(self, kind, model_folder=None, model_id=None, n_classes=10, max_batch_size=256, timeout=120):
+        #kind: 'model' (a model file of model_folder), 'image' or 'text'
+        context = multiprocessing.get_context("spawn")
+        parent, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(kind, model_folder, model_id, n_classes, max_batch_size, child), daemon=True)
+        self.process.start()
+        if not parent.poll(timeout):
+            self.stop()
+            raise Exception("The stand-in prediction server did not start within " + str(timeout) + " seconds.")
+        status, value = parent.recv()
+        if status!="port":
+            self.stop()
+            raise Exception("The stand-in prediction server could not be started: " + value)
+        self.url = "http://127.0.0.1:" + str(value) + "/Predict"
+        self.stats_url = "http://127.0.0.1:" + str(value) + "/Stats"
+
+    def stats(self):
+        import requests
+        return requests.get(self.stats_url, timeout=10).json()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(10)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,35 @@
+from flask_restful import Resource, reqparse
+from modelregistry import registry
+from datacache import data_cache
+from explainercache import explainer_cache
+import predictcache
+import predictbatching
+
+
+class CacheStatus(Resource):
+
+    def __init__(self, result_cache):
+        self.result_cache = result_cache
+
+    def get(self):
+        return {
+            "models": registry.stats(),
+            "explainers": explainer_cache.stats(),
+            "predictions": predictcache.stats(),
+            "batching": predictbatching.stats(),
+            "results": self.result_cache.stats() if self.result_cache!=None else None,
+        }
+
+    def delete(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("id")
+        args = parser.parse_args()
+        _id = args.get("id")
+        if self.result_cache!=None:
+            self.result_cache.invalidate(_id)
+        explainer_cache.invalidate(_id)
+        registry.invalidate(_id)
+        if _id==None:
+            data_cache.invalidate()
+            predictcache.invalidate()
+        return self.get()
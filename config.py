@@ -0,0 +1,206 @@
+import os
+
+## Server configuration. Every setting can be overridden with an environment variable of the same name.
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return float(value)
+
+
+#maximum estimated size (bytes) of the deserialized models kept in memory by the model registry
+MODEL_CACHE_MAX_BYTES = _env_int("MODEL_CACHE_MAX_BYTES", 2 * 1024**3)
+
+#1 memoizes the predictions of each model on tabular rows, so the rows already predicted are not sent to the model again
+PREDICT_CACHE = _env_int("PREDICT_CACHE", 1)==1
+
+#maximum estimated size (bytes) of the cached predictions of each model. The least recently used rows are evicted above it
+PREDICT_CACHE_MAX_BYTES = _env_int("PREDICT_CACHE_MAX_BYTES", 64 * 1024**2)
+
+#maximum number of prediction URLs whose predictions are cached. The least recently used URL loses its cache above it
+PREDICT_CACHE_MAX_URLS = _env_int("PREDICT_CACHE_MAX_URLS", 8)
+
+#seconds the predictions of a URL are reused before the rows are sent to the URL again (0 keeps them until evicted)
+PREDICT_CACHE_URL_TTL = _env_float("PREDICT_CACHE_URL_TTL", 600)
+
+#1 merges the predict calls of concurrent requests for the same model into shared batches
+PREDICT_BATCHING = _env_int("PREDICT_BATCHING", 0)==1
+
+#maximum number of rows of a merged batch. Calls with more rows are predicted directly
+PREDICT_BATCH_MAX_SIZE = _env_int("PREDICT_BATCH_MAX_SIZE", 512)
+
+#seconds a batch waits for the calls of other requests before it is predicted
+PREDICT_BATCH_MAX_WAIT = _env_float("PREDICT_BATCH_MAX_WAIT", 0.002)
+
+#folder for the memory mapped copies of the training data. By default a '.datacache' folder is created next to each _data.pkl file
+DATA_CACHE_FOLDER = os.environ.get("DATA_CACHE_FOLDER", "")
+
+#store continuous features as float32 instead of float64 to halve the memory used by the training data
+DATA_CACHE_FLOAT32 = _env_int("DATA_CACHE_FLOAT32", 0)==1
+
+#comma separated list of the explainer routes to enable, e.g. 'Tabular/*,Images/LIME'. All explainers are enabled by default
+EXPLAINERS_ENABLED = [x for x in os.environ.get("EXPLAINERS_ENABLED", "").split(",") if x.strip()]
+
+#comma separated list of model backends (sklearn, TF1, TF2, PYT, other). Only the explainers supporting them are enabled
+EXPLAINERS_BACKENDS = [x for x in os.environ.get("EXPLAINERS_BACKENDS", "").split(",") if x.strip()]
+
+#import the enabled explainers at startup instead of on the first request to each endpoint
+EXPLAINERS_WARMUP = _env_int("EXPLAINERS_WARMUP", 0)==1
+
+#print the time spent importing each explainer module and the packages it pulled in
+IMPORT_REPORT = _env_int("IMPORT_REPORT", 0)==1
+
+#maximum number of keep-alive connections kept open to each external prediction URL
+REMOTE_POOL_SIZE = _env_int("REMOTE_POOL_SIZE", 16)
+
+#timeout (seconds) of the requests to external prediction URLs
+REMOTE_TIMEOUT = _env_float("REMOTE_TIMEOUT", 300.0)
+
+#binary request bodies larger than this size (bytes) are gzip-compressed
+REMOTE_COMPRESS_MIN_BYTES = _env_int("REMOTE_COMPRESS_MIN_BYTES", 65536)
+
+#batches with more rows than this are split into chunks sent concurrently to the external prediction URL (0 disables it)
+REMOTE_CHUNK_SIZE = _env_int("REMOTE_CHUNK_SIZE", 1000)
+
+#maximum number of chunks of the same batch being predicted at the same time
+REMOTE_MAX_IN_FLIGHT = _env_int("REMOTE_MAX_IN_FLIGHT", 4)
+
+#number of threads shared by all the concurrent requests to external prediction URLs
+REMOTE_MAX_WORKERS = _env_int("REMOTE_MAX_WORKERS", 32)
+
+#number of times a request is retried after a connection error, a timeout or a 502/503/504 response
+REMOTE_RETRIES = _env_int("REMOTE_RETRIES", 2)
+
+#seconds to wait before the first retry, doubled after each attempt
+REMOTE_RETRY_BACKOFF = _env_float("REMOTE_RETRY_BACKOFF", 0.5)
+
+#maximum number of asynchronous explainer jobs running at the same time, each one in its own worker process
+JOBS_MAX_WORKERS = _env_int("JOBS_MAX_WORKERS", 2)
+
+#folder where the status and results of the asynchronous jobs are kept. Defaults to a '.jobs' folder inside the upload folder
+JOBS_FOLDER = os.environ.get("JOBS_FOLDER", "")
+
+#seconds the status and the result of the finished, failed and cancelled jobs are kept. 0 keeps them forever
+JOBS_TTL = _env_float("JOBS_TTL", 86400)
+
+#multiprocessing start method of the job worker processes (spawn, fork or forkserver). Defaults to forkserver where available,
+#so the workers are never forked from the threads of the server
+JOBS_START_METHOD = os.environ.get("JOBS_START_METHOD", "")
+
+#summary of the training data used as the KernelSHAP background: kmeans (weighted centroids), sample (stratified by target) or full
+SHAP_BACKGROUND_METHOD = os.environ.get("SHAP_BACKGROUND_METHOD", "full")
+
+#maximum number of background rows (centroids or sampled rows) used by the KernelSHAP explainers
+SHAP_BACKGROUND_SIZE = _env_int("SHAP_BACKGROUND_SIZE", 100)
+
+#number of worker processes of the pool shared by the requests computing KernelSHAP values (0 uses one per CPU, up to 4)
+SHAP_PARALLEL_WORKERS = _env_int("SHAP_PARALLEL_WORKERS", 0)
+
+#number of instances explained by each task of the KernelSHAP worker processes (0 picks a few chunks per worker)
+SHAP_CHUNK_SIZE = _env_int("SHAP_CHUNK_SIZE", 0)
+
+#multiprocessing start method of the KernelSHAP worker processes. Defaults to forkserver where available, so the workers are
+#never forked from the threads of the server
+SHAP_PARALLEL_START_METHOD = os.environ.get("SHAP_PARALLEL_START_METHOD", "")
+
+#maximum number of fitted explainer objects (LIME, Anchors, SHAP, ALE, DiCE) kept in memory for reuse (0 disables the cache)
+EXPLAINER_CACHE_MAX_ENTRIES = _env_int("EXPLAINER_CACHE_MAX_ENTRIES", 64)
+
+#reuse the stored responses of deterministic explanations (same model, data, endpoint and arguments). Set to 0 to disable it
+RESULT_CACHE = _env_int("RESULT_CACHE", 1)==1
+
+#folder where the cached responses are stored. Defaults to a '.results' folder inside the upload folder
+RESULT_CACHE_FOLDER = os.environ.get("RESULT_CACHE_FOLDER", "")
+
+#maximum number of instances accepted by the batch endpoints in a single request
+BATCH_MAX_INSTANCES = _env_int("BATCH_MAX_INSTANCES", 10000)
+
+#number of threads explaining the instances of a LIME or Anchors batch request
+BATCH_WORKERS = _env_int("BATCH_WORKERS", 8)
+
+#render the plots on their first request to /ViewExplanation instead of while computing the explanation. Set to 0 to render them right away
+PLOTS_LAZY = _env_int("PLOTS_LAZY", 1)==1
+
+#maximum number of browsers taking screenshots of the HTML plots at the same time
+SCREENSHOT_BROWSERS = _env_int("SCREENSHOT_BROWSERS", 2)
+
+#seconds a screenshot waits for a free browser before failing
+SCREENSHOT_QUEUE_TIMEOUT = _env_float("SCREENSHOT_QUEUE_TIMEOUT", 60.0)
+
+#seconds the browser waits for a page to load before taking its screenshot
+SCREENSHOT_TIMEOUT = _env_float("SCREENSHOT_TIMEOUT", 30.0)
+
+#'browser' takes screenshots of the HTML plots. 'fast' draws the LIME and DiCE plots with matplotlib instead
+SCREENSHOT_RENDERER = os.environ.get("SCREENSHOT_RENDERER", "browser")
+
+#artifacts (plots) not viewed for this many seconds are deleted by the janitor. 0 keeps them forever
+ARTIFACTS_TTL = _env_float("ARTIFACTS_TTL", 0)
+
+#maximum total size in bytes of the artifacts. The least recently viewed ones are deleted above it. 0 means no limit
+ARTIFACTS_MAX_BYTES = _env_int("ARTIFACTS_MAX_BYTES", 0)
+
+#seconds between two runs of the janitor of the artifacts
+ARTIFACTS_JANITOR_INTERVAL = _env_float("ARTIFACTS_JANITOR_INTERVAL", 300)
+
+#responses at least this large (bytes) are gzip-compressed for the clients accepting it. 0 disables the compression
+RESPONSE_GZIP_MIN_BYTES = _env_int("RESPONSE_GZIP_MIN_BYTES", 65536)
+
+#gzip compression level of the responses (1 fastest - 9 smallest)
+RESPONSE_GZIP_LEVEL = _env_int("RESPONSE_GZIP_LEVEL", 6)
+
+#responses whose arrays take at least this many bytes are streamed to the client in chunks. 0 disables the streaming
+RESPONSE_STREAM_MIN_BYTES = _env_int("RESPONSE_STREAM_MIN_BYTES", 16 * 1024**2)
+
+#1 measures the latency of each stage of the requests and serves it at /metrics. 0 disables the measures
+METRICS = _env_int("METRICS", 1)==1
+
+#1 lets requests ask for a profile of the explainer with the 'X-Profile' header or the 'profile' argument
+PROFILING = _env_int("PROFILING", 0)==1
+
+#if set, profiles are only taken for the requests sending this value in the 'X-Profile-Token' header
+PROFILING_TOKEN = os.environ.get("PROFILING_TOKEN", "")
+
+#seconds between two samples of the sampling profiler
+PROFILING_INTERVAL = _env_float("PROFILING_INTERVAL", 0.005)
+
+#file receiving the trace spans of the requests in the Chrome trace event format. Empty disables it. {pid} is replaced by the process id
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+
+#file receiving the trace spans in the OTLP/JSON format, one request per line. Empty disables it
+TRACE_OTLP_FILE = os.environ.get("TRACE_OTLP_FILE", "")
+
+#size in bytes above which the trace files are rolled over
+TRACE_MAX_BYTES = _env_int("TRACE_MAX_BYTES", 64 * 1024**2)
+
+#number of rolled over trace files that are kept
+TRACE_BACKUPS = _env_int("TRACE_BACKUPS", 3)
+
+#service name of the OTLP spans
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "explainer-libraries")
+
+#address and port of the production server (serve.py)
+SERVE_HOST = os.environ.get("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = _env_int("SERVE_PORT", 5000)
+
+#worker processes of serve.py. 0 starts one per CPU
+SERVE_WORKERS = _env_int("SERVE_WORKERS", 0)
+
+#requests handled at the same time by each worker process of serve.py
+SERVE_THREADS = _env_int("SERVE_THREADS", 8)
+
+#seconds a request may take in a worker before serve.py answers 504 Gateway Timeout
+SERVE_TIMEOUT = _env_float("SERVE_TIMEOUT", 900)
+
+#seconds given to the requests in flight to finish when serve.py is stopped
+SERVE_GRACEFUL_TIMEOUT = _env_float("SERVE_GRACEFUL_TIMEOUT", 30)
+
+#comma separated list of the model ids loaded, with their training data, before the workers are forked. '*' loads every model
+SERVE_PRELOAD = [x.strip() for x in os.environ.get("SERVE_PRELOAD", "").split(",") if x.strip()]
@@ -0,0 +1,190 @@
+import os
+import json
+import threading
+import numpy as np
+import pandas as pd
+import joblib
+import config
+import metrics
+from getmodelfiles import get_model_paths
+
+## Converts <id>_data.pkl once into a contiguous feature matrix and a target array stored as .npy files,
+## which are then opened with memory mapping. Worker processes serving the same model share the page cache.
+
+FORMAT_VERSION = 1
+
+
+class TrainingData:
+
+    def __init__(self, features, target, feature_names, target_name, dtypes, target_dtype):
+        self.features = features
+        self.target = target
+        self.feature_names = feature_names
+        self.target_name = target_name
+        self.dtypes = dtypes
+        self.target_dtype = target_dtype
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return self.features.shape
+
+    def cached(self, key, compute):
+        #values derived from the training data (e.g. background summaries) are computed once per version of the data file
+        with self._lock:
+            if key in self._derived:
+                return self._derived[key]
+        value = compute()
+        with self._lock:
+            return self._derived.setdefault(key, value)
+
+    def feature_frame(self):
+        #wraps the (memory mapped) feature matrix without copying it
+        df = pd.DataFrame(self.features, columns=self.feature_names, copy=False)
+        if self.features.dtype.hasobject:
+            #mixed column types are not memory mapped, so the original types are restored
+            df = df.astype(dict(zip(self.feature_names, self.dtypes)))
+        return df
+
+    def target_frame(self):
+        return pd.DataFrame({self.target_name: self.target}).astype({self.target_name: self.target_dtype})
+
+    def frame(self):
+        #full dataframe with the original column types, as stored in the _data.pkl file
+        df = self.feature_frame().astype(dict(zip(self.feature_names, self.dtypes)))
+        df[self.target_name] = pd.Series(self.target, index=df.index).astype(self.target_dtype)
+        return df
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _cache_folder(data_path):
+    if config.DATA_CACHE_FOLDER:
+        model_dir = os.path.basename(os.path.dirname(os.path.abspath(data_path)))
+        return os.path.join(config.DATA_CACHE_FOLDER, model_dir)
+    return os.path.join(os.path.dirname(data_path), ".datacache")
+
+
+def _save_npy(path, array):
+    tmp = path + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+    with open(tmp, "wb") as f:
+        np.save(f, array, allow_pickle=array.dtype.hasobject)
+    os.replace(tmp, path)
+
+
+def _is_numeric(dtype):
+    return np.issubdtype(dtype, np.number) or np.issubdtype(dtype, np.bool_)
+
+
+def convert_data_file(data_path, folder, float32):
+    dataframe = joblib.load(data_path)
+    os.makedirs(folder, exist_ok=True)
+    X = dataframe.iloc[:, :-1]
+    y = dataframe.iloc[:, -1]
+
+    numeric = all(_is_numeric(dt) for dt in X.dtypes)
+    if numeric:
+        features = np.ascontiguousarray(X.to_numpy(dtype=np.float32 if float32 else None))
+    else:
+        features = X.to_numpy(dtype=object)
+    target = y.to_numpy(dtype=None if _is_numeric(y.dtype) else object)
+
+    _save_npy(os.path.join(folder, "features.f32.npy" if float32 else "features.npy"), features)
+    _save_npy(os.path.join(folder, "target.npy"), target)
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "source": _file_signature(data_path),
+        "float32": float32,
+        "numeric": numeric,
+        "feature_names": [str(c) for c in X.columns],
+        "target_name": str(y.name),
+        "dtypes": [str(dt) for dt in X.dtypes],
+        "target_dtype": str(y.dtype),
+    }
+    meta_path = os.path.join(folder, "meta.f32.json" if float32 else "meta.json")
+    tmp = meta_path + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+    return meta
+
+
+def _read_meta(path, data_path):
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version")!=FORMAT_VERSION or meta.get("source")!=_file_signature(data_path):
+        return None
+    return meta
+
+
+class DataCache:
+
+    def __init__(self):
+        self._entries = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, data_path, float32=False):
+        key = (os.path.abspath(data_path), tuple(_file_signature(data_path)), float32)
+        with self._lock:
+            data = self._entries.get(key)
+            if data!=None:
+                return data
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        #only one thread converts and maps a given file, the others wait for it and reuse the result
+        with key_lock:
+            with self._lock:
+                data = self._entries.get(key)
+                if data!=None:
+                    return data
+            try:
+                data = self._load(data_path, float32)
+                with self._lock:
+                    #drop the views of older versions of the same file
+                    for k in [k for k in self._entries if k[0]==key[0] and k!=key]:
+                        del self._entries[k]
+                    self._entries[key] = data
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return data
+
+    def _load(self, data_path, float32):
+        folder = _cache_folder(data_path)
+        meta = _read_meta(os.path.join(folder, "meta.f32.json" if float32 else "meta.json"), data_path)
+        if meta==None:
+            meta = convert_data_file(data_path, folder, float32)
+
+        #copy-on-write mapping: pages are shared between processes unless an explainer writes to them
+        mmap_mode = "c" if meta["numeric"] else None
+        features = np.load(os.path.join(folder, "features.f32.npy" if float32 else "features.npy"), mmap_mode=mmap_mode, allow_pickle=not meta["numeric"])
+        target = np.load(os.path.join(folder, "target.npy"), allow_pickle=True)
+        return TrainingData(features, target, meta["feature_names"], meta["target_name"], meta["dtypes"], meta["target_dtype"])
+
+    def invalidate(self, data_path=None):
+        with self._lock:
+            for k in list(self._entries):
+                if data_path==None or k[0]==os.path.abspath(data_path):
+                    del self._entries[k]
+
+
+data_cache = DataCache()
+
+
+def get_training_data(_id, model_folder, float32=None):
+    _, _, data_path = get_model_paths(_id, model_folder)
+    if data_path==None:
+        return None
+    if float32==None:
+        float32 = config.DATA_CACHE_FLOAT32
+    with metrics.stage("load_data"):
+        return data_cache.get(data_path, float32)
@@ -0,0 +1,76 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import config
+import metrics
+from lazyplots import save_plot
+from plotting import pyplot_figure
+
+## Helpers of the batch endpoints, which explain a matrix of instances in a single request.
+
+
+def parse_instances(value):
+    instances = np.array(json.loads(value) if isinstance(value, str) else value)
+    if instances.ndim!=2 or len(instances)==0:
+        raise Exception("The 'instances' argument must be a non-empty array of instances (rows).")
+    if len(instances) > config.BATCH_MAX_INSTANCES:
+        raise Exception("Too many instances. At most " + str(config.BATCH_MAX_INSTANCES) + " instances can be explained in a single request.")
+    return instances
+
+
+def map_instances(func, instances, n_jobs=None, init=None):
+    #explains the instances in parallel threads. Each thread explains a contiguous block of instances and
+    #gets its own state from init(worker_index), e.g. an explainer that must not be shared between threads
+    if n_jobs==None:
+        n_jobs = config.BATCH_WORKERS
+    n_jobs = max(1, min(int(n_jobs), len(instances)))
+    blocks = np.array_split(np.arange(len(instances)), n_jobs)
+    request_metrics = metrics.current()
+
+    def run(worker):
+        with metrics.attach(request_metrics):
+            state = init(worker) if init!=None else None
+            return [func(instances[i], state) for i in blocks[worker]]
+
+    if n_jobs==1:
+        return run(0)
+    with ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix="batch-explain") as executor:
+        results = list(executor.map(run, range(n_jobs)))
+    return [result for block in results for result in block]
+
+
+def select_output(shap_values, expected_value, index):
+    #returns the (instances, features) matrix of Shapley values and the expected value of the explained output
+    expected_value = np.ravel(expected_value)
+    if isinstance(shap_values, list):
+        #multiclass shape: (#_of_classes, #_of_instances, #_of_features)
+        return np.asarray(shap_values[index]), float(expected_value[index])
+    shap_values = np.asarray(shap_values)
+    if shap_values.ndim==3:
+        return shap_values[:, :, index], float(expected_value[index])
+    return shap_values, float(expected_value[0])
+
+
+def shap_plot(payload, path):
+    #renderer of the plot of one instance of the SHAP batch endpoints
+    import shap
+    import matplotlib.pyplot as plt
+    plot_type = payload["plot_type"]
+    with pyplot_figure():
+        if plot_type=="bar":
+            shap.plots._bar.bar_legacy(payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        elif plot_type=="decision":
+            shap.decision_plot(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        else:
+            shap.plots._waterfall.waterfall_legacy(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        plt.savefig(path+".png",bbox_inches="tight")
+
+
+def save_shap_plots(path, upload_folder, expected_value, shap_values, instances, feature_names, plot_type=None):
+    #one plot per instance, rendered when it is first viewed. Returns their URLs
+    urls = []
+    for values, instance in zip(shap_values, instances):
+        getcall = save_plot(path, upload_folder, shap_plot, dict(plot_type=plot_type, expected_value=expected_value,
+                            shap_values=values, instance=instance, feature_names=feature_names))
+        urls.append(getcall+".png")
+    return urls
@@ -0,0 +1,118 @@
+import copy
+import json
+import weakref
+import threading
+from collections import OrderedDict
+import config
+import metrics
+
+## Cache of the fitted explainer objects (LIME statistics, anchor samplers, SHAP expected values, DiCE data...),
+## keyed by model, explainer and the parameters that affect their construction. An entry is only reused while
+## the model and the training data it was built from are the ones currently served by the model registry and
+## the data cache, so it is rebuilt whenever their files change. The cache only holds a weak reference to the
+## model entry: when the model registry lets go of a model, its explainers are dropped with it.
+
+
+class ExplainerCache:
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, entry, data):
+        cached = self._entries.get(key)
+        if cached!=None and cached[0]() is entry and cached[1] is data:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[2]
+        return None
+
+    def _discard(self, key):
+        #called when the model entry of an explainer is garbage collected
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached!=None and cached[0]()==None:
+                del self._entries[key]
+
+    def get(self, name, entry, data, factory, url=None, params=None, copy_function=copy.copy, predict_func=None):
+        #factory: function building the explainer. params: request parameters used by the factory
+        #copy_function: returns the copy of the cached explainer used by a request
+        #predict_func: prediction function of the request, replacing the one the explainer was built with
+        if self.max_entries<=0:
+            with metrics.stage("build_explainer", cache="off"):
+                return factory()
+        key = (entry.key, name, url, json.dumps(params, sort_keys=True, default=str))
+        built = False
+        with self._lock:
+            explainer = self._lookup(key, entry, data)
+            if explainer==None:
+                key_lock = self._loading.setdefault(key, threading.Lock())
+        if explainer==None:
+            with key_lock:
+                with self._lock:
+                    explainer = self._lookup(key, entry, data)
+                    if explainer==None:
+                        self.misses += 1
+                if explainer==None:
+                    try:
+                        with metrics.stage("build_explainer", cache="miss"):
+                            explainer = factory()
+                    finally:
+                        with self._lock:
+                            self._loading.pop(key, None)
+                    with self._lock:
+                        self._entries[key] = (weakref.ref(entry), data, explainer)
+                        self._entries.move_to_end(key)
+                        while len(self._entries) > self.max_entries:
+                            self._entries.popitem(last=False)
+                            self.evictions += 1
+                    weakref.finalize(entry, self._discard, key)
+                    built = True
+        if not built:
+            #hits record a zero-cost stage too, so that the stage has one sample per request like the others
+            with metrics.stage("build_explainer", cache="hit"):
+                pass
+        #explainers store per-call state in their attributes, so every request works on its own copy
+        explainer = copy_function(explainer)
+        if predict_func!=None:
+            _rebind(explainer, predict_func)
+        return explainer
+
+    def invalidate(self, _id=None):
+        with self._lock:
+            for key in list(self._entries):
+                if _id==None or key[0][1]==_id:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _rebind(explainer, predict_func):
+    #the copy calls the prediction function of the current request instead of the one of the request that built it
+    if hasattr(explainer, "reset_predictor"):
+        #alibi explainers (Anchors, ALE)
+        explainer.reset_predictor(predict_func)
+    elif hasattr(getattr(explainer, "model", None), "f"):
+        #shap KernelExplainer
+        explainer.model = copy.copy(explainer.model)
+        explainer.model.f = predict_func
+
+
+explainer_cache = ExplainerCache(config.EXPLAINER_CACHE_MAX_ENTRIES)
+
+
+def get_explainer(name, entry, data, factory, url=None, params=None, copy_function=copy.copy, predict_func=None):
+    return explainer_cache.get(name, entry, data, factory, url, params, copy_function, predict_func)
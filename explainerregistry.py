@@ -0,0 +1,217 @@
+import sys
+import time
+import builtins
+import threading
+import importlib
+from fnmatch import fnmatch
+from flask import request
+from flask_restful import Resource
+from resultcache import request_arguments
+from saveinfo import request_model_id
+import metrics
+import profiling
+
+## Explainer resources are registered by name and only imported on the first request to their endpoint
+## (or on warm up), so the server does not pay for every ML framework at startup.
+
+ALL_BACKENDS = ("sklearn", "TF1", "TF2", "PYT", "other")
+TF_BACKENDS = ("TF1", "TF2")
+
+#route, module, class, backends of the models supported by the explainer
+EXPLAINERS = [
+    ("/Tabular/DicePublic", "resources.explainers.tabular.dicePublic", "DicePublic", ("sklearn", "TF1", "TF2", "PYT")),
+    ("/Tabular/DicePrivate", "resources.explainers.tabular.dicePrivate", "DicePrivate", TF_BACKENDS),
+    ("/Tabular/LIME", "resources.explainers.tabular.lime", "Lime", ALL_BACKENDS),
+    ("/Tabular/KernelSHAPLocal", "resources.explainers.tabular.shapKernelLocal", "ShapKernelLocal", ALL_BACKENDS),
+    ("/Tabular/KernelSHAPGlobal", "resources.explainers.tabular.shapKernelGlobal", "ShapKernelGlobal", ALL_BACKENDS),
+    ("/Tabular/TreeSHAPLocal", "resources.explainers.tabular.shapTreeLocal", "ShapTreeLocal", ("sklearn", "other")),
+    ("/Tabular/TreeSHAPGlobal", "resources.explainers.tabular.shapTreeGlobal", "ShapTreeGlobal", ("sklearn", "other")),
+    ("/Tabular/DeepSHAPLocal", "resources.explainers.tabular.shapDeepLocal", "ShapDeepLocal", TF_BACKENDS),
+    ("/Tabular/DeepSHAPGlobal", "resources.explainers.tabular.shapDeepGlobal", "ShapDeepGlobal", TF_BACKENDS),
+    ("/Tabular/Anchors", "resources.explainers.tabular.anchors", "Anchors", ALL_BACKENDS),
+    ("/Tabular/LIMEBatch", "resources.explainers.tabular.limeBatch", "LimeBatch", ALL_BACKENDS),
+    ("/Tabular/KernelSHAPLocalBatch", "resources.explainers.tabular.shapKernelBatch", "ShapKernelLocalBatch", ALL_BACKENDS),
+    ("/Tabular/TreeSHAPLocalBatch", "resources.explainers.tabular.shapTreeBatch", "ShapTreeLocalBatch", ("sklearn", "other")),
+    ("/Tabular/DeepSHAPLocalBatch", "resources.explainers.tabular.shapDeepBatch", "ShapDeepLocalBatch", TF_BACKENDS),
+    ("/Tabular/AnchorsBatch", "resources.explainers.tabular.anchorsBatch", "AnchorsBatch", ALL_BACKENDS),
+    ("/Tabular/ALE", "resources.explainers.tabular.ale", "Ale", ALL_BACKENDS),
+    ("/Tabular/Importance", "resources.explainers.tabular.importance", "Importance", ALL_BACKENDS),
+    ("/Images/LIME", "resources.explainers.images.lime", "LimeImage", ALL_BACKENDS),
+    ("/Images/Anchors", "resources.explainers.images.anchors", "AnchorsImage", ALL_BACKENDS),
+    ("/Images/Counterfactuals", "resources.explainers.images.counterfactuals", "CounterfactualsImage", TF_BACKENDS),
+    ("/Images/GradCamTorch", "resources.explainers.images.gradcamTorch", "GradCamTorch", ("PYT",)),
+    ("/Text/LIME", "resources.explainers.text.lime", "LimeText", ALL_BACKENDS),
+]
+
+#long-running explainers that can be submitted as asynchronous jobs with the 'async' argument
+ASYNC_ROUTES = ("/Tabular/KernelSHAPGlobal", "/Tabular/TreeSHAPGlobal", "/Tabular/DeepSHAPGlobal", "/Tabular/ALE", "/Tabular/Importance",
+                "/Tabular/LIMEBatch", "/Tabular/KernelSHAPLocalBatch", "/Tabular/TreeSHAPLocalBatch", "/Tabular/DeepSHAPLocalBatch", "/Tabular/AnchorsBatch")
+
+_import_lock = threading.RLock()
+_import_report = []
+
+
+def _timed_import(module_name):
+    #times the import of the module, attributing the time spent importing each new top-level package to that package
+    packages = {}
+    stack = []
+    original_import = builtins.__import__
+    owner = threading.get_ident()
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        package = name.split(".")[0]
+        if threading.get_ident()!=owner or level!=0 or package in sys.modules or any(p==package for p, _, _ in stack):
+            return original_import(name, globals, locals, fromlist, level)
+        stack.append([package, time.perf_counter(), 0.0])
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            package, start, children = stack.pop()
+            elapsed = time.perf_counter() - start
+            packages[package] = packages.get(package, 0.0) + elapsed - children
+            if stack:
+                stack[-1][2] += elapsed
+
+    start = time.perf_counter()
+    builtins.__import__ = timed_import
+    try:
+        module = importlib.import_module(module_name)
+    finally:
+        builtins.__import__ = original_import
+    total = time.perf_counter() - start
+    return module, total, packages
+
+
+class LazyExplainer:
+
+    def __init__(self, route, module_name, class_name, backends):
+        self.route = route
+        self.module_name = module_name
+        self.class_name = class_name
+        self.backends = backends
+        self._resource_class = None
+
+    @property
+    def loaded(self):
+        return self._resource_class!=None
+
+    def load(self):
+        if self._resource_class==None:
+            with _import_lock:
+                if self._resource_class==None:
+                    module, total, packages = _timed_import(self.module_name)
+                    _import_report.append({"module": self.module_name, "route": self.route, "seconds": total, "packages": packages})
+                    self._resource_class = getattr(module, self.class_name)
+        return self._resource_class
+
+    @property
+    def supports_async(self):
+        return self.route in ASYNC_ROUTES
+
+    def resource(self, job_manager=None, result_cache=None):
+        explainer = self
+
+        class LazyResource(Resource):
+            methods = {"GET", "POST"}
+
+            def __init__(self, *args, **kwargs):
+                self.args = args
+                self.kwargs = kwargs
+
+            def dispatch_request(self, *args, **kwargs):
+                #the request is measured until its response is sent (see metrics.init_app)
+                metrics.begin(explainer.route, request_model_id())
+                if job_manager!=None and explainer.supports_async and request.method=="POST" and _is_async_request():
+                    return self.submit_job()
+                profile_mode = profiling.requested_mode() if request.method=="POST" else None
+                if profile_mode!=None:
+                    return self.profiled(profile_mode, *args, **kwargs)
+                key = self.cache_key() if result_cache!=None and request.method=="POST" else None
+                if key!=None:
+                    with metrics.stage("result_cache"):
+                        response = result_cache.get(key, self.kwargs["upload_folder"], request.host_url)
+                    if response!=None:
+                        return response
+                resource = explainer.load()(*self.args, **self.kwargs)
+                response = resource.dispatch_request(*args, **kwargs)
+                if key!=None and isinstance(response, dict):
+                    result_cache.put(key, response, explainer.route, request.host_url)
+                return response
+
+            def profiled(self, mode, *args, **kwargs):
+                #profiled requests are always computed, and their responses are not cached as they link the profile
+                resource = explainer.load()(*self.args, **self.kwargs)
+                with profiling.profile(mode) as profiler:
+                    response = resource.dispatch_request(*args, **kwargs)
+                links = profiling.save_profile(profiler, self.kwargs["upload_folder"])
+                if isinstance(response, dict):
+                    response = dict(response, profile=links)
+                return response
+
+            def cache_key(self):
+                try:
+                    return result_cache.key(explainer.route, self.kwargs["model_folder"], request_arguments())
+                except Exception:
+                    #invalid requests are left to the explainer to report
+                    return None
+
+            def submit_job(self):
+                json_body = request.get_json(silent=True) if request.is_json else None
+                form = {k: v for k, v in request.values.items() if k!="async"}
+                if isinstance(json_body, dict):
+                    json_body = {k: v for k, v in json_body.items() if k!="async"}
+                status = job_manager.submit(explainer.route, explainer.module_name, explainer.class_name, self.kwargs,
+                                            request.host_url, form=form, json_body=json_body)
+                return {"job_id": status["job_id"], "state": status["state"],
+                        "status_url": request.host_url + "Jobs/" + status["job_id"]}, 202
+
+        LazyResource.__name__ = self.class_name
+        return LazyResource
+
+
+def select_explainers(enabled=None, backends=None):
+    #enabled: list of route patterns such as 'Tabular/*'. backends: list of model backends that must be served
+    selected = []
+    for route, module_name, class_name, explainer_backends in EXPLAINERS:
+        if enabled and not any(fnmatch(route.strip("/"), pattern.strip().strip("/")) for pattern in enabled):
+            continue
+        if backends and not set(b.strip() for b in backends) & set(explainer_backends):
+            continue
+        selected.append(LazyExplainer(route, module_name, class_name, explainer_backends))
+    return selected
+
+
+def _is_async_request():
+    value = request.values.get("async")
+    if value==None and request.is_json:
+        json_body = request.get_json(silent=True)
+        value = json_body.get("async") if isinstance(json_body, dict) else None
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def register_explainers(api, explainers, job_manager=None, result_cache=None, **resource_class_kwargs):
+    for explainer in explainers:
+        api.add_resource(explainer.resource(job_manager, result_cache), explainer.route, resource_class_kwargs=resource_class_kwargs)
+
+
+def warm_up(explainers):
+    for explainer in explainers:
+        explainer.load()
+
+
+def import_report():
+    with _import_lock:
+        return list(_import_report)
+
+
+def print_import_report(startup_seconds=None):
+    if startup_seconds!=None:
+        print("Server core imported in {:.2f}s".format(startup_seconds))
+    report = import_report()
+    if not report:
+        print("No explainer modules have been imported yet.")
+    for entry in report:
+        print("{:<28} {:>7.2f}s  {}".format(entry["route"], entry["seconds"], entry["module"]))
+        for package, seconds in sorted(entry["packages"].items(), key=lambda x: -x[1]):
+            if seconds >= 0.01:
+                print("    {:<24} {:>7.2f}s".format(package, seconds))
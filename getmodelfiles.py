@@ -2,26 +2,43 @@ from os.path import exists
 
 
 
-def get_model_files(_id,model_folder):
+def get_model_paths(_id,model_folder):
 
     if exists(model_folder+'/' +_id):
         path=model_folder+'/' +_id+'/'+_id
-    
+
         model=None
         if exists(path + '.pkl'):
-            model = open(path + '.pkl','r+b')
+            model = path + '.pkl'
         elif exists(path + '.h5'):
-            model = open(path + '.h5','r+b')
+            model = path + '.h5'
         elif exists(path + '.pt'):
-            model = open(path + '.pt','r+b')
+            model = path + '.pt'
 
         model_info = None
         if exists(path + '.json'):
-            model_info=open(path + '.json')
+            model_info = path + '.json'
 
         data=None
         if exists(path + '_data.pkl'):
-            data=open(path + '_data.pkl','rb')
+            data = path + '_data.pkl'
         return model, model_info, data
     else:
         raise Exception("No directory with id '"+ _id +"' was found in the database.")
+
+
+def get_model_files(_id,model_folder):
+    model_path, model_info_path, data_path = get_model_paths(_id,model_folder)
+
+    model=None
+    if model_path!=None:
+        model = open(model_path,'r+b')
+
+    model_info = None
+    if model_info_path!=None:
+        model_info=open(model_info_path)
+
+    data=None
+    if data_path!=None:
+        data=open(data_path,'rb')
+    return model, model_info, data
@@ -0,0 +1,270 @@
+import os
+import atexit
+import shutil
+import time
+import uuid
+import threading
+import importlib
+import multiprocessing
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from flask import Flask
+from responseformats import dump_stored, load_stored
+
+## Asynchronous jobs for the long-running explainers. Each job runs the explainer resource in its own
+## worker process (at most max_workers at the same time), so it can be cancelled by terminating the process.
+## The status and the result of every job are persisted in its folder, so they can be polled from any
+## server process and survive a restart of the server. The folders of the jobs finished for longer than the
+## retention time are removed by the thread of the job manager.
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+#seconds between two removals of the expired jobs
+CLEANUP_INTERVAL = 300
+
+_current_job_dir = None
+
+
+def _write_json(path, content):
+    tmp = path + ".tmp" + str(os.getpid()) + "-" + str(threading.get_ident())
+    with open(tmp, "w") as f:
+        #the arrays of the results keep their labels, so they can be downloaded in a binary format
+        dump_stored(content, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return load_stored(f)
+
+
+def _update_status(job_dir, expected_states=None, **changes):
+    #expected_states: the status is only changed if the job is still in one of these states. The job process
+    #and the server processes update the same file, so the read and the write happen under a file lock
+    path = os.path.join(job_dir, "status.json")
+    with open(os.path.join(job_dir, "status.lock"), "a") as lock:
+        if fcntl!=None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        status = _read_json(path)
+        if expected_states!=None and status["state"] not in expected_states:
+            return status
+        status.update(changes)
+        _write_json(path, status)
+        return status
+
+
+def _pid_alive(pid):
+    if pid==None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def report_progress(progress, message=None):
+    #called by the explainers to report the progress (0 to 1) of the job they are running. No-op outside of a job
+    if _current_job_dir!=None:
+        _update_status(_current_job_dir, (RUNNING,), progress=progress, message=message)
+
+
+def _run_job(job_dir, module_name, class_name, resource_kwargs, path, base_url, form, json_body):
+    global _current_job_dir
+    _current_job_dir = job_dir
+    status = _update_status(job_dir, (QUEUED,), state=RUNNING, started=time.time(), pid=os.getpid(), progress=0.0, message="Starting")
+    if status["state"]!=RUNNING:
+        #cancelled before it started
+        return
+    try:
+        resource_class = getattr(importlib.import_module(module_name), class_name)
+        #the explainer reads its arguments from the request, so the original one is recreated in the worker
+        app = Flask(__name__)
+        if json_body!=None:
+            context = app.test_request_context(path, base_url=base_url, method="POST", json=json_body)
+        else:
+            context = app.test_request_context(path, base_url=base_url, method="POST", data=form)
+        with context:
+            result = resource_class(**resource_kwargs).post()
+        code = 200
+        if isinstance(result, tuple):
+            result, code = result[0], result[1]
+        _write_json(os.path.join(job_dir, "result.json"), result)
+        if code >= 400:
+            _update_status(job_dir, (RUNNING,), state=FAILED, finished=time.time(), error="The explainer returned status " + str(code))
+        else:
+            _update_status(job_dir, (RUNNING,), state=DONE, finished=time.time(), progress=1.0, message=None)
+    except Exception as e:
+        message = getattr(e, "data", {}).get("message") if isinstance(getattr(e, "data", None), dict) else None
+        _update_status(job_dir, (RUNNING,), state=FAILED, finished=time.time(), error=str(message or e) or type(e).__name__)
+
+
+def _get_context(start_method):
+    #the jobs are started by the job-manager thread while other threads serve requests and hold locks, which a forked
+    #child would inherit, so fork is only used when it is asked for
+    if not start_method:
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(start_method)
+
+
+class JobManager:
+
+    def __init__(self, folder, max_workers=2, start_method=None, poll_interval=0.5, ttl=0):
+        #ttl: seconds the finished jobs are kept (0 keeps them forever)
+        self.folder = folder
+        self.max_workers = max_workers
+        self.poll_interval = poll_interval
+        self.ttl = ttl
+        self.expired = 0
+        self._next_cleanup = 0
+        self._context = _get_context(start_method)
+        self._pending = []
+        self._running = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        os.makedirs(folder, exist_ok=True)
+        atexit.register(self.shutdown)
+
+    def _job_dir(self, job_id):
+        #job ids are generated by the server, anything else could escape the jobs folder
+        if not job_id.isalnum():
+            raise KeyError(job_id)
+        return os.path.join(self.folder, job_id)
+
+    def submit(self, route, module_name, class_name, resource_kwargs, base_url, form=None, json_body=None):
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        status = {"job_id": job_id, "endpoint": route, "state": QUEUED, "progress": 0.0, "message": None,
+                  "submitted": time.time(), "started": None, "finished": None, "error": None,
+                  "server_pid": os.getpid(), "pid": None}
+        _write_json(os.path.join(job_dir, "status.json"), status)
+        with self._lock:
+            self._pending.append((job_id, (job_dir, module_name, class_name, resource_kwargs, route, base_url, form, json_body)))
+            self._start_thread()
+        self._wakeup.set()
+        return status
+
+    def status(self, job_id):
+        job_dir = self._job_dir(job_id)
+        #the jobs left by a previous run of the server also expire once their status is requested
+        with self._lock:
+            self._start_thread()
+        try:
+            status = _read_json(os.path.join(job_dir, "status.json"))
+        except FileNotFoundError:
+            raise KeyError(job_id)
+        #jobs left unfinished by a server (or worker) that is no longer running will never complete
+        if status["state"]==QUEUED and not _pid_alive(status["server_pid"]):
+            status = _update_status(job_dir, (QUEUED,), state=FAILED, finished=time.time(), error="The server was stopped before the job started.")
+        elif status["state"]==RUNNING and not _pid_alive(status["pid"]):
+            status = _update_status(job_dir, (RUNNING,), state=FAILED, finished=time.time(), error="The job was interrupted.")
+        return status
+
+    def result(self, job_id):
+        try:
+            return _read_json(os.path.join(self._job_dir(job_id), "result.json"))
+        except FileNotFoundError:
+            return None
+
+    def cancel(self, job_id):
+        status = self.status(job_id)
+        if status["state"] in FINISHED_STATES:
+            return status
+        #the flag is also seen by the server process owning the job if it is not this one
+        open(os.path.join(self._job_dir(job_id), "cancel"), "w").close()
+        self._wakeup.set()
+        self._check_jobs()
+        return self.status(job_id)
+
+    def _cancel_requested(self, job_id):
+        return os.path.exists(os.path.join(self._job_dir(job_id), "cancel"))
+
+    def _start_thread(self):
+        if self._thread==None:
+            self._thread = threading.Thread(target=self._run, name="job-manager", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self._check_jobs()
+                if self.ttl > 0 and time.time() >= self._next_cleanup:
+                    self._next_cleanup = time.time() + min(self.ttl, CLEANUP_INTERVAL)
+                    self.remove_expired()
+            except Exception as e:
+                print("Job manager error: " + str(e))
+
+    def _check_jobs(self):
+        with self._lock:
+            for job_id, process in list(self._running.items()):
+                if process.is_alive() and self._cancel_requested(job_id):
+                    process.terminate()
+                    process.join()
+                    _update_status(self._job_dir(job_id), (QUEUED, RUNNING), state=CANCELLED, finished=time.time(), message=None)
+                    del self._running[job_id]
+                elif not process.is_alive():
+                    process.join()
+                    del self._running[job_id]
+                    _update_status(self._job_dir(job_id), (QUEUED, RUNNING), state=FAILED, finished=time.time(),
+                                   error="The worker process exited with code " + str(process.exitcode))
+
+            for job_id, args in list(self._pending):
+                if self._cancel_requested(job_id):
+                    self._pending.remove((job_id, args))
+                    _update_status(self._job_dir(job_id), (QUEUED,), state=CANCELLED, finished=time.time())
+            while self._pending and len(self._running) < self.max_workers:
+                job_id, args = self._pending.pop(0)
+                #not a daemon process, so the explainers can start worker processes of their own
+                process = self._context.Process(target=_run_job, args=args, name="job-" + job_id)
+                process.start()
+                self._running[job_id] = process
+
+    def remove_expired(self, ttl=None):
+        #removes the folders of the jobs finished more than ttl seconds ago, whichever server process ran them
+        ttl = self.ttl if ttl==None else ttl
+        limit = time.time() - ttl
+        removed = 0
+        for job_id in os.listdir(self.folder):
+            job_dir = os.path.join(self.folder, job_id)
+            if not job_id.isalnum() or not os.path.isdir(job_dir):
+                continue
+            try:
+                status = self.status(job_id)
+                expired = status["state"] in FINISHED_STATES and (status["finished"] or 0) < limit
+            except KeyError:
+                #folders without a status are left by a server stopped while submitting the job
+                expired = os.path.getmtime(job_dir) < limit
+            except Exception:
+                continue
+            if expired:
+                shutil.rmtree(job_dir, ignore_errors=True)
+                removed += 1
+        with self._lock:
+            self.expired += removed
+        return removed
+
+    def shutdown(self):
+        with self._lock:
+            for job_id, process in self._running.items():
+                process.terminate()
+                process.join()
+                _update_status(self._job_dir(job_id), (QUEUED, RUNNING), state=FAILED, finished=time.time(), error="The server was stopped.")
+            self._running.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"queued": len(self._pending), "running": len(self._running), "max_workers": self.max_workers,
+                    "ttl": self.ttl, "expired": self.expired}
@@ -0,0 +1,24 @@
+from flask_restful import Resource
+
+
+class JobStatus(Resource):
+
+    def __init__(self, job_manager):
+        self.job_manager = job_manager
+
+    def get(self, job_id):
+        try:
+            status = self.job_manager.status(job_id)
+        except KeyError:
+            return {"message": "No job with id '" + job_id + "' was found."}, 404
+        response = {k: v for k, v in status.items() if k not in ("server_pid", "pid")}
+        if status["state"]=="done":
+            response["result"] = self.job_manager.result(job_id)
+        return response
+
+    def delete(self, job_id):
+        try:
+            status = self.job_manager.cancel(job_id)
+        except KeyError:
+            return {"message": "No job with id '" + job_id + "' was found."}, 404
+        return {k: v for k, v in status.items() if k not in ("server_pid", "pid")}
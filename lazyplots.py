@@ -0,0 +1,104 @@
+import os
+import pickle
+import threading
+import importlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import config
+import metrics
+from saveinfo import save_file_info
+from artifactstore import get_store
+from screenshots import screenshot, bars_png, tables_png
+
+## Plots are rendered on demand: the explainers store what is needed to draw them (the payload) and return
+## the URLs right away. The first GET of a plot through ViewExplanation renders all the files of that plot
+## (e.g. .html and .png) into the artifact store, where they are served from on the following requests.
+## Clients that only use the JSON explanation never pay for the rendering.
+
+#requests for the same plot wait for the one rendering it on an exclusive flock of its pending file, which
+#also covers the other server processes. Without fcntl (Windows), the threads wait on one of these locks,
+#picked by the name of the plot
+_file_locks = [threading.Lock() for _ in range(64)]
+
+
+def save_plot(path, upload_folder, renderer, payload):
+    #renderer: function called as renderer(payload, file_path) that writes the plot files of file_path
+    #(the path in the upload folder without the extension). Returns the URL of the plot without extension
+    folder, filename, getcall = save_file_info(path, upload_folder)
+    if config.PLOTS_LAZY:
+        with metrics.stage("save_artifact"):
+            pending = get_store(upload_folder).pending_path(filename)
+            os.makedirs(os.path.dirname(pending), exist_ok=True)
+            tmp = pending + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+            with open(tmp, "wb") as f:
+                pickle.dump({"module": renderer.__module__, "function": renderer.__name__, "payload": payload}, f)
+            os.replace(tmp, pending)
+    else:
+        with metrics.stage("render"):
+            renderer(payload, folder + filename)
+    return getcall
+
+
+def _render_file(store, filename, file_path):
+    pending = store.pending_path(filename)
+    try:
+        f = open(pending, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        if fcntl!=None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        #another request may have rendered it while this one was waiting
+        if os.path.exists(file_path):
+            return
+        record = pickle.load(f)
+        renderer = getattr(importlib.import_module(record["module"]), record["function"])
+        #renderers draw on their own figures (see plotting.py), so different plots are rendered concurrently
+        with metrics.stage("render"):
+            renderer(record["payload"], store.base_path(filename))
+        #removed while the lock is held, the requests waiting for it find the rendered file
+        os.remove(pending)
+    store.changed(filename)
+
+
+def render_pending(upload_folder, name):
+    #renders the plot files of the requested file if they were deferred. Returns whether the file exists
+    store = get_store(upload_folder)
+    if store.file_path(name)!=None:
+        return True
+    filename = os.path.splitext(name)[0]
+    file_path = os.path.join(os.path.dirname(store.base_path(filename)), name)
+    if fcntl!=None:
+        _render_file(store, filename, file_path)
+    else:
+        with _file_locks[hash(filename) % len(_file_locks)]:
+            _render_file(store, filename, file_path)
+    return os.path.exists(file_path)
+
+
+def artifact_exists(upload_folder, name):
+    #true if the file exists or can be rendered on demand
+    store = get_store(upload_folder)
+    return store.file_path(name)!=None or os.path.exists(store.pending_path(os.path.splitext(name)[0]))
+
+
+def html_plot(payload, path):
+    #renderer of the explainers whose plot is an HTML page (LIME, DiCE). payload: {"html": page} plus the
+    #content used to draw the PNG with matplotlib when there is no browser: "bars" (see bars_png) or "tables"
+    with open(path + ".html", "w") as f:
+        f.write(payload["html"])
+    fast = payload.get("bars")!=None or payload.get("tables")!=None
+    if config.SCREENSHOT_RENDERER!="fast" or not fast:
+        try:
+            screenshot(path + ".png", html=payload["html"])
+            return
+        except Exception as e:
+            if not fast:
+                raise
+            print("Could not take the screenshot of '" + os.path.basename(path) + ".html' (" + str(e) + "). Drawing it with matplotlib instead.")
+    if payload.get("bars")!=None:
+        bars_png(payload["bars"], path + ".png")
+    else:
+        tables_png(payload["tables"], path + ".png")
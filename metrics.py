@@ -0,0 +1,295 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+import config
+import tracing
+
+## Latency metrics of the explainers, exposed in the Prometheus text format at /metrics. Every request to an
+## explainer measures the time spent in each stage (loading the model and the data, building the explainer,
+## predicting, rendering the plots...) and counts the calls to the prediction function and the rows predicted.
+## The measures are labelled by endpoint, model id and backend when the request finishes, as the backend is
+## only known once the model is loaded (it is empty for the responses of the result cache). Stages can be
+## nested: e.g. the predictions made while an explainer is built count in both stages. Work done in other
+## processes (asynchronous jobs, KernelSHAP worker processes) is not included.
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CALLS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+LABELS = ("endpoint", "model_id", "backend")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values):
+    return "{" + ",".join(name + '="' + _escape(value) + '"' for name, value in zip(names, values)) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+
+    def __init__(self, name, description, label_names, buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        #labels: tuple with the values of label_names
+        with self._lock:
+            series = self._series.get(labels)
+            if series==None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def lines(self):
+        yield "# HELP " + self.name + " " + self.description
+        yield "# TYPE " + self.name + " histogram"
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + "_bucket" + format_labels(self.label_names + ("le",), labels + (_format_number(bound),)) + " " + str(cumulative)
+            yield self.name + "_bucket" + format_labels(self.label_names + ("le",), labels + ("+Inf",)) + " " + str(count)
+            yield self.name + "_sum" + format_labels(self.label_names, labels) + " " + repr(total)
+            yield self.name + "_count" + format_labels(self.label_names, labels) + " " + str(count)
+
+
+request_seconds = Histogram("explainer_request_seconds", "Duration of the requests to the explainers.", LABELS + ("status",), SECONDS_BUCKETS)
+stage_seconds = Histogram("explainer_stage_seconds", "Time spent in each stage of a request.", LABELS + ("stage",), SECONDS_BUCKETS)
+predict_calls = Histogram("explainer_predict_calls", "Calls to the prediction function per request using it.", LABELS, CALLS_BUCKETS)
+predict_rows = Histogram("explainer_predict_rows", "Rows predicted per request using the prediction function.", LABELS, ROWS_BUCKETS)
+
+_histograms = [request_seconds, stage_seconds, predict_calls, predict_rows]
+_collectors = []
+_listeners = []
+
+
+def register_collector(collector):
+    #collector: function returning the lines of additional metrics (e.g. gauges) in the text format
+    _collectors.append(collector)
+
+
+def register_listener(listener):
+    #listener: function called with the RequestMetrics of every finished request (e.g. by the benchmarks)
+    _listeners.append(listener)
+
+
+class RequestMetrics:
+
+    def __init__(self, endpoint, model_id=None):
+        self.labels = {"endpoint": endpoint, "model_id": model_id or "", "backend": ""}
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.predict_calls = 0
+        self.predict_rows = 0
+        #calls and rows predicted within each stage, 'explain' for the ones made outside of any stage
+        self.predicts_by_stage = {}
+        self.status = None
+        self.seconds = None
+        #trace of the request, None when tracing is disabled (see tracing.py)
+        self.trace = tracing.start_trace(endpoint, endpoint=endpoint, model_id=model_id)
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_predict(self, rows, stage="explain"):
+        with self._lock:
+            self.predict_calls += 1
+            self.predict_rows += rows
+            calls = self.predicts_by_stage.setdefault(stage, [0, 0])
+            calls[0] += 1
+            calls[1] += rows
+
+    def finish(self, status):
+        self.status = status
+        self.seconds = time.perf_counter() - self.start
+        if config.METRICS:
+            labels = tuple(self.labels[name] for name in LABELS)
+            request_seconds.observe(labels + (str(status),), self.seconds)
+            with self._lock:
+                stages = dict(self.stages)
+            for stage, seconds in stages.items():
+                stage_seconds.observe(labels + (stage,), seconds)
+            if self.predict_calls:
+                predict_calls.observe(labels, self.predict_calls)
+                predict_rows.observe(labels, self.predict_rows)
+        if self.trace!=None:
+            self.trace.finish(status=status, model_id=self.labels["model_id"] or None, backend=self.labels["backend"] or None,
+                              predict_calls=self.predict_calls, predict_rows=self.predict_rows)
+        for listener in _listeners:
+            listener(self)
+
+
+_local = threading.local()
+
+
+def current():
+    return getattr(_local, "request", None)
+
+
+def _open_stages():
+    stages = getattr(_local, "stages", None)
+    if stages==None:
+        stages = _local.stages = []
+    return stages
+
+
+@contextmanager
+def attach(request_metrics):
+    #makes the measures of another thread (e.g. the workers of a batch request) count for the request
+    previous = current()
+    _local.request = request_metrics
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+def context():
+    #the request measured by the current thread and its innermost open span, handed to the threads doing
+    #work on its behalf, which record it with add_stage
+    request_metrics = current()
+    if request_metrics==None:
+        return None
+    trace = request_metrics.trace
+    return request_metrics, (trace.current_span_id() if trace!=None else None)
+
+
+def add_stage(request_context, name, start_ns, seconds, **attributes):
+    #records a stage that another thread ran for the request of request_context (see context)
+    if request_context==None:
+        return
+    request_metrics, parent_id = request_context
+    request_metrics.add_stage(name, seconds)
+    if request_metrics.trace!=None:
+        request_metrics.trace.add_span(name, parent_id, start_ns, start_ns + int(seconds * 1e9), **attributes)
+
+
+def begin(endpoint, model_id=None):
+    #starts measuring a request in the current thread. It is finished by finish() when the response is sent
+    if not config.METRICS and not tracing.enabled():
+        return None
+    _local.request = RequestMetrics(endpoint, model_id)
+    return _local.request
+
+
+def finish(status):
+    request_metrics = current()
+    _local.request = None
+    if request_metrics!=None:
+        request_metrics.finish(status)
+
+
+def set_labels(**labels):
+    request_metrics = current()
+    if request_metrics!=None:
+        request_metrics.labels.update({k: v for k, v in labels.items() if v!=None})
+
+
+@contextmanager
+def stage(name, **attributes):
+    #attributes: recorded in the trace span of the stage, e.g. the rows of a prediction
+    request_metrics = current()
+    trace = request_metrics.trace if request_metrics!=None else None
+    stages = _open_stages()
+    stages.append(name)
+    start = time.perf_counter()
+    try:
+        if trace!=None:
+            with trace.span(name, **attributes):
+                yield
+        else:
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        stages.pop()
+        if request_metrics!=None:
+            request_metrics.add_stage(name, seconds)
+        elif config.METRICS:
+            stage_seconds.observe(("", "", "", name), seconds)
+
+
+class CountedPredict:
+    #prediction function counting its calls and rows for the metrics of the current request
+    #(a class instead of a closure, so it can be pickled for the worker processes)
+
+    def __init__(self, predict_func):
+        self.predict_func = predict_func
+
+    def __call__(self, X, *args, **kwargs):
+        rows = len(X) if hasattr(X, "__len__") else 1
+        request_metrics = current()
+        if request_metrics!=None:
+            stages = _open_stages()
+            request_metrics.add_predict(rows, stages[-1] if stages else "explain")
+        with stage("predict", rows=rows):
+            return self.predict_func(X, *args, **kwargs)
+
+
+def _resident_bytes():
+    #current resident memory of the process, None where /proc is not available
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _memory_lines():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #kilobytes on Linux, bytes on macOS
+        peak = peak if sys.platform=="darwin" else peak * 1024
+    except ImportError:
+        peak = None
+    for name, description, value in (("process_resident_memory_bytes", "Resident memory size of the server process in bytes.", _resident_bytes()),
+                                     ("process_max_resident_memory_bytes", "Peak resident memory size of the server process in bytes.", peak)):
+        if value!=None:
+            yield "# HELP " + name + " " + description
+            yield "# TYPE " + name + " gauge"
+            yield name + " " + str(value)
+
+
+register_collector(_memory_lines)
+
+
+def init_app(app):
+    #finishes the measures of each request once its response is built
+    @app.after_request
+    def _finish_request(response):
+        finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exception):
+        if current()!=None:
+            finish(500)
+
+
+def render():
+    lines = []
+    for histogram in _histograms:
+        lines.extend(histogram.lines())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,10 @@
+from flask import Response
+from flask_restful import Resource
+import metrics
+
+
+class Metrics(Resource):
+
+    def get(self):
+        #Prometheus text format, returned as is instead of through the representations of the API
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
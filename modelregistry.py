@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import threading
+from collections import OrderedDict
+import config
+from getmodelfiles import get_model_paths
+from remotepredict import get_remote_predictor
+import metrics
+import predictcache
+import predictbatching
+
+
+def _file_signature(path):
+    if path==None:
+        return None
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _tf_executing_eagerly():
+    #only ask tensorflow if it was already imported by someone else
+    if "tensorflow" in sys.modules:
+        return sys.modules["tensorflow"].executing_eagerly()
+    return True
+
+
+class ModelEntry:
+
+    def __init__(self, key, model, model_info, predict_func, data_path, nbytes, eager):
+        self.key = key
+        self.model = model
+        self.model_info = model_info
+        self.predict_func = predict_func
+        self.data_path = data_path
+        self.nbytes = nbytes
+        self.eager = eager
+
+    @property
+    def backend(self):
+        return self.model_info.get("backend")
+
+
+def load_model_file(model_path, backend):
+    #returns the deserialized model, its prediction function and whether it was loaded with eager execution
+    if backend=="TF1" or backend=="TF2":
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path)
+        return model, model, tf.executing_eagerly()
+    elif backend=="sklearn":
+        import joblib
+        model = joblib.load(model_path)
+        return model, model.predict_proba if hasattr(model, "predict_proba") else model.predict, True
+    elif backend=="PYT":
+        import torch
+        model = torch.load(model_path)
+        return model, getattr(model, "predict", None), True
+    else:
+        import joblib
+        model = joblib.load(model_path)
+        return model, model.predict, True
+
+
+def load_model_entry(key, model_path, model_info_path, data_path):
+    model_info = {}
+    if model_info_path!=None:
+        with open(model_info_path) as f:
+            model_info = json.load(f)
+
+    model=None
+    predic_func=None
+    eager=True
+    if model_path!=None:
+        model, predic_func, eager = load_model_file(model_path, model_info.get("backend"))
+
+    #the size on disk is used as an estimate of the size of the deserialized model
+    nbytes = sum(os.path.getsize(p) for p in (model_path, model_info_path) if p!=None)
+    return ModelEntry(key, model, model_info, predic_func, data_path, nbytes, eager)
+
+
+class ModelRegistry:
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._keys_by_id = {}
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, _id, model_folder):
+        model_path, model_info_path, data_path = get_model_paths(_id, model_folder)
+        model_id = (os.path.abspath(model_folder), _id)
+        key = model_id + (_file_signature(model_path), _file_signature(model_info_path))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry!=None and self._is_valid(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        #only one thread loads a given model, the others wait for it and reuse the result
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry!=None and self._is_valid(entry):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                self.misses += 1
+            try:
+                entry = load_model_entry(key, model_path, model_info_path, data_path)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+            with self._lock:
+                stale = self._keys_by_id.get(model_id)
+                if stale!=None and stale!=key:
+                    self._entries.pop(stale, None)
+                self._entries[key] = entry
+                self._keys_by_id[model_id] = key
+                self._evict()
+        return entry
+
+    def invalidate(self, _id=None):
+        with self._lock:
+            for key in list(self._entries):
+                if _id==None or key[1]==_id:
+                    del self._entries[key]
+                    self._keys_by_id.pop(key[:2], None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(e.nbytes for e in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _is_valid(self, entry):
+        #models loaded with eager execution can not be reused once it has been disabled (and vice versa)
+        if entry.backend=="TF1" or entry.backend=="TF2":
+            return entry.eager==_tf_executing_eagerly()
+        return True
+
+    def _evict(self):
+        total = sum(e.nbytes for e in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            if self._keys_by_id.get(key[:2])==key:
+                del self._keys_by_id[key[:2]]
+            total -= entry.nbytes
+            self.evictions += 1
+
+
+registry = ModelRegistry(config.MODEL_CACHE_MAX_BYTES)
+
+
+def get_model(_id, model_folder):
+    with metrics.stage("load_model"):
+        entry = registry.get(_id, model_folder)
+    metrics.set_labels(model_id=_id, backend=entry.backend)
+    return entry
+
+
+def _graph_bound(entry):
+    return entry.backend=="TF1" or (entry.backend=="TF2" and not entry.eager)
+
+
+def get_predict_function(entry, url):
+    #the calls and the predicted rows are counted in the metrics of the request, and the predictions are
+    #memoized per model (or URL) so repeated rows are only predicted once (see predictcache.py). The uncached
+    #rows of concurrent requests can be merged into shared batches (see predictbatching.py)
+    if entry.predict_func!=None:
+        predict_func = entry.predict_func
+        #the merged calls run on the thread of the batcher, where the graph and session of a TensorFlow model
+        #in graph mode are not available
+        if not _graph_bound(entry):
+            predict_func = predictbatching.batched(predict_func, entry, entry.key[1])
+        return metrics.CountedPredict(predictcache.memoize(predict_func, entry, entry.key[1]))
+    elif url!=None:
+        predictor = get_remote_predictor(url)
+        predict_func = predictbatching.batched(predictor, predictor, url)
+        return metrics.CountedPredict(predictcache.memoize_url(predict_func, url))
+    return None
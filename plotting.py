@@ -0,0 +1,52 @@
+import os
+import threading
+from contextlib import contextmanager
+#the backend is selected once, before matplotlib is first imported, instead of with plt.switch_backend on
+#every request. matplotlib itself is only imported by the first plot, so it does not slow down the startup
+os.environ.setdefault("MPLBACKEND", "agg")
+
+## Figures of the explainers. The plots drawn by the server itself use their own Figure objects, which are not
+## registered with pyplot, so requests can draw them in parallel threads and they are freed with the request.
+## The SHAP plots can only draw on pyplot's current figure, which is shared by all the threads: they are drawn
+## inside pyplot_figure(), which runs them one at a time and always closes the figures they created.
+
+_pyplot_lock = threading.RLock()
+
+#number of features drawn by shap.summary_plot
+SUMMARY_MAX_DISPLAY = 20
+
+
+def new_figure(**kwargs):
+    #kwargs: arguments of matplotlib's Figure (figsize, dpi...)
+    from matplotlib.figure import Figure
+    return Figure(**kwargs)
+
+
+@contextmanager
+def pyplot_figure(**kwargs):
+    #usage: with pyplot_figure(): shap.summary_plot(..., show=False); plt.savefig(path)
+    #the plot may draw on the new figure or create its own, both are closed on exit
+    import matplotlib.pyplot as plt
+    with _pyplot_lock:
+        before = set(plt.get_fignums())
+        plt.figure(**kwargs)
+        try:
+            yield
+        finally:
+            for num in set(plt.get_fignums()) - before:
+                plt.close(num)
+
+
+def summary_payload(shap_values, features, feature_names=None, class_names=None):
+    #payload of a deferred shap.summary_plot (see lazyplots.py): only the columns of the features it draws, the
+    #SUMMARY_MAX_DISPLAY most important ones, and their Shapley values in float32
+    import numpy as np
+    values = shap_values if isinstance(shap_values, list) else [shap_values]
+    importance = sum(np.abs(np.asarray(v)).mean(axis=0) for v in values)
+    columns = np.sort(np.argsort(-importance)[:SUMMARY_MAX_DISPLAY])
+    if feature_names==None:
+        feature_names = list(features.columns) if hasattr(features, "columns") else ["Feature " + str(i) for i in range(len(importance))]
+    values = [np.asarray(v, dtype=np.float32)[:, columns] for v in values]
+    return dict(shap_values=values if isinstance(shap_values, list) else values[0],
+                features=features.iloc[:, columns] if hasattr(features, "iloc") else np.asarray(features)[:, columns],
+                feature_names=[feature_names[i] for i in columns], class_names=class_names)
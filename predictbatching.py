@@ -0,0 +1,119 @@
+import os
+import weakref
+import threading
+import numpy as np
+import config
+import metrics
+from batching import MicroBatcher
+
+## Micro-batching of the prediction functions across requests, enabled with PREDICT_BATCHING=1. Explainers
+## such as image LIME, Anchors or the counterfactual searches predict many small batches, and each call pays
+## the fixed cost of the model (framework dispatch, GPU transfers, the HTTP round trip of a prediction URL).
+## The calls of concurrent requests for the same model (or prediction URL) are queued and merged into one
+## batch of up to PREDICT_BATCH_MAX_SIZE rows, or whatever arrived within PREDICT_BATCH_MAX_WAIT seconds,
+## predicted with a single call and split back to each caller. Calls of PREDICT_BATCH_MAX_SIZE rows or more
+## are predicted directly. The batching sits below the prediction cache, so only the uncached rows are queued.
+## The merged call runs on the thread of the batcher: it is recorded as a 'predict_batch' stage and trace span
+## of every request it served. Models bound to the graph and session of a thread (TensorFlow graph mode) are
+## never batched (see modelregistry.get_predict_function).
+
+
+class BatchedPredict:
+    #prediction function whose calls are merged with those of the other requests for the same model
+
+    def __init__(self, predict_func, batcher):
+        self.predict_func = predict_func
+        self.batcher = batcher
+
+    def __getstate__(self):
+        #the worker processes predict directly, the queue and thread of the batcher stay in the server
+        return {"predict_func": self.predict_func, "batcher": None}
+
+    def __call__(self, X, *args, **kwargs):
+        if self.batcher==None or args or kwargs:
+            return self.predict_func(X, *args, **kwargs)
+        X = np.asarray(X)
+        if X.ndim==0 or len(X)==0:
+            return self.predict_func(X)
+        return self.batcher(X)
+
+
+_batchers = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    #the batchers created before a fork have no thread in the child process, which creates its own
+    global _batchers, _lock
+    for batcher in list(_batchers.values()):
+        batcher.detach()
+    _batchers = weakref.WeakKeyDictionary()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _observe(calls, start_ns, seconds):
+    batch_rows = sum(rows for _, rows in calls)
+    for request_context, rows in calls:
+        metrics.add_stage(request_context, "predict_batch", start_ns, seconds, rows=rows, batch_rows=batch_rows)
+
+
+def batched(predict_func, owner, label):
+    #owner: object the batcher lives with, the model entry or the remote predictor of a URL. The thread of
+    #the batcher stops when the owner leaves the model registry
+    if not config.PREDICT_BATCHING:
+        return predict_func
+    with _lock:
+        batcher = _batchers.get(owner)
+        if batcher==None:
+            batcher = _batchers[owner] = MicroBatcher(predict_func, max_batch_size=config.PREDICT_BATCH_MAX_SIZE,
+                                                      max_wait=config.PREDICT_BATCH_MAX_WAIT, name="predict-batcher",
+                                                      context=metrics.context, observe=_observe)
+            batcher.label = label
+            weakref.finalize(owner, batcher.close)
+    return BatchedPredict(predict_func, batcher)
+
+
+def _batchers_list():
+    with _lock:
+        return list(_batchers.values())
+
+
+def stats():
+    batchers = [b.stats() for b in _batchers_list()]
+    calls = sum(s["calls"] for s in batchers)
+    batches = sum(s["batches"] for s in batchers)
+    rows = sum(s["rows"] for s in batchers)
+    return {
+        "batchers": len(batchers),
+        "calls": calls,
+        "batches": batches,
+        "rows": rows,
+        "mean_batch_rows": rows / batches if batches else 0.0,
+        "max_batch_size": config.PREDICT_BATCH_MAX_SIZE,
+        "max_wait": config.PREDICT_BATCH_MAX_WAIT,
+    }
+
+
+def _metric_lines():
+    #the batchers of older versions of a model may still be alive, they are added to the current one
+    totals = {}
+    for batcher in _batchers_list():
+        s = batcher.stats()
+        total = totals.setdefault(batcher.label, {"calls": 0, "batches": 0, "rows": 0})
+        for k in total:
+            total[k] += s[k]
+    for name, description, key in (
+            ("prediction_batcher_calls_total", "Calls to the prediction function queued by the micro-batcher.", "calls"),
+            ("prediction_batcher_batches_total", "Batches sent to the model by the micro-batcher.", "batches"),
+            ("prediction_batcher_rows_total", "Rows sent to the model by the micro-batcher.", "rows")):
+        yield "# HELP " + name + " " + description
+        yield "# TYPE " + name + " counter"
+        for label in sorted(totals):
+            yield name + metrics.format_labels(("model",), (label,)) + " " + str(totals[label][key])
+
+
+metrics.register_collector(_metric_lines)
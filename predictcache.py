@@ -0,0 +1,221 @@
+import json
+import time
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+import numpy as np
+import config
+import metrics
+
+## Memoization of the prediction functions. On tabular data, LIME (with categorical or discretized features),
+## the precision sampling of Anchors and KernelSHAP predict many identical perturbed rows, within an explanation
+## and across the requests for the same model. Each model (or prediction URL) gets a cache of the outputs of
+## the rows it predicted, keyed by a hash of the row: only the rows never seen before are sent to the model,
+## and the cached outputs are put back in their place. Only tabular inputs (one row of features per instance)
+## are memoized: hashing every image tensor or text costs more than the rare hits of their perturbations save.
+## The caches are bounded by PREDICT_CACHE_MAX_BYTES each, evicting the least recently used rows. The caches of
+## the models are dropped with their model once it has left the model registry and the explainer cache (see
+## explainercache.py). The URLs are given by the clients, so only the PREDICT_CACHE_MAX_URLS most recently used
+## ones keep a cache, and their outputs expire after PREDICT_CACHE_URL_TTL seconds in case the model behind
+## the URL is redeployed.
+
+#estimated memory used by an entry besides its output (key, tuple, timestamp, dict and list slots)
+_ENTRY_OVERHEAD = 200
+
+
+def row_keys(X):
+    #hash of each row, including its dtype and shape so different inputs never share an entry. The width of
+    #string dtypes depends on the longest string of the batch, so rows with strings are hashed by value
+    if X.dtype.hasobject or X.dtype.kind in "US":
+        prefix = ("text" + str(X.shape[1:])).encode()
+        rows = (json.dumps(row.tolist() if isinstance(row, np.ndarray) else row, default=str).encode() for row in X)
+    else:
+        prefix = (str(X.dtype) + str(X.shape[1:])).encode()
+        X = np.ascontiguousarray(X)
+        rows = (row.tobytes() for row in X)
+    return [hashlib.blake2b(prefix + row, digest_size=16).digest() for row in rows]
+
+
+class PredictionCache:
+
+    def __init__(self, label, max_bytes, ttl=0):
+        #label: model id or URL of the predictions, used in the metrics
+        #ttl: seconds after which a cached output is predicted again (0 keeps them until they are evicted)
+        self.label = label
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.closed = False
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def lookup(self, keys):
+        #cached outputs of the keys, None for the missing ones
+        with self._lock:
+            now = time.monotonic()
+            outputs = []
+            for key in keys:
+                entry = self._entries.get(key)
+                output = None
+                if entry is not None:
+                    if self.ttl and now - entry[1] > self.ttl:
+                        del self._entries[key]
+                        self.bytes -= entry[0].nbytes + _ENTRY_OVERHEAD
+                        self.expired += 1
+                    else:
+                        self._entries.move_to_end(key)
+                        output = entry[0]
+                outputs.append(output)
+            found = sum(1 for output in outputs if output is not None)
+            self.hits += found
+            self.misses += len(keys) - found
+            return outputs
+
+    def store(self, keys, outputs):
+        with self._lock:
+            #a cache dropped from the caches of the URLs may still be used by an explainer, it no longer grows
+            if self.closed:
+                return
+            now = time.monotonic()
+            for key, output in zip(keys, outputs):
+                if key not in self._entries:
+                    self._entries[key] = (output, now)
+                    self.bytes += output.nbytes + _ENTRY_OVERHEAD
+            while self.bytes > self.max_bytes and self._entries:
+                _, entry = self._entries.popitem(last=False)
+                self.bytes -= entry[0].nbytes + _ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"rows": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "expired": self.expired}
+
+
+class MemoizedPredict:
+    #prediction function only predicting the rows missing from the cache
+
+    def __init__(self, predict_func, cache):
+        self.predict_func = predict_func
+        self.cache = cache
+
+    def __getstate__(self):
+        #the worker processes predict without the cache of the server
+        return {"predict_func": self.predict_func, "cache": None}
+
+    def __call__(self, X, *args, **kwargs):
+        if self.cache==None or args or kwargs:
+            return self.predict_func(X, *args, **kwargs)
+        X = np.asarray(X)
+        if X.ndim!=2 or len(X)==0:
+            return self.predict_func(X)
+        keys = row_keys(X)
+        outputs = self.cache.lookup(keys)
+        #the rows to predict, each distinct row only once
+        missing = OrderedDict()
+        for i, (key, output) in enumerate(zip(keys, outputs)):
+            if output is None and key not in missing:
+                missing[key] = i
+        if missing:
+            with metrics.stage("predict_uncached", rows=len(missing)):
+                predicted = np.asarray(self.predict_func(X[list(missing.values())]))
+            self.cache.store(list(missing), [output.copy() for output in predicted])
+            new = dict(zip(missing, predicted))
+            outputs = [new[key] if output is None else output for key, output in zip(keys, outputs)]
+        return np.stack(outputs)
+
+
+_caches = weakref.WeakKeyDictionary()
+#caches of the prediction URLs, from the least to the most recently used
+_url_caches = OrderedDict()
+_lock = threading.Lock()
+
+
+def memoize(predict_func, owner, label):
+    #owner: model entry the cache lives with
+    if not config.PREDICT_CACHE or config.PREDICT_CACHE_MAX_BYTES<=0:
+        return predict_func
+    with _lock:
+        cache = _caches.get(owner)
+        if cache==None:
+            cache = _caches[owner] = PredictionCache(label, config.PREDICT_CACHE_MAX_BYTES)
+    return MemoizedPredict(predict_func, cache)
+
+
+def memoize_url(predict_func, url):
+    if not config.PREDICT_CACHE or config.PREDICT_CACHE_MAX_BYTES<=0 or config.PREDICT_CACHE_MAX_URLS<=0:
+        return predict_func
+    with _lock:
+        cache = _url_caches.get(url)
+        if cache==None:
+            cache = _url_caches[url] = PredictionCache(url, config.PREDICT_CACHE_MAX_BYTES, config.PREDICT_CACHE_URL_TTL)
+            while len(_url_caches) > config.PREDICT_CACHE_MAX_URLS:
+                _, evicted = _url_caches.popitem(last=False)
+                evicted.close()
+        else:
+            _url_caches.move_to_end(url)
+    return MemoizedPredict(predict_func, cache)
+
+
+def _caches_list():
+    with _lock:
+        return list(_caches.values()) + list(_url_caches.values())
+
+
+def invalidate():
+    for cache in _caches_list():
+        cache.clear()
+
+
+def stats():
+    caches = _caches_list()
+    return {
+        "caches": len(caches),
+        "url_caches": len(_url_caches),
+        "max_urls": config.PREDICT_CACHE_MAX_URLS,
+        "url_ttl": config.PREDICT_CACHE_URL_TTL,
+        "rows": sum(c.stats()["rows"] for c in caches),
+        "bytes": sum(c.bytes for c in caches),
+        "max_bytes_per_cache": config.PREDICT_CACHE_MAX_BYTES,
+        "hits": sum(c.hits for c in caches),
+        "misses": sum(c.misses for c in caches),
+        "evictions": sum(c.evictions for c in caches),
+        "expired": sum(c.expired for c in caches),
+    }
+
+
+def _metric_lines():
+    #the caches of older versions of a model may still be alive, they are added to the current one
+    totals = {}
+    for cache in _caches_list():
+        s = cache.stats()
+        total = totals.setdefault(cache.label, {"hits": 0, "misses": 0, "bytes": 0})
+        for k in total:
+            total[k] += s[k]
+    for name, kind, description, key in (
+            ("prediction_cache_hits_total", "counter", "Rows whose prediction was found in the cache.", "hits"),
+            ("prediction_cache_misses_total", "counter", "Rows sent to the model by the prediction cache.", "misses"),
+            ("prediction_cache_bytes", "gauge", "Estimated memory used by the prediction cache.", "bytes")):
+        yield "# HELP " + name + " " + description
+        yield "# TYPE " + name + " " + kind
+        for label in sorted(totals):
+            yield name + metrics.format_labels(("model",), (label,)) + " " + str(totals[label][key])
+
+
+metrics.register_collector(_metric_lines)
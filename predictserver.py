@@ -0,0 +1,144 @@
+import io
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+from collections import deque
+import numpy as np
+from flask import Flask, Response, request
+from flask_restful import Api, Resource
+from batching import MicroBatcher
+from modelregistry import load_model_file
+from remotepredict import NPY_MEDIA_TYPE
+
+## Reference server for the prediction functions used through the 'url' parameter of the explainers.
+## The model is loaded once at startup, concurrent requests are merged with dynamic micro-batching,
+## inputs are accepted as binary .npy arrays (optionally gzip-compressed) or as the JSON 'inputs' field,
+## and latency statistics are available at /Stats.
+##
+## Usage: python predictserver.py <model file> [--backend sklearn|TF2|PYT|other] [--method predict_proba] [--port 6000]
+
+BACKENDS_BY_EXTENSION = {".pkl": "sklearn", ".h5": "TF2", ".pt": "PYT"}
+
+
+def load_predict_function(model_path, backend=None, method=None):
+    if backend==None:
+        backend = BACKENDS_BY_EXTENSION.get(model_path[model_path.rfind("."):], "other")
+    model, predic_func, _ = load_model_file(model_path, backend)
+    if method!=None:
+        predic_func = getattr(model, method)
+    elif backend=="TF1" or backend=="TF2":
+        predic_func = model.predict
+
+    def predict(X):
+        return np.asarray(predic_func(X))
+    return predict
+
+
+class LatencyStats:
+
+    def __init__(self, window=10000):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rows = 0
+
+    def record(self, seconds, rows, error=False):
+        with self._lock:
+            self._latencies.append(seconds)
+            self.requests += 1
+            self.rows += rows
+            if error:
+                self.errors += 1
+
+    def summary(self):
+        with self._lock:
+            latencies = np.array(self._latencies)
+            summary = {"requests": self.requests, "errors": self.errors, "rows": self.rows, "window": len(latencies)}
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            summary.update({"mean_ms": latencies.mean() * 1000, "p50_ms": p50 * 1000, "p95_ms": p95 * 1000,
+                            "p99_ms": p99 * 1000, "max_ms": latencies.max() * 1000})
+        return summary
+
+
+def read_inputs():
+    body = request.get_data()
+    if request.headers.get("Content-Encoding", "")=="gzip":
+        body = gzip.decompress(body)
+    if request.mimetype==NPY_MEDIA_TYPE:
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    if request.mimetype=="application/json":
+        return np.array(json.loads(body)["inputs"])
+    inputs = request.form.get("inputs")
+    if inputs==None:
+        raise ValueError("The 'inputs' field was not provided.")
+    return np.array(json.loads(inputs))
+
+
+def write_outputs(outputs):
+    if request.accept_mimetypes.best_match(["application/json", NPY_MEDIA_TYPE])==NPY_MEDIA_TYPE:
+        buffer = io.BytesIO()
+        np.save(buffer, outputs, allow_pickle=False)
+        body = buffer.getvalue()
+        response = Response(body, mimetype=NPY_MEDIA_TYPE)
+        if len(body) >= 65536 and "gzip" in request.headers.get("Accept-Encoding", ""):
+            response.set_data(gzip.compress(body, compresslevel=1))
+            response.headers["Content-Encoding"] = "gzip"
+        return response
+    return outputs.tolist()
+
+
+def create_app(predict_func, max_batch_size=256, max_wait=0.005):
+    batcher = MicroBatcher(predict_func, max_batch_size=max_batch_size, max_wait=max_wait)
+    stats = LatencyStats()
+
+    class Predict(Resource):
+
+        def post(self):
+            start = time.perf_counter()
+            rows = 0
+            try:
+                try:
+                    inputs = read_inputs()
+                except Exception as e:
+                    stats.record(time.perf_counter() - start, 0, error=True)
+                    return {"message": "Could not read the inputs: " + str(e)}, 400
+                rows = len(inputs)
+                response = write_outputs(batcher(inputs))
+            except Exception:
+                stats.record(time.perf_counter() - start, rows, error=True)
+                raise
+            stats.record(time.perf_counter() - start, rows)
+            return response
+
+    class Stats(Resource):
+
+        def get(self):
+            return {"latency": stats.summary(), "batching": batcher.stats()}
+
+    app = Flask(__name__)
+    api = Api(app)
+    api.add_resource(Predict, '/Predict')
+    api.add_resource(Stats, '/Stats')
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves the prediction function of a model for the 'url' parameter of the explainers.")
+    parser.add_argument("model", help="Model file (.pkl, .h5 or .pt)")
+    parser.add_argument("--backend", help="sklearn, TF1, TF2, PYT or other. Inferred from the file extension by default.")
+    parser.add_argument("--method", help="Name of the prediction method of the model, e.g. predict_proba.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6000)
+    parser.add_argument("--max-batch-size", type=int, default=256, help="Maximum number of rows merged into a single model call.")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="Maximum time a request waits for others to be batched with.")
+    args = parser.parse_args()
+
+    cli = sys.modules['flask.cli']
+    cli.show_server_banner = lambda *x: None
+    app = create_app(load_predict_function(args.model, args.backend, args.method), args.max_batch_size, args.max_wait_ms / 1000)
+    app.run(host=args.host, port=args.port, threaded=True)
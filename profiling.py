@@ -0,0 +1,171 @@
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+from flask import request
+import config
+from saveinfo import save_file_info
+
+## On-demand profiling of single explanation requests, enabled with PROFILING=1. A request asks for it with the
+## 'X-Profile' header or the 'profile' argument:
+##   sample    a sampling profiler records the stack of the request thread every PROFILING_INTERVAL seconds.
+##             Saves the call tree of the samples (.txt) and the folded stacks (.folded), which can be drawn
+##             with flamegraph.pl or speedscope
+##   cprofile  the deterministic profiler of the standard library. Saves the functions sorted by cumulative
+##             time with their callees (.txt) and the raw statistics (.prof) for snakeviz or pstats
+## The files are saved as an artifact of the upload folder and linked in the 'profile' field of the response.
+## Only the thread of the request is profiled: the work of other threads (batch workers, remote chunks) and
+## processes shows as the time spent waiting for them.
+
+MODES = ("sample", "cprofile")
+
+#nodes of the call tree below this share of the samples are not printed
+_MIN_SHARE = 0.005
+
+
+def requested_mode():
+    #profiling mode asked by the request, None if there is none or profiling is disabled
+    if not config.PROFILING:
+        return None
+    mode = request.headers.get("X-Profile")
+    if mode==None:
+        mode = request.values.get("profile")
+        body = request.get_json(silent=True) if request.is_json else None
+        if mode==None and isinstance(body, dict):
+            mode = body.get("profile")
+    if mode==None or str(mode).lower() in ("", "0", "false", "no"):
+        return None
+    if config.PROFILING_TOKEN and request.headers.get("X-Profile-Token")!=config.PROFILING_TOKEN:
+        return None
+    mode = str(mode).lower()
+    return mode if mode in MODES else "sample"
+
+
+def _label(code):
+    #function name with its file relative to the import path, e.g. shap/explainers/_tree.py:shap_values
+    filename = code.co_filename
+    for prefix in _path_prefixes():
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    return (filename + ":" + code.co_name).replace(";", ",").replace(" ", "_")
+
+
+def _path_prefixes():
+    #longest first, so site-packages wins over the prefix of the interpreter
+    return sorted((p for p in sys.path if p), key=len, reverse=True)
+
+
+class SamplingProfiler:
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval!=None else config.PROFILING_INTERVAL
+        self.samples = {}
+        self.total = 0
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, root_frame):
+        #the stacks are recorded from root_frame (excluded) down to the running function
+        self._target = threading.get_ident()
+        self._root = root_frame
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self._start
+
+    def _run(self):
+        labels = {}
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame!=None and frame is not self._root:
+                code = frame.f_code
+                label = labels.get(code)
+                if label==None:
+                    label = labels[code] = _label(code)
+                stack.append(label)
+                frame = frame.f_back
+            if stack:
+                stack = tuple(reversed(stack))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+                self.total += 1
+
+    def folded(self):
+        return "".join(";".join(stack) + " " + str(count) + "\n" for stack, count in sorted(self.samples.items()))
+
+    def call_tree(self):
+        tree = {}
+        for stack, count in self.samples.items():
+            node = tree
+            for label in stack:
+                entry = node.setdefault(label, [0, {}])
+                entry[0] += count
+                node = entry[1]
+        lines = ["%d samples every %.1f ms over %.3f s" % (self.total, self.interval * 1000, self.seconds), ""]
+
+        def write(node, depth):
+            for label, (count, children) in sorted(node.items(), key=lambda item: -item[1][0]):
+                if count < _MIN_SHARE * self.total:
+                    continue
+                lines.append("%6.1f%% %6d  %s%s" % (100.0 * count / self.total, count, "  " * depth, label))
+                write(children, depth + 1)
+        write(tree, 0)
+        return "\n".join(lines) + "\n"
+
+    def save(self, base_path):
+        with open(base_path + ".txt", "w") as f:
+            f.write(self.call_tree())
+        with open(base_path + ".folded", "w") as f:
+            f.write(self.folded())
+        return {"call_tree": ".txt", "folded_stacks": ".folded"}
+
+
+class DeterministicProfiler:
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self, root_frame):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def save(self, base_path):
+        self.profile.dump_stats(base_path + ".prof")
+        text = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=text).sort_stats("cumulative")
+        stats.print_stats(60)
+        stats.print_callees(30)
+        with open(base_path + ".txt", "w") as f:
+            f.write(text.getvalue())
+        return {"call_tree": ".txt", "stats": ".prof"}
+
+
+@contextmanager
+def profile(mode):
+    #usage: with profile("sample") as profiler: ...; links = save_profile(profiler, upload_folder)
+    profiler = DeterministicProfiler() if mode=="cprofile" else SamplingProfiler()
+    #the frame of the caller of the with statement is the root of the sampled stacks
+    profiler.start(sys._getframe(2))
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+
+
+def save_profile(profiler, upload_folder):
+    #saves the files of the profile as an artifact, returns their URLs
+    folder, filename, getcall = save_file_info(request.path + "/Profile", upload_folder)
+    extensions = profiler.save(folder + filename)
+    return {name: getcall + extension for name, extension in extensions.items()}
@@ -0,0 +1,168 @@
+import io
+import os
+import time
+import gzip
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+import config
+
+## Client for the prediction functions exposed through an external URL.
+## Connections are pooled and kept alive per URL, and the inputs are sent as a binary NumPy (.npy) array,
+## gzip-compressed when large. Servers that do not understand the binary format get the original
+## form-encoded JSON request ('inputs' field), and the client remembers which format each URL accepts.
+
+NPY_MEDIA_TYPE = "application/x-npy"
+
+#status codes returned by servers that only accept the form-encoded JSON inputs
+FALLBACK_STATUS_CODES = (400, 405, 415, 422)
+
+#status codes worth retrying, usually returned by a busy or restarting prediction service
+RETRY_STATUS_CODES = (502, 503, 504)
+
+_sessions = {}
+_protocols = {}
+_predictors = {}
+_executor = None
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    #threads, pooled connections and locks held by other threads are not inherited by forked worker processes
+    global _executor, _lock
+    _executor = None
+    _lock = threading.Lock()
+    _sessions.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor==None:
+            _executor = ThreadPoolExecutor(max_workers=config.REMOTE_MAX_WORKERS, thread_name_prefix="remote-predict")
+        return _executor
+
+
+def get_session(url):
+    with _lock:
+        session = _sessions.get(url)
+        if session==None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config.REMOTE_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[url] = session
+        return session
+
+
+def encode_npy(X, compress_min_bytes):
+    buffer = io.BytesIO()
+    np.save(buffer, X, allow_pickle=False)
+    body = buffer.getvalue()
+    headers = {"Content-Type": NPY_MEDIA_TYPE, "Accept": NPY_MEDIA_TYPE + ", application/json;q=0.5"}
+    if compress_min_bytes!=None and len(body) >= compress_min_bytes:
+        body = gzip.compress(body, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
+
+
+def decode_response(response):
+    if response.headers.get("Content-Type", "").startswith(NPY_MEDIA_TYPE):
+        return np.load(io.BytesIO(response.content), allow_pickle=False)
+    return np.array(json.loads(response.text))
+
+
+class RemotePredictor:
+
+    def __init__(self, url, timeout=None, compress_min_bytes=None, chunk_size=None, max_in_flight=None, retries=None):
+        self.url = url
+        self.timeout = timeout if timeout!=None else config.REMOTE_TIMEOUT
+        self.compress_min_bytes = compress_min_bytes if compress_min_bytes!=None else config.REMOTE_COMPRESS_MIN_BYTES
+        self.chunk_size = chunk_size if chunk_size!=None else config.REMOTE_CHUNK_SIZE
+        self.max_in_flight = max_in_flight if max_in_flight!=None else config.REMOTE_MAX_IN_FLIGHT
+        self.retries = retries if retries!=None else config.REMOTE_RETRIES
+
+    @property
+    def protocol(self):
+        return _protocols.get(self.url)
+
+    def __call__(self, X):
+        X = np.asarray(X)
+        if self.chunk_size<=0 or len(X) <= self.chunk_size or self.max_in_flight<=1:
+            return self._predict_with_retries(X)
+        chunks = [X[i:i + self.chunk_size] for i in range(0, len(X), self.chunk_size)]
+        if self.protocol==None:
+            #the first chunk negotiates the format before the others are sent
+            results = [self._predict_with_retries(chunks[0])]
+            results.extend(self._predict_concurrently(chunks[1:]))
+        else:
+            results = self._predict_concurrently(chunks)
+        return np.concatenate(results, axis=0)
+
+    def _predict_concurrently(self, chunks):
+        executor = get_executor()
+        results = [None] * len(chunks)
+        pending = {}
+        next_chunk = 0
+        try:
+            while next_chunk < len(chunks) or pending:
+                while next_chunk < len(chunks) and len(pending) < self.max_in_flight:
+                    pending[executor.submit(self._predict_with_retries, chunks[next_chunk])] = next_chunk
+                    next_chunk += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+        return results
+
+    def _predict_with_retries(self, X):
+        attempt = 0
+        while True:
+            try:
+                return self._predict(X)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.HTTPError as e:
+                if e.response==None or e.response.status_code not in RETRY_STATUS_CODES:
+                    raise
+                error = e
+            attempt += 1
+            if attempt > self.retries:
+                raise error
+            time.sleep(config.REMOTE_RETRY_BACKOFF * 2**(attempt - 1))
+
+    def _predict(self, X):
+        if self.protocol!="json" and not X.dtype.hasobject:
+            body, headers = encode_npy(X, self.compress_min_bytes)
+            response = get_session(self.url).post(self.url, data=body, headers=headers, timeout=self.timeout)
+            if response.status_code not in FALLBACK_STATUS_CODES:
+                response.raise_for_status()
+                _protocols[self.url] = "npy"
+                return decode_response(response)
+            if self.protocol=="npy":
+                response.raise_for_status()
+            _protocols[self.url] = "json"
+        return self._post_json(X)
+
+    def _post_json(self, X):
+        response = get_session(self.url).post(self.url, data=dict(inputs=json.dumps(X.tolist())), timeout=self.timeout)
+        response.raise_for_status()
+        return decode_response(response)
+
+
+def get_remote_predictor(url):
+    with _lock:
+        predictor = _predictors.get(url)
+        if predictor==None:
+            predictor = RemotePredictor(url)
+            _predictors[url] = predictor
+        return predictor
@@ -2,17 +2,12 @@ from flask_restful import Resource,reqparse
 from flask import request
 from PIL import Image
 import numpy as np
-import tensorflow as tf
-import torch
-import h5py
-import joblib
 import json
 import werkzeug
-import matplotlib.pyplot as plt
 from alibi.explainers import AnchorImage
 from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from plotting import new_figure
+from modelregistry import get_model, get_predict_function
 
 class AnchorsImage(Resource):
 
@@ -42,33 +37,18 @@ class AnchorsImage(Resource):
         predic_func=None
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
         backend = model_info["backend"]  ##error handling?
         if "output_names" in model_info:
             output_names=model_info["output_names"]
 
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp.predict
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if entry.model!=None and (backend=="TF1" or backend=="TF2"):
+            predic_func=entry.model.predict
+        if predic_func==None:
             raise Exception("Either a locally stored model or an URL for the prediction function of the model must be provided.")
                 
         if instance!=None:
@@ -86,7 +66,6 @@ class AnchorsImage(Resource):
 
         if len(image.shape)<3:
             image = image.reshape(image.shape + (1,))
-            plt.gray()
 
         segmentation_fn='slic'
         if "segmentation_fn" in params_json:
@@ -99,8 +78,10 @@ class AnchorsImage(Resource):
         explainer = AnchorImage(predic_func, image.shape, segmentation_fn=segmentation_fn)
         explanation = explainer.explain(image,threshold)
        
-        fig, axes = plt.subplots(1,1, figsize = (4, 4))
-        axes.imshow(explanation.anchor)
+        fig = new_figure(figsize = (4, 4))
+        axes = fig.subplots(1,1)
+        #grayscale images have a single channel
+        axes.imshow(explanation.anchor,cmap="gray" if image.shape[-1]==1 else None)
         if output_names!=None:
             axes.set_title('Predicted Class: {}'.format(output_names[explanation.raw["prediction"][0]]))
         else:
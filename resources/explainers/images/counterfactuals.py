@@ -3,16 +3,12 @@ from flask import request
 from PIL import Image
 import numpy as np
 import tensorflow as tf
-import torch
-import h5py
-import joblib
 import json
 import werkzeug
-import matplotlib.pyplot as plt
 from alibi.explainers import Counterfactual
 from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from plotting import new_figure
+from modelregistry import get_model, get_predict_function
 
 class CounterfactualsImage(Resource):
 
@@ -42,33 +38,15 @@ class CounterfactualsImage(Resource):
         output_names=None
         predic_func=None
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
         if "output_names" in model_info:
             output_names=model_info["output_names"]
 
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either an ID for a locally stored model or an URL for the prediction function of the model must be provided.")
         
             
@@ -86,7 +64,6 @@ class CounterfactualsImage(Resource):
             raise Exception("Either an image file or a matrix representative of the image must be provided.")
         if len(image.shape)<3:
             image = image.reshape(image.shape + (1,))
-            plt.gray()
         image=image.reshape((1,) + image.shape)
         
 
@@ -103,8 +80,10 @@ class CounterfactualsImage(Resource):
         pred_class = explanation.cf['class']
         proba = explanation.cf['proba'][0][pred_class]       
 
-        fig, axes = plt.subplots(1,1, figsize = (4, 4))
-        axes.imshow(explanation.cf['X'][0])
+        fig = new_figure(figsize = (4, 4))
+        axes = fig.subplots(1,1)
+        #grayscale images have a single channel
+        axes.imshow(explanation.cf['X'][0],cmap="gray" if image.shape[-1]==1 else None)
 
         if output_names!=None:
             axes.set_title('Original Class: {}\nCounterfactual Class: {}\nProbability {:.3f}'.format(output_names[explanation.orig_class],output_names[pred_class],proba))  
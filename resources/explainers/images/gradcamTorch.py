@@ -5,12 +5,11 @@ import numpy as np
 import torch
 import json
 import werkzeug
-import numpy as np
 from pytorch_grad_cam.utils.image import show_cam_on_image,preprocess_image
 from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
 from pytorch_grad_cam import GradCAM
 from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from modelregistry import get_model
 
 class GradCamTorch(Resource):
 
@@ -35,11 +34,11 @@ class GradCamTorch(Resource):
             params_json = json.loads(params)
 
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         #loading model
-        if model_file!=None:
-            mlp = torch.load(model_file)
+        if entry.model!=None:
+            mlp = entry.model
             mlp.eval()
         else:
             raise Exception("This method requires a PyTorch model to be uploaded.")
@@ -48,7 +47,7 @@ class GradCamTorch(Resource):
         target_layers=None
         mean=[0.5,0.5,0.5]
         std=[0.5,0.5,0.5]
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
         backend = model_info["backend"]  
         if backend!="PYT":
             raise Exception("Only PyTorch models are compatible with this explanation method.")
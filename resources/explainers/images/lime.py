@@ -4,17 +4,12 @@ from lime.wrappers.scikit_image import SegmentationAlgorithm
 from skimage.segmentation import mark_boundaries
 from PIL import Image
 import numpy as np
-import tensorflow as tf
-import torch
-import h5py
-import joblib
 import json
 import werkzeug
-import matplotlib.pyplot as plt
 from lime import lime_image
 from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from plotting import new_figure
+from modelregistry import get_model, get_predict_function
 
 class LimeImage(Resource):
 
@@ -44,33 +39,15 @@ class LimeImage(Resource):
         predic_func=None
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
         if "output_names" in model_info:
             output_names=model_info["output_names"]
 
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either an ID for a locally stored model or an URL for the prediction function of the model must be provided.")
         
         
@@ -97,7 +74,8 @@ class LimeImage(Resource):
         explainer = lime_image.LimeImageExplainer()
         explanation = explainer.explain_instance(image, classifier_fn=predic_func,**{k: v for k, v in kwargsData.items() if v is not None})
 
-        fig, axes = plt.subplots(1,len(explanation.top_labels), figsize = (12, 12))
+        fig = new_figure(figsize = (12, 12))
+        axes = fig.subplots(1,len(explanation.top_labels))
         i=0
         for cat in explanation.top_labels:
             temp, mask = explanation.get_image_and_mask(cat, positive_only=False,hide_rest=False)
@@ -1,17 +1,23 @@
 from flask_restful import Resource,reqparse
-import tensorflow as tf
-import torch
-import numpy as np
-import joblib
-import h5py
 import json
 from alibi.explainers import ALE, plot_ale
 import math
-import matplotlib.pyplot as plt
 from flask import request
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from lazyplots import save_plot
+from plotting import new_figure
+from datacache import get_training_data
+from jobs import report_progress
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
+
+
+def plot(payload, path):
+    dim = payload["dim"]
+    fig = new_figure()
+    ax = fig.subplots(dim, dim, sharey='all');
+    plot_ale(payload["explanation"],ax=ax,fig_kw={'figwidth': 12, 'figheight': 10})
+    fig.savefig(path+'.png')
+
 
 class Ale(Resource):
     
@@ -34,17 +40,15 @@ class Ale(Resource):
             params_json = json.loads(params)
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
 
         ##getting params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
 
         kwargsData = dict(feature_names=None,target_names=None)
         if "feature_names" in model_info:
@@ -53,26 +57,8 @@ class Ale(Resource):
             kwargsData["target_names"] = model_info["output_names"]
 
         ## getting predict function
-        predic_func=None
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
       
         #getting params from request
@@ -81,8 +67,10 @@ class Ale(Resource):
             kwargsData2["features"] = params_json["features_to_show"]
 
 
-        proba_ale_lr = ALE(predic_func, **{k: v for k, v in kwargsData.items()})
-        proba_exp_lr = proba_ale_lr.explain(dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False).to_numpy(),**{k: v for k, v in kwargsData2.items()})
+        report_progress(0.1, "Computing the accumulated local effects")
+        proba_ale_lr = get_explainer("ALE", entry, data, lambda: ALE(predic_func, **{k: v for k, v in kwargsData.items()}), url,
+                                     predict_func=predic_func)
+        proba_exp_lr = proba_ale_lr.explain(data.features,**{k: v for k, v in kwargsData2.items()})
         
         
         if(kwargsData2["features"]!=None):
@@ -90,11 +78,8 @@ class Ale(Resource):
         else:
             dim = math.ceil(len(proba_exp_lr.feature_names)**(1/2))
 
-        fig, ax = plt.subplots(dim, dim, sharey='all');
-        plot_ale(proba_exp_lr,ax=ax,fig_kw={'figwidth': 12, 'figheight': 10})
-        #saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        fig.savefig(upload_folder+filename+'.png')
+        #saving (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,dict(explanation=proba_exp_lr,dim=dim))
 
         response = {"plot_png":getcall+'.png',"explanation":json.loads(proba_exp_lr.to_json())}
         return response
@@ -109,6 +94,7 @@ class Ale(Resource):
         "id": "Identifier of the ML model that was stored locally.",
         "url": "External URL of the prediction function. Ignored if a model file was uploaded to the server. "
                "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
+        "async": "(Optional) Set to true to run the explanation as a background job. The response contains the job id and the status_url to poll for its progress and result.",
         "params": { 
                 "features_to_show": "(Optional) Array of ints representing the indices of the features to be explained. Defaults to all features"
                 }
@@ -1,13 +1,18 @@
 from flask_restful import Resource,reqparse
-import tensorflow as tf
-import torch
 import numpy as np
-import joblib
-import h5py
+import copy
 import json
 from alibi.explainers import AnchorTabular
-from getmodelfiles import get_model_files
-import requests
+from datacache import get_training_data
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
+
+def copy_anchors_explainer(explainer):
+    #the samplers keep the state of the instance being explained, so they are not shared between requests
+    explainer = copy.copy(explainer)
+    explainer.samplers = [copy.copy(sampler) for sampler in explainer.samplers]
+    return explainer
+
 
 class Anchors(Resource):
 
@@ -32,17 +37,15 @@ class Anchors(Resource):
             params_json = json.loads(params)
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
 
         ##getting params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
 
         kwargsData = dict(feature_names=None,categorical_names=None, ohe=False)
         if "feature_names" in model_info:
@@ -54,26 +57,8 @@ class Anchors(Resource):
             kwargsData["ohe"] = model_info["ohe"]
 
         ## getting predict function
-        predic_func=None
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
 
         #getting params from request
@@ -82,9 +67,17 @@ class Anchors(Resource):
             kwargsData2["threshold"] = params_json["threshold"]
 
         # Create data
-        explainer = AnchorTabular(predic_func, **{k: v for k, v in kwargsData.items()})
-
-        explainer.fit(dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False).to_numpy(), disc_perc=(25, 50, 75))
+        def fit_explainer():
+            explainer = AnchorTabular(predic_func, **{k: v for k, v in kwargsData.items()})
+            explainer.fit(data.features, disc_perc=(25, 50, 75))
+            return explainer
+        if "seed" in params_json:
+            #seeded runs get a new explainer, so the random state starts from the seed
+            kwargsData["seed"] = params_json["seed"]
+            explainer = fit_explainer()
+        else:
+            explainer = get_explainer("Anchors", entry, data, fit_explainer, url, copy_function=copy_anchors_explainer,
+                                      predict_func=predic_func)
         
         explanation = explainer.explain(np.array(instance), **{k: v for k, v in kwargsData2.items()})
         
@@ -108,7 +101,8 @@ class Anchors(Resource):
                "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
 
         "params": { 
-                "threshold": "(Optional) The minimum level of precision required for the anchors. Default is 0.95"
+                "threshold": "(Optional) The minimum level of precision required for the anchors. Default is 0.95",
+                "seed": "(Optional) Int used as the seed of the sampling process. The sampler uses the global random state of numpy, so concurrent requests may still change the explanation."
                 }
 
        
@@ -0,0 +1,100 @@
+from flask_restful import Resource,reqparse
+import numpy as np
+import json
+from alibi.explainers import AnchorTabular
+from datacache import get_training_data
+from resources.explainers.tabular.anchors import copy_anchors_explainer
+from explainbatch import parse_instances, map_instances
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
+
+class AnchorsBatch(Resource):
+
+    def __init__(self,model_folder,upload_folder):
+        self.model_folder = model_folder
+        self.upload_folder = upload_folder
+
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument("id", required=True)
+        parser.add_argument("instances", required=True)
+        parser.add_argument("url")
+        parser.add_argument('params')
+        args = parser.parse_args()
+
+        _id = args.get("id")
+        instances = parse_instances(args.get("instances"))
+        url = args.get("url")
+        params=args.get("params")
+        params_json={}
+        if(params !=None):
+            params_json = json.loads(params)
+
+        #Getting model info, data, and file from local repository
+        entry = get_model(_id,self.model_folder)
+
+        ## loading data
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
+            raise Exception("The training data file was not provided.")
+
+        ##getting params from info
+        model_info=entry.model_info
+
+        kwargsData = dict(feature_names=None,categorical_names=None, ohe=False)
+        if "feature_names" in model_info:
+            kwargsData["feature_names"]=model_info["feature_names"]
+        if "categorical_names" in model_info:
+            cat_names = model_info["categorical_names"]
+            kwargsData["categorical_names"] = {int(k):v for k,v in cat_names.items()}
+        if "ohe" in model_info:
+            kwargsData["ohe"] = model_info["ohe"]
+
+        ## getting predict function
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
+            raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
+
+        #getting params from request
+        kwargsData2 = dict(threshold=0.95)
+        if "threshold" in params_json:
+            kwargsData2["threshold"] = params_json["threshold"]
+
+        def fit_explainer():
+            explainer = AnchorTabular(predic_func, **{k: v for k, v in kwargsData.items()})
+            explainer.fit(data.features, disc_perc=(25, 50, 75))
+            return explainer
+
+        def create_worker_explainer(worker):
+            return get_explainer("Anchors", entry, data, fit_explainer, url, copy_function=copy_anchors_explainer,
+                                 predict_func=predic_func)
+
+        def explain(instance, explainer):
+            explanation = explainer.explain(np.array(instance), **{k: v for k, v in kwargsData2.items()})
+            if explanation.anchor:
+                ret = dict(anchor=(' AND '.join(explanation.anchor)),precision=explanation.precision, coverage=explanation.coverage)
+            else:
+                ret = dict(anchor=(' AND '.join(explanation.anchor)),precision=explanation.precision[0], coverage=explanation.coverage)
+            return json.loads(json.dumps(ret))
+
+        return {"explanation": map_instances(explain, instances, params_json.get("n_jobs"), create_worker_explainer)}
+
+
+    def get(self):
+        return {
+        "_method_description": "Batch version of Anchors. Provides a simple boolean rule with its precision and coverage for each one of the given instances. "
+                            "The instances are distributed over several worker threads. This method accepts 4 arguments: "
+                           "the 'id', the 'instances', the 'url' (optional),  and the 'params' JSON (optional) with the configuration parameters of the method. "
+                           "These arguments are described below.",
+
+        "id": "Identifier of the ML model that was stored locally.",
+        "instances": "Matrix (array of arrays) with the feature values of each instance without including the target class.",
+        "url": "External URL of the prediction function. Ignored if a model file was uploaded to the server. "
+               "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
+
+        "params": {
+                "threshold": "(Optional) The minimum level of precision required for the anchors. Default is 0.95",
+                "n_jobs": "(Optional) Number of threads explaining the instances in parallel. Defaults to the server configuration (8)."
+                }
+
+        }
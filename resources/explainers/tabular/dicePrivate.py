@@ -1,11 +1,8 @@
 from flask_restful import Resource,reqparse
-import tensorflow as tf
-import h5py
 import json
 import dice_ml
-from html2image import Html2Image
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot, html_plot
+from modelregistry import get_model
 from flask import request
 
 class DicePrivate(Resource):
@@ -30,10 +27,10 @@ class DicePrivate(Resource):
             params_json = json.loads(params)
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
         backend = model_info["backend"]  ##error handling?
         outcome_name="Target"
         if "target_name" in model_info:
@@ -48,8 +45,7 @@ class DicePrivate(Resource):
       
         ## loading model
         if backend=="TF1" or backend=="TF2":
-           model_h5=h5py.File(model_file, 'w')
-           model = tf.keras.models.load_model(model_h5)
+           model = entry.model
         else:
             raise Exception("Only TF1 and TF2 backends are allowed.")
         
@@ -87,8 +83,8 @@ class DicePrivate(Resource):
         e1 = exp.generate_counterfactuals(instance, **{k: v for k, v in kwargsData2.items() if v is not None})
 
         #saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
         str_html=''
+        tables=[]
         i=1
         for cf in e1.cf_examples_list:
             if cf.final_cfs_df is None:
@@ -98,15 +94,11 @@ class DicePrivate(Resource):
                 cfs=cf.final_cfs_df.to_html()
 
             str_html =  str_html + '<h2>Instance ' + str(i) + '</h2>' + cf.test_instance_df.to_html() + '<h2>Counterfactuals</h2>'+ cfs + '<br><br><hr><br>'
+            tables = tables + [('Instance ' + str(i), cf.test_instance_df), ('Counterfactuals', cf.final_cfs_df if cf.final_cfs_df is not None else "No counterfactuals were found for this instance.")]
             i=i+1
 
-        file = open(upload_folder+filename+".html", "w")
-        file.write(str_html)
-        file.close()
-
-        hti = Html2Image()
-        hti.output_path= upload_folder
-        hti.screenshot(html_str=str_html, save_as=filename+".png")
+        #the screenshot is taken on the first request to the plot URL
+        getcall = save_plot(request.path,self.upload_folder,html_plot,{"html":str_html,"tables":tables})
         
         response={"plot_html":getcall+".html","plot_png":getcall+".png","explanation":json.loads(e1.cf_examples_list[0].final_cfs_df.to_json(orient='records'))}
         return response
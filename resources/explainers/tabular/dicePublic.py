@@ -1,14 +1,11 @@
 from flask_restful import Resource,reqparse
-import tensorflow as tf
-import torch
 import pandas as pd
-import joblib
-import h5py
 import json
 import dice_ml
-from html2image import Html2Image
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot, html_plot
+from datacache import get_training_data
+from explainercache import get_explainer
+from modelregistry import get_model
 from flask import request
 
 class DicePublic(Resource):
@@ -33,28 +30,24 @@ class DicePublic(Resource):
             params_json = json.loads(params)
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
         backend = model_info["backend"]  ##error handling?
         cont_features = model_info["cont_features"] ##error handling?
 
         ## loading model
-        if backend=="TF1" or backend=="TF2":
-           model_h5=h5py.File(model_file, 'w')
-           model = tf.keras.models.load_model(model_h5)
-        elif backend=="PYT":
-           model = torch.load(model_file)
-        else:
-           model = joblib.load(model_file)
+        model = entry.model
         
         ## loading data
-        dataframe = joblib.load(data_file)
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
+            raise Exception("The training data file was not provided.")
        
 
         ## params from the request
-        kwargsData = dict(continuous_features=cont_features, outcome_name=dataframe.columns[-1])
+        kwargsData = dict(continuous_features=cont_features, outcome_name=data.target_name)
         if "permitted_range" in params_json:
            kwargsData["permitted_range"] = params_json["permitted_range"]
         if "continuous_features_precision" in params_json:
@@ -68,20 +61,22 @@ class DicePublic(Resource):
         if "features_to_vary" in params_json:
            kwargsData2["features_to_vary"] = params_json["features_to_vary"]
 
-        # Create data
-        d = dice_ml.Data(dataframe=dataframe, **{k: v for k, v in kwargsData.items() if v is not None})
-  
-        # Create model
-        m = dice_ml.Model(model=model, backend=backend)
-
-        # Create CFs generator
         method="random"
         if "method" in params_json:
            method = params_json["method"]
-        exp = dice_ml.Dice(d, m, method=method)
 
-        columns = list(dataframe.columns)
-        columns.remove(dataframe.columns[-1])
+        def create_generator():
+            # Create data
+            d = dice_ml.Data(dataframe=data.frame(), **{k: v for k, v in kwargsData.items() if v is not None})
+
+            # Create model
+            m = dice_ml.Model(model=model, backend=backend)
+
+            # Create CFs generator
+            return dice_ml.Dice(d, m, method=method)
+        exp = get_explainer("DicePublic", entry, data, create_generator, params={"method": method, "data": kwargsData})
+
+        columns = list(data.feature_names)
 
         instance = pd.DataFrame([instance], columns=columns)
        
@@ -92,8 +87,8 @@ class DicePublic(Resource):
             e1 = exp.generate_counterfactuals(instance, **{k: v for k, v in kwargsData2.items() if v is not None})
         
         #saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
         str_html=''
+        tables=[]
         i=1
         for cf in e1.cf_examples_list:
             if cf.final_cfs_df is None:
@@ -103,15 +98,11 @@ class DicePublic(Resource):
                 cfs=cf.final_cfs_df.to_html()
 
             str_html =  str_html + '<h2>Instance ' + str(i) + '</h2>' + cf.test_instance_df.to_html() + '<h2>Counterfactuals</h2>'+ cfs + '<br><br><hr><br>'
+            tables = tables + [('Instance ' + str(i), cf.test_instance_df), ('Counterfactuals', cf.final_cfs_df if cf.final_cfs_df is not None else "No counterfactuals were found for this instance.")]
             i=i+1
 
-        file = open(upload_folder+filename+".html", "w")
-        file.write(str_html)
-        file.close()
-
-        hti = Html2Image()
-        hti.output_path= upload_folder
-        hti.screenshot(html_str=str_html, save_as=filename+".png")
+        #the screenshot is taken on the first request to the plot URL
+        getcall = save_plot(request.path,self.upload_folder,html_plot,{"html":str_html,"tables":tables})
 
         response={"plot_html":getcall+".html","plot_png":getcall+".png","explanation":json.loads(e1.to_json())}
         return response
@@ -1,14 +1,22 @@
 from flask_restful import Resource,reqparse
-import tensorflow as tf
-import torch
-import joblib
-import h5py
 import json
+import importlib.util
 import dalex as dx
 from flask import request
-from html2image import Html2Image
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot
+from screenshots import screenshot
+from datacache import get_training_data
+from jobs import report_progress
+from modelregistry import get_model
+
+
+def plot(fig, path):
+    fig.write_html(path+'.html')
+    #kaleido exports plotly figures without a browser
+    if importlib.util.find_spec("kaleido")!=None:
+        fig.write_image(path+'.png')
+    else:
+        screenshot(path+".png", html_file=path+'.html')
 
 
 class Importance(Resource):
@@ -31,41 +39,34 @@ class Importance(Resource):
             params_json = json.loads(params)
        
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
         model_task = model_info["model_task"]  ##error handling?
 
         ## loading model
-        if backend=="TF1" or backend=="TF2":
-            model_h5=h5py.File(model_file, 'w')
-            model = tf.keras.models.load_model(model_h5)
-        elif backend=="PYT":
-            model = torch.load(model_file)
-        else:
-            model = joblib.load(model_file)
+        model = entry.model
         
         ## loading data
-        dataframe = joblib.load(data_file)
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
+            raise Exception("The training data file was not provided.")
 
         ## params from the request
         kwargsData = dict()
         if "variables" in params_json:
             kwargsData["variables"] = params_json["variables"]
        
-        explainer = dx.Explainer(model, dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False), dataframe.iloc[:,-1:],model_type=model_task)
+        report_progress(0.1, "Computing the feature importance")
+        explainer = dx.Explainer(model, data.feature_frame(), data.target_frame(),model_type=model_task)
         parts = explainer.model_parts(**{k: v for k, v in kwargsData.items()})
 
+        report_progress(0.9, "Plotting")
         fig=parts.plot(show=False)
         
-        #saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        fig.write_html(upload_folder+filename+'.html')
-        hti = Html2Image()
-        hti.output_path= upload_folder
-        hti.screenshot(html_file=upload_folder+filename+'.html', save_as=filename+".png") 
+        #saving (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,fig)
 
         response={"plot_html":getcall+'.html',"plot_png":getcall+'.png', "explanation":json.loads(parts.result.to_json())}
         return response
@@ -78,6 +79,7 @@ class Importance(Resource):
                            "the 'id' string, and the 'params' object (optional) containing the configuration parameters of the explainer."
                            " These arguments are described below.",
         "id": "Identifier of the ML model that was stored locally.",
+        "async": "(Optional) Set to true to run the explanation as a background job. The response contains the job id and the status_url to poll for its progress and result.",
         "params": { 
                 "variables": "(Optional) Array of strings with the names of the features for which the importance will be calculated. Defaults to all features.",
                 }
@@ -1,16 +1,13 @@
 from flask_restful import Resource,reqparse
 from flask import request
-import tensorflow as tf
-import torch
 import numpy as np
-import joblib
-import h5py
 import json
 import lime.lime_tabular
-from html2image import Html2Image
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from lazyplots import save_plot, html_plot
+from screenshots import lime_bars
+from datacache import get_training_data
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
 
 class Lime(Resource):
 
@@ -35,17 +32,15 @@ class Lime(Resource):
             params_json = json.loads(params)
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
 
         ##getting params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
         kwargsData = dict(mode="classification", feature_names=None, categorical_features=None,categorical_names=None, class_names=None)
         if "model_task" in model_info:
             kwargsData["mode"] = model_info["model_task"]
@@ -59,26 +54,8 @@ class Lime(Resource):
             kwargsData["class_names"] = model_info["output_names"]
 
         ## getting predict function
-        predic_func=None
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
 
   
@@ -94,8 +71,14 @@ class Lime(Resource):
 
 
 
-        explainer = lime.lime_tabular.LimeTabularExplainer(dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False).to_numpy(),
-                                                            **{k: v for k, v in kwargsData.items() if v is not None})
+        def create_explainer():
+            return lime.lime_tabular.LimeTabularExplainer(data.features, **{k: v for k, v in kwargsData.items() if v is not None})
+        if "seed" in params_json:
+            #seeded runs get a new explainer, so the random state starts from the seed
+            kwargsData["random_state"] = params_json["seed"]
+            explainer = create_explainer()
+        else:
+            explainer = get_explainer("LIME", entry, data, create_explainer)
         explanation = explainer.explain_instance(np.array(instance, dtype='f'), predic_func, **{k: v for k, v in kwargsData2.items() if v is not None}) 
         
         #formatting json explanation
@@ -107,12 +90,8 @@ class Lime(Resource):
             ret = {k:[(kwargsData["feature_names"][i],j) for (i,j) in v] for k,v in ret.items()}
         ret=json.loads(json.dumps(ret))
 
-        ##saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        hti = Html2Image()
-        hti.output_path= upload_folder
-        hti.screenshot(html_str=explanation.as_html(), save_as=filename+".png")   
-        explanation.save_to_file(upload_folder+filename+".html")
+        ##saving (the screenshot is taken on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,html_plot,{"html":explanation.as_html(),"bars":lime_bars(explanation,kwargsData["class_names"])})
         
         response={"plot_html":getcall+".html","plot_png":getcall+".png","explanation":ret}
         return response
@@ -130,7 +109,8 @@ class Lime(Resource):
         "params": { 
                 "output_classes" : "(Optional) Array of ints representing the classes to be explained.",
                 "top_classes": "(Optional) Int representing the number of classes with the highest prediction probability to be explained. Overrides 'output_classes' if provided.",
-                "num_features": "(Optional) Int representing the maximum number of features to be included in the explanation."
+                "num_features": "(Optional) Int representing the maximum number of features to be included in the explanation.",
+                "seed": "(Optional) Int used as the seed of the random perturbations. Seeded explanations are reproducible and cached by the server."
                 }
 
         }
\ No newline at end of file
@@ -0,0 +1,139 @@
+from flask_restful import Resource,reqparse
+from flask import request
+import numpy as np
+import copy
+import json
+import lime.lime_tabular
+from lazyplots import save_plot, html_plot
+from screenshots import lime_bars
+from datacache import get_training_data
+from explainbatch import parse_instances, map_instances
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
+
+class LimeBatch(Resource):
+
+    def __init__(self,model_folder,upload_folder):
+        self.model_folder = model_folder
+        self.upload_folder = upload_folder
+
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('id',required=True)
+        parser.add_argument('instances',required=True)
+        parser.add_argument('url')
+        parser.add_argument('params')
+        args = parser.parse_args()
+
+        _id = args.get("id")
+        url = args.get("url")
+        instances = parse_instances(args.get("instances"))
+        params=args.get("params")
+        params_json={}
+        if(params !=None):
+            params_json = json.loads(params)
+
+        #Getting model info, data, and file from local repository
+        entry = get_model(_id,self.model_folder)
+
+        ## loading data
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
+            raise Exception("The training data file was not provided.")
+
+        ##getting params from info
+        model_info=entry.model_info
+        kwargsData = dict(mode="classification", feature_names=None, categorical_features=None,categorical_names=None, class_names=None)
+        if "model_task" in model_info:
+            kwargsData["mode"] = model_info["model_task"]
+        if "feature_names" in model_info:
+            kwargsData["feature_names"] = model_info["feature_names"]
+        if "categorical_features" in model_info:
+            kwargsData["categorical_features"] = model_info["categorical_features"]
+        if "categorical_names" in model_info:
+            kwargsData["categorical_names"] = {int(k):v for k,v in model_info["categorical_names"].items()}
+        if "output_names" in model_info:
+            kwargsData["class_names"] = model_info["output_names"]
+
+        ## getting predict function
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
+            raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
+
+        #getting params from request
+        kwargsData2 = dict(labels=(1,), top_labels=None, num_features=None)
+        if "output_classes" in params_json:
+            kwargsData2["labels"] = params_json["output_classes"]  #labels
+        if "top_classes" in params_json:
+            kwargsData2["top_labels"] = params_json["top_classes"]   #top labels
+        if "num_features" in params_json:
+            kwargsData2["num_features"] = params_json["num_features"]
+        seed=params_json.get("seed")
+        plots=params_json.get("plots",False)
+
+        def set_random_state(explainer):
+            random_state = np.random.RandomState(seed)
+            explainer.random_state = explainer.base.random_state = random_state
+            if explainer.discretizer!=None:
+                explainer.discretizer.random_state = random_state
+
+        def create_worker_explainer(worker):
+            explainer = get_explainer("LIME", entry, data, lambda: lime.lime_tabular.LimeTabularExplainer(data.features,
+                                                            **{k: v for k, v in kwargsData.items() if v is not None}))
+            #the random state is shared with the cached explainer, each thread gets its own
+            explainer.base = copy.copy(explainer.base)
+            explainer.discretizer = copy.copy(explainer.discretizer)
+            set_random_state(explainer)
+            return explainer
+
+        def explain(instance, explainer):
+            if seed!=None:
+                #every instance starts from the seed, so the explanations do not depend on the order of the instances
+                set_random_state(explainer)
+            explanation = explainer.explain_instance(np.array(instance, dtype='f'), predic_func, **{k: v for k, v in kwargsData2.items() if v is not None})
+
+            #formatting json explanation
+            ret = explanation.as_map()
+            ret = {str(k):[(int(i),float(j)) for (i,j) in v] for k,v in ret.items()}
+            if kwargsData["class_names"]!=None:
+                ret = {kwargsData["class_names"][int(k)]:v for k,v in ret.items()}
+            if kwargsData["feature_names"]!=None:
+                ret = {k:[(kwargsData["feature_names"][i],j) for (i,j) in v] for k,v in ret.items()}
+
+            #the plot is rendered on its first request, only its content is built by the worker
+            plot = {"html":explanation.as_html(),"bars":lime_bars(explanation,kwargsData["class_names"])} if plots else None
+            return json.loads(json.dumps(ret)), plot
+
+        results = map_instances(explain, instances, params_json.get("n_jobs"), create_worker_explainer)
+
+        response={"explanation":[ret for ret, _ in results]}
+        if plots:
+            ##saving (the screenshots are taken on the first request to each plot URL)
+            response["plot_html"]=[]
+            response["plot_png"]=[]
+            for _, plot in results:
+                getcall = save_plot(request.path,self.upload_folder,html_plot,plot)
+                response["plot_html"].append(getcall+".html")
+                response["plot_png"].append(getcall+".png")
+        return response
+
+    def get(self):
+        return {
+        "_method_description": "Batch version of LIME. Explains each one of the given instances with the weight of each attribute to its prediction value. "
+                           "The instances are distributed over several worker threads. This method accepts 4 arguments: "
+                           "the 'id', the 'instances', the 'url'(optional),  and the 'params' dictionary (optional) with the configuration parameters of the method. "
+                           "These arguments are described below.",
+        "id": "Identifier of the ML model that was stored locally.",
+        "instances": "Matrix (array of arrays) with the feature values of each instance not including the target class.",
+        "url": "External URL of the prediction function. Ignored if a model file was uploaded to the server. "
+               "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
+        "params": {
+                "output_classes" : "(Optional) Array of ints representing the classes to be explained.",
+                "top_classes": "(Optional) Int representing the number of classes with the highest prediction probability to be explained. Overrides 'output_classes' if provided.",
+                "num_features": "(Optional) Int representing the maximum number of features to be included in the explanation.",
+                "seed": "(Optional) Int used as the seed of the random perturbations of every instance. Seeded explanations are reproducible and cached by the server.",
+                "n_jobs": "(Optional) Number of threads explaining the instances in parallel. Defaults to the server configuration (8).",
+                "plots": "(Optional) Boolean. If true, an HTML and a PNG plot are generated for each instance. Defaults to false."
+                }
+
+        }
@@ -0,0 +1,81 @@
+from flask_restful import Resource,reqparse
+import json
+import shap
+from flask import request
+from datacache import get_training_data
+from explainbatch import parse_instances, select_output, save_shap_plots
+from responseformats import LabeledArray
+from explainercache import get_explainer
+from modelregistry import get_model
+
+
+class ShapDeepLocalBatch(Resource):
+
+    def __init__(self,model_folder,upload_folder):
+        self.model_folder = model_folder
+        self.upload_folder = upload_folder
+
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('id',required=True)
+        parser.add_argument('instances',required=True)
+        parser.add_argument('params')
+        args = parser.parse_args()
+
+        _id = args.get("id")
+        instances = parse_instances(args.get("instances"))
+        params=args.get("params")
+        params_json={}
+        if(params !=None):
+            params_json = json.loads(params)
+
+        #Getting model info, data, and file from local repository
+        entry = get_model(_id,self.model_folder)
+
+        #getting params from request
+        index=1
+        if "output_index" in params_json:
+            index=params_json["output_index"]
+        plots=params_json.get("plots",False)
+
+        ##getting params from info
+        model_info=entry.model_info
+
+        feature_names=["Feature "+str(i) for i in range(instances.shape[1])]
+        if "feature_names" in model_info:
+            feature_names = model_info["feature_names"]
+
+        #load model (.h5 file)
+        model = entry.model
+
+        ## loading data
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
+            raise Exception("The training data file was not provided.")
+
+        # Create explanation for all the instances at once
+        explainer = get_explainer("DeepSHAP", entry, data, lambda: shap.DeepExplainer(model,data.features))
+        shap_values, expected_value = select_output(explainer.shap_values(instances), explainer.expected_value, index)
+
+        response={"expected_value":expected_value,"explanation":LabeledArray(shap_values,feature_names)}
+        if plots:
+            response["plot_png"]=save_shap_plots(request.path,self.upload_folder,expected_value,shap_values,instances,feature_names,params_json.get("plot_type"))
+        return response
+
+
+    def get(self):
+        return {
+        "_method_description": "Batch version of DeepSHAPLocal. Computes the contribution of each attribute to the prediction of each one of the given instances, based on Shapley values (for deep learning models only). "
+                           "All the instances are explained at once. This method accepts 3 arguments: "
+                           "the 'id', the 'instances', and the 'params' JSON with the configuration parameters of the method. "
+                           "These arguments are described below.",
+
+        "id": "Identifier of the ML model that was stored locally.",
+        "instances": "Matrix (array of arrays) with the feature values of each instance without including the target class.",
+        "params": {
+                "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. The default index is 1.",
+                "plots": "(Optional) Boolean. If true, a plot is generated for each instance. Defaults to false.",
+                "plot_type": "(Optional) String with the name of the plots to be generated. The supported plots are 'waterfall', 'decision' and 'bar'. Defaults to 'waterfall'."
+                }
+
+        }
@@ -1,14 +1,22 @@
 import matplotlib.pyplot as plt
-import tensorflow as tf
 import numpy as np
-import joblib
-import h5py
 import json
 import shap
 from flask_restful import Resource,reqparse
 from flask import request
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot
+from responseformats import LabeledArray
+from plotting import pyplot_figure, summary_payload
+from datacache import get_training_data
+from jobs import report_progress
+from explainercache import get_explainer
+from modelregistry import get_model
+
+
+def plot(payload, path):
+    with pyplot_figure():
+        shap.summary_plot(payload["shap_values"],features=payload["features"],feature_names=payload["feature_names"],class_names=payload["class_names"],show=False)
+        plt.savefig(path+".png",bbox_inches="tight")
 
 
 class ShapDeepGlobal(Resource):
@@ -30,7 +38,7 @@ class ShapDeepGlobal(Resource):
             params_json = json.loads(params)
         
         #getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         #getting params from request
         index=1
@@ -38,7 +46,7 @@ class ShapDeepGlobal(Resource):
             index=params_json["output_index"];
 
         #getting params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
         kwargsData = dict(feature_names=None, output_names=None)
         if "feature_names" in model_info:
             kwargsData["feature_names"] = model_info["feature_names"]
@@ -46,34 +54,27 @@ class ShapDeepGlobal(Resource):
             kwargsData["output_names"] = model_info["output_names"]
 
         #loading model (.h5 file)
-        model=h5py.File(model_file, 'w')
-        model = tf.keras.models.load_model(model)
+        model = entry.model
 
         #loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-            dataframe=dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False)
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
+        dataframe=data.feature_frame()
 
         #creating explanation
-        explainer = shap.DeepExplainer(model,dataframe.to_numpy())
-        shap_values = explainer.shap_values(dataframe.to_numpy())
+        report_progress(0.1, "Computing the Shapley values")
+        explainer = get_explainer("DeepSHAP", entry, data, lambda: shap.DeepExplainer(model,data.features))
+        shap_values = explainer.shap_values(data.features)
         
         if(len(np.array(shap_values).shape)==3): #multiclass shape: (#_of_classes, #_of_instances,#_of_features)
             shap_values=shap_values[index]
            
-        #plotting
-        plt.switch_backend('agg')
-        shap.summary_plot(shap_values,features=dataframe,feature_names=kwargsData["feature_names"],class_names=kwargsData["output_names"])
-
-        #saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        plt.savefig(upload_folder+filename+".png",bbox_inches="tight")
+        #plotting (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,summary_payload(shap_values,dataframe,kwargsData["feature_names"],kwargsData["output_names"]))
        
-        #formatting json output
-        shap_values = [x.tolist() for x in shap_values]
-        ret=json.loads(json.dumps(shap_values))
+        #the arrays are encoded in the format requested by the client (see responseformats.py)
+        ret=LabeledArray(shap_values,kwargsData["feature_names"],kwargsData["output_names"])
         
         response={"plot_png":getcall+".png","explanation":ret}
 
@@ -86,6 +87,7 @@ class ShapDeepGlobal(Resource):
                            "the 'id', and the 'params' JSON with the configuration parameters of the method. "
                            "These arguments are described below.",
         "id": "Identifier of the ML model that was stored locally.",
+        "async": "(Optional) Set to true to run the explanation as a background job. The response contains the job id and the status_url to poll for its progress and result.",
         "params": { 
                 "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. Defaults to class 1.",
                 }
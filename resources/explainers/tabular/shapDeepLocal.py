@@ -1,14 +1,31 @@
 import matplotlib.pyplot as plt
-import tensorflow as tf
 import numpy as np
-import joblib
-import h5py
 import json
 import shap
 from flask_restful import Resource,reqparse
 from flask import request
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot
+from responseformats import LabeledArray
+from plotting import pyplot_figure
+from datacache import get_training_data
+from explainercache import get_explainer
+from modelregistry import get_model
+
+
+def plot(payload, path):
+    plot_type=payload["plot_type"]
+    with pyplot_figure():
+        if plot_type=="bar":
+            shap.plots._bar.bar_legacy(payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        elif plot_type=="decision":
+            shap.decision_plot(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        else:
+            if plot_type==None:
+                print("No plot type was specified. Defaulting to waterfall plot.")
+            elif plot_type!="waterfall":
+                print("No plot with the specified name was found. Defaulting to waterfall plot.")
+            shap.plots._waterfall.waterfall_legacy(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        plt.savefig(path+".png",bbox_inches="tight")
 
 
 class ShapDeepLocal(Resource):
@@ -32,7 +49,7 @@ class ShapDeepLocal(Resource):
             params_json = json.loads(params)
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         #getting params from request
         index=1
@@ -43,7 +60,7 @@ class ShapDeepLocal(Resource):
             plot_type=params_json["plot_type"];
 
         ##getting params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
 
         kwargsData = dict(feature_names=None, output_names=None)
 
@@ -57,44 +74,27 @@ class ShapDeepLocal(Resource):
         '''
 
         #load model (.h5 file)
-        model=h5py.File(model_file, 'w')
-        model = tf.keras.models.load_model(model)
+        model = entry.model
 
         ## loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-            dataframe=dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False)
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
 
         # Create explanation
-        explainer = shap.DeepExplainer(model,dataframe.to_numpy())
+        explainer = get_explainer("DeepSHAP", entry, data, lambda: shap.DeepExplainer(model,data.features))
         shap_values = explainer.shap_values(np.array([instance]))
 
         if(len(np.array(shap_values).shape)!=1 and np.array(shap_values).shape[0]!=1):
             explainer.expected_value=explainer.expected_value[index]
             shap_values=shap_values[index]
            
-        #plotting
-        plt.switch_backend('agg')
-        if plot_type=="bar":
-            shap.plots._bar.bar_legacy(shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"],show=False)
-        elif plot_type=="decision":
-            shap.decision_plot(explainer.expected_value,shap_values=shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"])
-        else:
-            if plot_type==None:
-                print("No plot type was specified. Defaulting to waterfall plot.")
-            elif plot_type!="waterfall":
-                print("No plot with the specified name was found. Defaulting to waterfall plot.")
-            shap.plots._waterfall.waterfall_legacy(explainer.expected_value,shap_values=shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"],show=False)
-       
-        ##saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        plt.savefig(upload_folder+filename+".png",bbox_inches="tight")
+        #plotting (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,dict(plot_type=plot_type,expected_value=explainer.expected_value,
+                            shap_values=shap_values[0],instance=np.array(instance),feature_names=kwargsData["feature_names"],output_names=None))
        
-        #formatting json output
-        shap_values = [x.tolist() for x in shap_values]
-        ret=json.loads(json.dumps(shap_values))
+        #the arrays are encoded in the format requested by the client (see responseformats.py)
+        ret=LabeledArray(shap_values,kwargsData["feature_names"],kwargsData["output_names"])
         
         #Insert code for image uploading and getting url
         response={"plot_png":getcall+".png","explanation":ret}
@@ -0,0 +1,103 @@
+from flask_restful import Resource,reqparse
+import json
+import shap
+from flask import request
+from datacache import get_training_data
+from background import get_background
+from shapparallel import kernel_shap_values
+from explainbatch import parse_instances, select_output, save_shap_plots
+from responseformats import LabeledArray
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
+
+
+class ShapKernelLocalBatch(Resource):
+
+    def __init__(self,model_folder,upload_folder):
+        self.model_folder = model_folder
+        self.upload_folder = upload_folder
+
+    def post(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('id',required=True)
+        parser.add_argument('instances',required=True)
+        parser.add_argument('url')
+        parser.add_argument('params')
+        args = parser.parse_args()
+
+        _id = args.get("id")
+        instances = parse_instances(args.get("instances"))
+        url = args.get("url")
+        params=args.get("params")
+        params_json={}
+        if(params !=None):
+            params_json = json.loads(params)
+
+        #Getting model info, data, and file from local repository
+        entry = get_model(_id,self.model_folder)
+
+        ## loading data
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
+            raise Exception("The training data file was not provided.")
+
+        #getting params from request
+        index=1
+        if "output_index" in params_json:
+            index=params_json["output_index"]
+        plots=params_json.get("plots",False)
+
+        ##getting params from info
+        model_info=entry.model_info
+        backend = model_info["backend"]  ##error handling?
+
+        kwargsData = dict(feature_names=None, output_names=None)
+        if "feature_names" in model_info:
+            kwargsData["feature_names"] = model_info["feature_names"]
+        else:
+            kwargsData["feature_names"]=["Feature "+str(i) for i in range(instances.shape[1])]
+        if "output_names" in model_info:
+            kwargsData["output_names"] = model_info["output_names"]
+
+        ## getting predict function
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
+            raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
+
+        # Create explanation, spreading the instances over the worker processes
+        background = get_background(data,params_json)
+        explainer = get_explainer("KernelSHAP", entry, data, lambda: shap.KernelExplainer(predic_func, background.data,**{k: v for k, v in kwargsData.items()}),
+                                  url, {"background": background.metadata()}, predict_func=predic_func)
+        n_jobs=params_json.get("n_jobs")
+        if n_jobs==None and backend in ("TF1","TF2"):
+            n_jobs=1 #tensorflow models are slow to pickle and load in the worker processes
+        shap_values = kernel_shap_values(predic_func, background.data, instances, kwargsData, n_jobs, params_json.get("chunk_size"), explainer=explainer)
+        shap_values, expected_value = select_output(shap_values, explainer.expected_value, index)
+
+        response={"expected_value":expected_value,"explanation":LabeledArray(shap_values,kwargsData["feature_names"]),"background":background.metadata()}
+        if plots:
+            response["plot_png"]=save_shap_plots(request.path,self.upload_folder,expected_value,shap_values,instances,kwargsData["feature_names"],params_json.get("plot_type"))
+        return response
+
+
+    def get(self):
+        return {
+        "_method_description": "Batch version of KernelSHAPLocal. Computes the contribution of each attribute to the prediction of each one of the given instances, based on Shapley values. "
+                           "The instances are distributed over several worker processes. This method accepts 4 arguments: "
+                           "the 'id', the 'instances', the 'url' (optional),  and the 'params' dictionary (optional) with the configuration parameters of the method. "
+                           "These arguments are described below.",
+        "id": "Identifier of the ML model that was stored locally.",
+        "instances": "Matrix (array of arrays) with the feature values of each instance without including the target class.",
+        "url": "External URL of the prediction function. Ignored if a model file was uploaded to the server. "
+               "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
+        "params": {
+                "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. The default index is 1.",
+                "background_method": "(Optional) Summary of the training data used as the background distribution: 'kmeans', 'sample' or 'full'. Defaults to the server configuration (full).",
+                "background_size": "(Optional) Maximum number of background rows of the 'kmeans' and 'sample' methods. Defaults to the server configuration (100).",
+                "background_seed": "(Optional) Seed of the random sample drawn when background_method is 'sample'. Defaults to 0.",
+                "n_jobs": "(Optional) Maximum number of worker processes of the shared KernelSHAP pool used by this request. Defaults to all the workers of the pool (SHAP_PARALLEL_WORKERS).",
+                "chunk_size": "(Optional) Number of instances explained by each task sent to the worker processes.",
+                "plots": "(Optional) Boolean. If true, a plot is generated for each instance. Defaults to false.",
+                "plot_type": "(Optional) String with the name of the plots to be generated. The supported plots are 'waterfall', 'decision' and 'bar'. Defaults to 'waterfall'."
+                }
+        }
@@ -1,16 +1,24 @@
 import matplotlib.pyplot as plt
-import tensorflow as tf
 import numpy as np
-import torch
-import joblib
-import h5py
 import json
 import shap
-import requests
 from flask_restful import Resource,reqparse
 from flask import request
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot
+from responseformats import LabeledArray
+from plotting import pyplot_figure, summary_payload
+from datacache import get_training_data
+from background import get_background
+from explainercache import get_explainer
+from shapparallel import kernel_shap_values
+from jobs import report_progress
+from modelregistry import get_model, get_predict_function
+
+
+def plot(payload, path):
+    with pyplot_figure():
+        shap.summary_plot(payload["shap_values"],features=payload["features"],feature_names=payload["feature_names"],class_names=payload["class_names"],show=False)
+        plt.savefig(path+".png",bbox_inches="tight")
 
 
 class ShapKernelGlobal(Resource):
@@ -34,21 +42,22 @@ class ShapKernelGlobal(Resource):
             params_json = json.loads(params)
         
         #getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         #loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
 
         #getting params from request
         index=1
         if "output_index" in params_json:
             index=params_json["output_index"];
+        n_jobs=params_json.get("n_jobs")
+        chunk_size=params_json.get("chunk_size")
 
         #getting params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
         backend = model_info["backend"]  ##error handling?
 
         kwargsData = dict(feature_names=None, output_names=None)
@@ -59,50 +68,33 @@ class ShapKernelGlobal(Resource):
 
 
         #getting predict function
-        predic_func=None
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
 
 
         #creating explanation
-        dataframe=dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False)
-        explainer = shap.KernelExplainer(predic_func, dataframe,**{k: v for k, v in kwargsData.items()})
-        shap_values = explainer.shap_values(dataframe)
+        report_progress(0.1, "Computing the Shapley values")
+        dataframe=data.feature_frame()
+        background = get_background(data,params_json)
+        #the explainer shared with the local KernelSHAP requests, used when the rows are explained in this process
+        explainer = get_explainer("KernelSHAP", entry, data, lambda: shap.KernelExplainer(predic_func, background.data,**{k: v for k, v in kwargsData.items()}),
+                                  url, {"background": background.metadata()}, predict_func=predic_func)
+        if n_jobs==None and backend in ("TF1","TF2"):
+            n_jobs=1 #tensorflow models are slow to pickle and load in the worker processes
+        shap_values = kernel_shap_values(predic_func, background.data, dataframe, kwargsData, n_jobs, chunk_size,
+                                         progress=lambda done: report_progress(0.1+0.8*done, "Computing the Shapley values"), explainer=explainer)
      
         if(len(np.array(shap_values).shape)==3 and index!=None): #multiclass shape: (#_of_classes, #_of_instances,#_of_features)
             shap_values=shap_values[index]
 
-        #plotting   
-        plt.switch_backend('agg')
-        shap.summary_plot(shap_values,features=dataframe, feature_names=kwargsData["feature_names"],class_names=kwargsData["output_names"],show=False)
-
-        #saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        plt.savefig(upload_folder+filename+".png",bbox_inches="tight")
+        #plotting (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,summary_payload(shap_values,dataframe,kwargsData["feature_names"],kwargsData["output_names"]))
 
-        #formatting json output
-        shap_values = [x.tolist() for x in shap_values]
-        ret=json.loads(json.dumps(shap_values))
+        #the arrays are encoded in the format requested by the client (see responseformats.py)
+        ret=LabeledArray(shap_values,kwargsData["feature_names"],kwargsData["output_names"])
         
-        response={"plot_png":getcall+".png","explanation":ret}
+        response={"plot_png":getcall+".png","explanation":ret,"background":background.metadata()}
 
         return response
 
@@ -116,8 +108,14 @@ class ShapKernelGlobal(Resource):
         "id": "Identifier of the ML model that was stored locally.",
         "url": "External URL of the prediction function. Ignored if a model file was uploaded to the server. "
                "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
+        "async": "(Optional) Set to true to run the explanation as a background job. The response contains the job id and the status_url to poll for its progress and result.",
         "params": { 
-                "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. Defaults to class 1." 
+                "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. Defaults to class 1.",
+                "background_method": "(Optional) Summary of the training data used as the background distribution: 'kmeans' (weighted k-means centroids), 'sample' (random sample stratified by the target) or 'full' (whole training set). Defaults to the server configuration (full).",
+                "background_size": "(Optional) Maximum number of background rows (centroids or sampled rows) of the 'kmeans' and 'sample' methods. Defaults to the server configuration (100).",
+                "background_seed": "(Optional) Seed of the random sample drawn when background_method is 'sample'. Defaults to 0.",
+                "n_jobs": "(Optional) Maximum number of worker processes of the shared KernelSHAP pool used by this request. Defaults to all the workers of the pool (SHAP_PARALLEL_WORKERS).",
+                "chunk_size": "(Optional) Number of instances explained by each task sent to the worker processes. Defaults to a few chunks per worker.",
                 }
 
 
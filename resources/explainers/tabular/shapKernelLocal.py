@@ -1,16 +1,35 @@
 from flask_restful import Resource,reqparse
-import tensorflow as tf
-import torch
 import numpy as np
-import joblib
-import h5py
 import json
 import shap
 from flask import request
 import matplotlib.pyplot as plt
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from lazyplots import save_plot
+from responseformats import LabeledArray
+from plotting import pyplot_figure
+from datacache import get_training_data
+from background import get_background
+from explainercache import get_explainer
+from modelregistry import get_model, get_predict_function
+
+
+def plot(payload, path):
+    plot_type=payload["plot_type"]
+    with pyplot_figure():
+        if plot_type=="bar":
+            shap.plots._bar.bar_legacy(payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        elif plot_type=="decision":
+            shap.decision_plot(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        elif plot_type=="force":
+            shap.plots._force.force(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],out_names=payload["output_names"],matplotlib=True,show=False)
+        else:
+            if plot_type==None:
+                print("No plot type was specified. Defaulting to waterfall plot.")
+            elif plot_type!="waterfall":
+                print("No plot with the specified name was found. Defaulting to waterfall plot.")
+            shap.plots._waterfall.waterfall_legacy(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        plt.savefig(path+".png",bbox_inches="tight")
+
 
 class ShapKernelLocal(Resource):
 
@@ -36,12 +55,11 @@ class ShapKernelLocal(Resource):
         
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, data_file = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## loading data
-        if data_file!=None:
-            dataframe = joblib.load(data_file) ##error handling?
-        else:
+        data = get_training_data(_id,self.model_folder)
+        if data==None:
             raise Exception("The training data file was not provided.")
 
         #getting params from request
@@ -53,8 +71,7 @@ class ShapKernelLocal(Resource):
             plot_type=params_json["plot_type"];
 
         ##getting params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
 
         kwargsData = dict(feature_names=None, output_names=None)
         if "feature_names" in model_info:
@@ -66,31 +83,15 @@ class ShapKernelLocal(Resource):
 
 
         ## getting predict function
-        predic_func=None
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either a stored model or a valid URL for the prediction function must be provided.")
 
 
         # Create data
-        explainer = shap.KernelExplainer(predic_func, dataframe.drop(dataframe.columns[len(dataframe.columns)-1], axis=1, inplace=False),**{k: v for k, v in kwargsData.items()})
+        background = get_background(data,params_json)
+        explainer = get_explainer("KernelSHAP", entry, data, lambda: shap.KernelExplainer(predic_func, background.data,**{k: v for k, v in kwargsData.items()}),
+                                  url, {"background": background.metadata()}, predict_func=predic_func)
 
         shap_values = explainer.shap_values(np.array(instance))
         
@@ -98,35 +99,15 @@ class ShapKernelLocal(Resource):
             explainer.expected_value=explainer.expected_value[index]
             shap_values=shap_values[index]
             
-        #plotting
-        plt.switch_backend('agg')
-        if plot_type=="bar":
-            shap.plots._bar.bar_legacy(shap_values,features=np.array(instance),feature_names=kwargsData["feature_names"],show=False)
-        elif plot_type=="decision":
-            shap.decision_plot(explainer.expected_value,shap_values=shap_values,features=np.array(instance),feature_names=kwargsData["feature_names"])
-        elif plot_type=="force":
-                shap.plots._force.force(explainer.expected_value,shap_values=shap_values,features=np.array(instance),feature_names=kwargsData["feature_names"],out_names=kwargsData["output_names"],matplotlib=True,show=False)
-        else:
-            if plot_type==None:
-                print("No plot type was specified. Defaulting to waterfall plot.")
-            elif plot_type!="waterfall":
-                print("No plot with the specified name was found. Defaulting to waterfall plot.")
-            shap.plots._waterfall.waterfall_legacy(explainer.expected_value,shap_values=shap_values,features=np.array(instance),feature_names=kwargsData["feature_names"],show=False)
-       
-        #saving force plot to html (DEPRECATED)
-        #additive_exp = shap.force_plot(explainer.expected_value, shap_values,features=np.array(instance),feature_names=kwargsData["feature_names"],out_names=out_names,show=False)
-        
-        ##saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        plt.savefig(upload_folder+filename+".png",bbox_inches="tight")
-        #shap.plots._force.save_html(upload_folder+filename+".html",additive_exp)
+        #plotting (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,dict(plot_type=plot_type,expected_value=explainer.expected_value,
+                            shap_values=shap_values,instance=np.array(instance),feature_names=kwargsData["feature_names"],output_names=kwargsData["output_names"]))
         
-        #formatting json output
-        shap_values = [x.tolist() for x in shap_values]
-        ret=json.loads(json.dumps(shap_values))
+        #the arrays are encoded in the format requested by the client (see responseformats.py)
+        ret=LabeledArray(shap_values,kwargsData["feature_names"],kwargsData["output_names"])
         
         #Insert code for image uploading and getting url
-        response={"plot_png":getcall+".png","explanation":ret}
+        response={"plot_png":getcall+".png","explanation":ret,"background":background.metadata()}
 
         return response
 
@@ -141,7 +122,10 @@ class ShapKernelLocal(Resource):
         "url": "External URL of the prediction function. Ignored if a model file was uploaded to the server. "
                "This url must be able to handle a POST request receiving a (multi-dimensional) array of N data points as inputs (instances represented as arrays). It must return a array of N outputs (predictions for each instance).",
         "params": { 
-                "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. The default index is 1." 
+                "output_index": "(Optional) Integer representing the index of the class to be explained. Ignore for regression models. The default index is 1.",
+                "background_method": "(Optional) Summary of the training data used as the background distribution: 'kmeans' (weighted k-means centroids), 'sample' (random sample stratified by the target) or 'full' (whole training set). Defaults to the server configuration (full).",
+                "background_size": "(Optional) Maximum number of background rows (centroids or sampled rows) of the 'kmeans' and 'sample' methods. Defaults to the server configuration (100).",
+                "background_seed": "(Optional) Seed of the random sample drawn when background_method is 'sample'. Defaults to 0.",
                 }
         }
     
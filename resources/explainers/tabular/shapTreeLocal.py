@@ -1,12 +1,31 @@
 from flask_restful import Resource,reqparse
 import numpy as np
-import joblib
 import json
 import shap
 from flask import request
 import matplotlib.pyplot as plt
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
+from lazyplots import save_plot
+from responseformats import LabeledArray
+from plotting import pyplot_figure
+from modelregistry import get_model
+
+
+def plot(payload, path):
+    plot_type=payload["plot_type"]
+    with pyplot_figure():
+        if plot_type=="bar":
+            shap.plots._bar.bar_legacy(payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        elif plot_type=="decision":
+            shap.decision_plot(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        elif plot_type=="force":
+            shap.plots._force.force(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],out_names=payload["output_names"],matplotlib=True,show=False)
+        else:
+            if plot_type==None:
+                print("No plot type was specified. Defaulting to waterfall plot.")
+            elif plot_type!="waterfall":
+                print("No plot with the specified name was found. Defaulting to waterfall plot.")
+            shap.plots._waterfall.waterfall_legacy(payload["expected_value"],shap_values=payload["shap_values"],features=payload["instance"],feature_names=payload["feature_names"],show=False)
+        plt.savefig(path+".png",bbox_inches="tight")
 
 
 class ShapTreeLocal(Resource):
@@ -30,7 +49,7 @@ class ShapTreeLocal(Resource):
             params_json = json.loads(params)
        
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         #getting params from request
         index=1
@@ -41,7 +60,7 @@ class ShapTreeLocal(Resource):
             plot_type=params_json["plot_type"];
 
         ##getting params from info
-        model_info=json.load(model_info_file)
+        model_info=entry.model_info
 
         kwargsData = dict(feature_names=None, output_names=None)
         if "feature_names" in model_info:
@@ -52,7 +71,7 @@ class ShapTreeLocal(Resource):
             kwargsData["output_names"] = model_info["output_names"]
 
         #load model (.pkl file)
-        model=joblib.load(model_file)
+        model=entry.model
 
         # Create explanation
         explainer = shap.Explainer(model,**{k: v for k, v in kwargsData.items()})
@@ -62,28 +81,12 @@ class ShapTreeLocal(Resource):
             explainer.expected_value=explainer.expected_value[index]
             shap_values=shap_values[index]
            
-        #plotting
-        plt.switch_backend('agg')
-        if plot_type=="bar":
-            shap.plots._bar.bar_legacy(shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"],show=False)
-        elif plot_type=="decision":
-            shap.decision_plot(explainer.expected_value,shap_values=shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"])
-        elif plot_type=="force":
-                shap.plots._force.force(explainer.expected_value,shap_values=shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"],out_names=kwargsData["output_names"],matplotlib=True,show=False)
-        else:
-            if plot_type==None:
-                print("No plot type was specified. Defaulting to waterfall plot.")
-            elif plot_type!="waterfall":
-                print("No plot with the specified name was found. Defaulting to waterfall plot.")
-            shap.plots._waterfall.waterfall_legacy(explainer.expected_value,shap_values=shap_values[0],features=np.array(instance),feature_names=kwargsData["feature_names"],show=False)
-       
-        ##saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        plt.savefig(upload_folder+filename+".png",bbox_inches="tight")
+        #plotting (rendered on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,plot,dict(plot_type=plot_type,expected_value=explainer.expected_value,
+                            shap_values=shap_values[0],instance=np.array(instance),feature_names=kwargsData["feature_names"],output_names=kwargsData["output_names"]))
        
-        #formatting json output
-        shap_values = [x.tolist() for x in shap_values]
-        ret=json.loads(json.dumps(shap_values))
+        #the arrays are encoded in the format requested by the client (see responseformats.py)
+        ret=LabeledArray(shap_values,kwargsData["feature_names"],kwargsData["output_names"])
         
         #Insert code for image uploading and getting url
         response={"plot_png":getcall+".png","explanation":ret}
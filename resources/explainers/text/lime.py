@@ -1,16 +1,10 @@
 from flask_restful import Resource,reqparse
 from flask import request
-import tensorflow as tf
-import torch
-import numpy as np
-import joblib
-import h5py
 import json
 import lime.lime_text
-from html2image import Html2Image
-from saveinfo import save_file_info
-from getmodelfiles import get_model_files
-import requests
+from lazyplots import save_plot, html_plot
+from screenshots import lime_bars
+from modelregistry import get_model, get_predict_function
 
 class LimeText(Resource):
 
@@ -38,33 +32,15 @@ class LimeText(Resource):
         predic_func=None
         
         #Getting model info, data, and file from local repository
-        model_file, model_info_file, _ = get_model_files(_id,self.model_folder)
+        entry = get_model(_id,self.model_folder)
 
         ## params from info
-        model_info=json.load(model_info_file)
-        backend = model_info["backend"]  ##error handling?
+        model_info=entry.model_info
         if "output_names" in model_info:
             output_names=model_info["output_names"]
 
-        if model_file!=None:
-            if backend=="TF1" or backend=="TF2":
-                model=h5py.File(model_file, 'w')
-                mlp = tf.keras.models.load_model(model)
-                predic_func=mlp
-            elif backend=="sklearn":
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict_proba
-            elif backend=="PYT":
-                mlp = torch.load(model_file)
-                predic_func=mlp.predict
-            else:
-                mlp = joblib.load(model_file)
-                predic_func=mlp.predict
-        elif url!=None:
-            def predict(X):
-                return np.array(json.loads(requests.post(url, data=dict(inputs=str(X.tolist()))).text))
-            predic_func=predict
-        else:
+        predic_func=get_predict_function(entry,url)
+        if predic_func==None:
             raise Exception("Either an ID for a locally stored model or an URL for the prediction function of the model must be provided.")
         
      
@@ -89,12 +65,8 @@ class LimeText(Resource):
             ret = {output_names[int(k)]:v for k,v in ret.items()}
         ret=json.loads(json.dumps(ret))
 
-        ##saving
-        upload_folder, filename, getcall = save_file_info(request.path,self.upload_folder)
-        hti = Html2Image()
-        hti.output_path= upload_folder
-        hti.screenshot(html_str=explanation.as_html(), save_as=filename+".png")   
-        explanation.save_to_file(upload_folder+filename+".html")
+        ##saving (the screenshot is taken on the first request to the plot URL)
+        getcall = save_plot(request.path,self.upload_folder,html_plot,{"html":explanation.as_html(),"bars":lime_bars(explanation,output_names)})
         
         response={"plot_html":getcall+".html","plot_png":getcall+".png","explanation":ret}
         return response
@@ -0,0 +1,298 @@
+import io
+import json
+import gzip
+import zlib
+import functools
+import importlib.util
+import numpy as np
+from flask import Response, request
+import config
+import metrics
+from remotepredict import NPY_MEDIA_TYPE
+
+## Content negotiation of the explanation responses. The explainers return their matrices (e.g. the Shapley
+## values of a whole dataset) as LabeledArray objects instead of converting them to lists, and the format of
+## the body is chosen from the Accept header of the request:
+##   application/json (default)           compact JSON, the arrays as nested lists as before
+##   application/x-npy                    the main array of the response as a .npy file. The other fields, the
+##                                        feature and class names go in the X-Explanation-Metadata header
+##   application/x-npz                    every array of the response and a 'metadata' JSON entry
+##   application/vnd.apache.arrow.stream  Arrow IPC stream of the main array, one column per feature
+##                                        (only when pyarrow is installed)
+## Bodies are gzip-compressed when the client accepts it, and large arrays are streamed to the client in
+## chunks instead of being encoded in memory first.
+
+NPZ_MEDIA_TYPE = "application/x-npz"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+_ROWS_PER_CHUNK = 1000
+_CHUNK_BYTES = 1 << 16
+
+
+class LabeledArray:
+
+    def __init__(self, values, feature_names=None, class_names=None):
+        #multiclass arrays have the shape (#_of_classes, #_of_instances, #_of_features)
+        self.values = np.asarray(values)
+        self.feature_names = list(feature_names) if feature_names is not None else None
+        self.class_names = list(class_names) if class_names is not None and self.values.ndim==3 else None
+
+    def metadata(self):
+        return {"shape": list(self.values.shape), "dtype": str(self.values.dtype),
+                "feature_names": self.feature_names, "class_names": self.class_names}
+
+
+def _default(value):
+    if isinstance(value, LabeledArray):
+        return value.values.tolist()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Object of type " + type(value).__name__ + " is not JSON serializable")
+
+
+def dumps(data):
+    return json.dumps(data, default=_default, separators=(",", ":"))
+
+
+## The stored responses (result cache, job results) keep the arrays and their labels
+
+def _tagged_default(value):
+    if isinstance(value, LabeledArray):
+        return dict(value.metadata(), __array__=value.values.tolist())
+    return _default(value)
+
+
+def _object_hook(value):
+    if "__array__" in value:
+        return LabeledArray(np.array(value["__array__"], dtype=value["dtype"]).reshape(value["shape"]),
+                            value["feature_names"], value["class_names"])
+    return value
+
+
+def dump_stored(data, f):
+    json.dump(data, f, default=_tagged_default)
+
+
+def load_stored(f):
+    return json.load(f, object_hook=_object_hook)
+
+
+def _arrays(value, path=""):
+    #(path, array) of the arrays of the response, e.g. ("explanation", array)
+    if isinstance(value, (LabeledArray, np.ndarray)):
+        yield path, value if isinstance(value, LabeledArray) else LabeledArray(value)
+    elif isinstance(value, dict):
+        for k, v in value.items():
+            yield from _arrays(v, path + "." + str(k) if path else str(k))
+    elif isinstance(value, (list, tuple)):
+        for i, v in enumerate(value):
+            yield from _arrays(v, path + "." + str(i) if path else str(i))
+
+
+def _without_arrays(value):
+    #the response with its arrays replaced by their shape, dtype and labels
+    if isinstance(value, (LabeledArray, np.ndarray)):
+        return (value if isinstance(value, LabeledArray) else LabeledArray(value)).metadata()
+    elif isinstance(value, dict):
+        return {k: _without_arrays(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_without_arrays(v) for v in value]
+    return value
+
+
+def _stream(arrays):
+    return config.RESPONSE_STREAM_MIN_BYTES > 0 and sum(a.values.nbytes for _, a in arrays) >= config.RESPONSE_STREAM_MIN_BYTES
+
+
+def _buffered(chunks):
+    #joins the small pieces produced by the encoders into chunks of about _CHUNK_BYTES
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= _CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def _iter_json(value):
+    if isinstance(value, dict):
+        yield "{"
+        for i, (k, v) in enumerate(value.items()):
+            yield ("," if i else "") + json.dumps(str(k)) + ":"
+            yield from _iter_json(v)
+        yield "}"
+    elif isinstance(value, (list, tuple)):
+        yield "["
+        for i, v in enumerate(value):
+            if i:
+                yield ","
+            yield from _iter_json(v)
+        yield "]"
+    elif isinstance(value, (LabeledArray, np.ndarray)):
+        values = value.values if isinstance(value, LabeledArray) else value
+        if values.ndim<=1:
+            yield dumps(values)
+        elif values.ndim>2:
+            yield from _iter_json(list(values))
+        else:
+            yield "["
+            for start in range(0, len(values), _ROWS_PER_CHUNK):
+                rows = dumps(values[start:start + _ROWS_PER_CHUNK])
+                yield ("," if start else "") + rows[1:-1]
+            yield "]"
+    else:
+        yield dumps(value)
+
+
+def _iter_npy(values):
+    header = io.BytesIO()
+    description = np.lib.format.header_data_from_array_1_0(values)
+    #the rows are written in C order
+    description["fortran_order"] = False
+    np.lib.format.write_array_header_1_0(header, description)
+    yield header.getvalue()
+    rows = max(1, _ROWS_PER_CHUNK * 64 // max(1, int(np.prod(values.shape[1:]))))
+    for start in range(0, len(values), rows):
+        yield np.ascontiguousarray(values[start:start + rows]).tobytes()
+
+
+def _iter_arrow(array, metadata):
+    import pyarrow as pa
+    values = array.values.reshape(1, -1) if array.values.ndim==1 else array.values
+    blocks = [(None, values)] if values.ndim==2 else list(zip(array.class_names or range(len(values)), values))
+    names = array.feature_names or ["feature_" + str(i) for i in range(values.shape[-1])]
+    fields = [pa.field(str(name), pa.from_numpy_dtype(values.dtype)) for name in names]
+    if values.ndim==3:
+        fields = [pa.field("class", pa.string())] + fields
+    schema = pa.schema(fields, metadata={"explanation": json.dumps(metadata, default=_default)})
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for label, block in blocks:
+            for start in range(0, len(block), _ROWS_PER_CHUNK):
+                rows = block[start:start + _ROWS_PER_CHUNK]
+                columns = [pa.array(rows[:, j]) for j in range(rows.shape[1])]
+                if label is not None:
+                    columns = [pa.array([str(label)] * len(rows))] + columns
+                writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=schema))
+                yield sink.getvalue()
+                sink.seek(0)
+                sink.truncate()
+    yield sink.getvalue()
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(config.RESPONSE_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _respond(body, mimetype, code, headers, stream):
+    #body: the whole content, or an iterator of chunks when stream is true
+    headers = dict(headers or {})
+    gzip_enabled = config.RESPONSE_GZIP_MIN_BYTES > 0 and "gzip" in request.accept_encodings
+    if gzip_enabled:
+        headers["Vary"] = "Accept-Encoding"
+    if stream:
+        body = _buffered(body)
+        if gzip_enabled:
+            body = _gzip_stream(body)
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, status=code, mimetype=mimetype, headers=headers, direct_passthrough=True)
+    if isinstance(body, str):
+        body = body.encode()
+    if gzip_enabled and len(body) >= config.RESPONSE_GZIP_MIN_BYTES:
+        body = gzip.compress(body, config.RESPONSE_GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, status=code, mimetype=mimetype, headers=headers)
+
+
+def output_json(data, code, headers=None):
+    if _stream(list(_arrays(data))):
+        return _respond(_iter_json(data), "application/json", code, headers, True)
+    return _respond(dumps(data), "application/json", code, headers, False)
+
+
+def _json_fallback(data, code, headers):
+    #responses without arrays (e.g. errors) are sent as JSON. flask-restful sets the Content-Type of the
+    #requested format after this, so it is restored in an after_request handler (see register_representations)
+    response = output_json(data, code, headers)
+    response.fallback_content_type = "application/json"
+    return response
+
+
+def output_npy(data, code, headers=None):
+    arrays = list(_arrays(data))
+    if not arrays:
+        return _json_fallback(data, code, headers)
+    path, array = arrays[0]
+    headers = dict(headers or {}, **{"X-Explanation-Metadata": dumps({"array": path, "response": _without_arrays(data)})})
+    if _stream(arrays):
+        return _respond(_iter_npy(array.values), NPY_MEDIA_TYPE, code, headers, True)
+    buffer = io.BytesIO()
+    np.save(buffer, array.values, allow_pickle=False)
+    return _respond(buffer.getvalue(), NPY_MEDIA_TYPE, code, headers, False)
+
+
+def output_npz(data, code, headers=None):
+    arrays = list(_arrays(data))
+    if not arrays:
+        return _json_fallback(data, code, headers)
+    content = {"metadata": np.array(dumps(_without_arrays(data)))}
+    for path, array in arrays:
+        content[path] = array.values
+        if array.feature_names is not None:
+            content[path + ".feature_names"] = np.array([str(x) for x in array.feature_names])
+        if array.class_names is not None:
+            content[path + ".class_names"] = np.array([str(x) for x in array.class_names])
+    buffer = io.BytesIO()
+    np.savez(buffer, **content)
+    return _respond(buffer.getvalue(), NPZ_MEDIA_TYPE, code, headers, False)
+
+
+def output_arrow(data, code, headers=None):
+    arrays = list(_arrays(data))
+    if not arrays:
+        return _json_fallback(data, code, headers)
+    path, array = arrays[0]
+    chunks = _iter_arrow(array, {"array": path, "response": _without_arrays(data)})
+    if _stream(arrays):
+        return _respond(chunks, ARROW_MEDIA_TYPE, code, headers, True)
+    return _respond(b"".join(chunks), ARROW_MEDIA_TYPE, code, headers, False)
+
+
+def _restore_content_type(response):
+    content_type = getattr(response, "fallback_content_type", None)
+    if content_type!=None:
+        response.headers["Content-Type"] = content_type
+    return response
+
+
+def _measured(representation):
+    #time spent encoding the response. The chunks of the streamed responses are encoded after the request is measured
+    @functools.wraps(representation)
+    def wrapper(data, code, headers=None):
+        with metrics.stage("encode"):
+            return representation(data, code, headers)
+    return wrapper
+
+
+def register_representations(app, api):
+    #JSON stays the first representation, so it is the one used for Accept: */*
+    api.representations["application/json"] = _measured(output_json)
+    api.representations[NPY_MEDIA_TYPE] = _measured(output_npy)
+    api.representations[NPZ_MEDIA_TYPE] = _measured(output_npz)
+    if importlib.util.find_spec("pyarrow")!=None:
+        api.representations[ARROW_MEDIA_TYPE] = _measured(output_arrow)
+    app.after_request(_restore_content_type)
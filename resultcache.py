@@ -0,0 +1,181 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from flask import request
+from getmodelfiles import get_model_paths
+from lazyplots import artifact_exists
+from responseformats import dump_stored, load_stored
+
+## Content-addressed cache of the explanations of the deterministic explainers. The key is a hash of the model,
+## model info and data files, the endpoint and the normalized arguments of the request. The JSON response is
+## stored once and the artifacts (plots) it links to are reused by every later request with the same key.
+
+#routes whose explanations are deterministic ("always") or only when the request sets a 'seed' param ("seeded").
+#Anchors is not cached: alibi seeds the global random state of numpy, shared with the concurrent requests
+CACHEABLE_ROUTES = {
+    "/Tabular/TreeSHAPLocal": "always",
+    "/Tabular/TreeSHAPGlobal": "always",
+    "/Tabular/DeepSHAPLocal": "always",
+    "/Tabular/DeepSHAPGlobal": "always",
+    "/Tabular/ALE": "always",
+    "/Tabular/TreeSHAPLocalBatch": "always",
+    "/Tabular/DeepSHAPLocalBatch": "always",
+    "/Tabular/LIMEBatch": "seeded",
+    "/Tabular/LIME": "seeded",
+}
+
+#params that only change how the work is distributed, not the explanation
+EXECUTION_PARAMS = ("n_jobs", "chunk_size")
+
+VIEW_PREFIX = "ViewExplanation/"
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def file_digest(path):
+    #the hash of each file is only computed again when its modification time or size changes
+    if path==None:
+        return None
+    stat = os.stat(path)
+    signature = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        digest = _digests.get(signature)
+    if digest==None:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with _digests_lock:
+            _digests[signature] = digest
+    return digest
+
+
+def _normalize(value):
+    #JSON strings (instance, params) are parsed so formatting and key order do not change the key
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def request_arguments():
+    args = request.values.to_dict()
+    body = request.get_json(silent=True) if request.is_json else None
+    if isinstance(body, dict):
+        args.update(body)
+    args.pop("async", None)
+    return {k: _normalize(v) for k, v in args.items()}
+
+
+def _artifacts(value, host_url):
+    #filenames of the plots linked by the response
+    if isinstance(value, str):
+        if value.startswith(host_url + VIEW_PREFIX):
+            yield value[len(host_url + VIEW_PREFIX):]
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _artifacts(v, host_url)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _artifacts(v, host_url)
+
+
+def _rebase(value, old, new):
+    #links are stored with the host of the request that created them
+    if isinstance(value, str):
+        return new + value[len(old):] if value.startswith(old + VIEW_PREFIX) else value
+    elif isinstance(value, dict):
+        return {k: _rebase(v, old, new) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_rebase(v, old, new) for v in value]
+    return value
+
+
+class ResultCache:
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def key(self, route, model_folder, args):
+        #returns None for requests whose explanation is not reproducible
+        policy = CACHEABLE_ROUTES.get(route)
+        params = args.get("params")
+        if policy==None or (policy=="seeded" and not (isinstance(params, dict) and params.get("seed")!=None)):
+            return None
+        _id = args.get("id")
+        if not isinstance(_id, str) or "/" in _id or "\\" in _id or _id in ("", ".", ".."):
+            return None
+        model_path, model_info_path, data_path = get_model_paths(_id, model_folder)
+        if model_path==None:
+            #explanations of an external prediction function can change without notice
+            return None
+        if isinstance(params, dict):
+            args = dict(args, params={k: v for k, v in params.items() if k not in EXECUTION_PARAMS})
+        content = {
+            "route": route,
+            "model": file_digest(model_path),
+            "model_info": file_digest(model_info_path),
+            "data": file_digest(data_path),
+            "args": {k: v for k, v in args.items() if k not in ("id", "url")},
+        }
+        digest = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+        return (_id, digest)
+
+    def _path(self, key):
+        _id, digest = key
+        return os.path.join(self.folder, _id, digest + ".json")
+
+    def get(self, key, upload_folder, host_url):
+        try:
+            with open(self._path(key)) as f:
+                stored = load_stored(f)
+        except (OSError, ValueError):
+            stored = None
+        if stored!=None and all(artifact_exists(upload_folder, name) for name in stored["artifacts"]):
+            with self._lock:
+                self.hits += 1
+            return _rebase(stored["response"], stored["host_url"], host_url)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, response, route, host_url):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stored = {"route": route, "host_url": host_url, "artifacts": list(_artifacts(response, host_url)), "response": response}
+        tmp = path + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+        with open(tmp, "w") as f:
+            dump_stored(stored, f)
+        os.replace(tmp, path)
+        with self._lock:
+            self.stores += 1
+
+    def invalidate(self, _id=None):
+        #removes the cached responses. The plots stay in the upload folder
+        if _id!=None:
+            if _id in ("", ".", "..") or "/" in _id or "\\" in _id:
+                return
+            shutil.rmtree(os.path.join(self.folder, _id), ignore_errors=True)
+        elif os.path.isdir(self.folder):
+            for name in os.listdir(self.folder):
+                shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
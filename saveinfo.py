@@ -1,9 +1,22 @@
 from flask import request
 import random
 import string
+from artifactstore import get_store
+import metrics
 
 
 
+def request_model_id():
+    _id = request.values.get("id")
+    body = request.get_json(silent=True) if request.is_json else None
+    if _id==None and isinstance(body, dict):
+        _id = body.get("id")
+    return _id
+
+
 def save_file_info(name, upload_folder):
+    #the files are written in the shard folder of the artifact store assigned to the filename
     filename = ''.join(random.choices(string.ascii_uppercase + string.digits, k = 10)) + name.replace("/","_")
-    return upload_folder+'/', filename, request.host_url + "ViewExplanation/" + filename
\ No newline at end of file
+    with metrics.stage("save_artifact"):
+        folder = get_store(upload_folder).add(filename, name, request_model_id())
+    return folder+'/', filename, request.host_url + "ViewExplanation/" + filename
\ No newline at end of file
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import queue
+import atexit
+import base64
+import select
+import shutil
+import signal
+import pathlib
+import tempfile
+import threading
+import config
+import metrics
+from plotting import new_figure
+
+## PNG versions of the HTML plots (LIME, DiCE, feature importance). Screenshots are taken by a bounded pool of
+## headless Chrome processes that are started once and reused: each browser is driven through the DevTools
+## protocol over a pipe (--remote-debugging-pipe), so a screenshot only loads the page in a running browser
+## instead of starting one. At most SCREENSHOT_BROWSERS browsers run at the same time, and requests beyond
+## that wait in a queue for a free one. Where the browser can not be driven over a pipe (Windows), each
+## screenshot starts Chrome through Html2Image instead. The plots whose content is known (LIME weights, DiCE
+## tables) can also be drawn directly with matplotlib, without a browser.
+
+#size of the browser window, and of the screenshots
+WINDOW_SIZE = (1920, 1080)
+
+
+class ScreenshotError(Exception):
+    pass
+
+
+class ScreenshotTimeout(ScreenshotError):
+    pass
+
+
+def _find_chrome():
+    from html2image.browsers.chrome import ChromeHeadless
+    return ChromeHeadless().executable
+
+
+class Browser:
+    #headless Chrome process taking the screenshots of one slot of the pool. It reads the DevTools protocol
+    #messages on its file descriptor 3 and writes the replies on 4, each message ending with a null byte
+
+    def __init__(self, flags, timeout):
+        self.timeout = timeout
+        self.temp_path = tempfile.mkdtemp(prefix="html2image")
+        self._buffer = b""
+        self._events = []
+        self._next_id = 0
+        self.pid = None
+        to_browser, self._input = os.pipe()
+        self._output, from_browser = os.pipe()
+        try:
+            try:
+                with open(os.devnull, "wb") as devnull:
+                    #posix_spawn does not run Python code in the child, unlike preexec_fn, so it is safe from threads
+                    self.pid = os.posix_spawnp(_find_chrome(), [
+                        "chrome", "--headless", "--remote-debugging-pipe", "--no-first-run",
+                        "--user-data-dir=" + os.path.join(self.temp_path, "profile"),
+                        "--window-size=" + str(WINDOW_SIZE[0]) + "," + str(WINDOW_SIZE[1])] + flags + ["about:blank"],
+                        os.environ, file_actions=[(os.POSIX_SPAWN_DUP2, to_browser, 3), (os.POSIX_SPAWN_DUP2, from_browser, 4),
+                                                  (os.POSIX_SPAWN_DUP2, devnull.fileno(), 1), (os.POSIX_SPAWN_DUP2, devnull.fileno(), 2)])
+            finally:
+                os.close(to_browser)
+                os.close(from_browser)
+            page = [t for t in self._call("Target.getTargets")["targetInfos"] if t["type"]=="page"]
+            target = page[0]["targetId"] if page else self._call("Target.createTarget", url="about:blank")["targetId"]
+            self._session = self._call("Target.attachToTarget", targetId=target, flatten=True)["sessionId"]
+            self._call("Page.enable", session=self._session)
+        except Exception:
+            self.close()
+            raise
+
+    def _read(self, deadline):
+        #next message of the browser
+        while b"\0" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self._output], [], [], remaining)[0]:
+                raise ScreenshotTimeout("The browser did not answer within " + str(self.timeout) + " seconds.")
+            data = os.read(self._output, 1 << 20)
+            if not data:
+                raise ScreenshotError("The browser exited.")
+            self._buffer += data
+        message, self._buffer = self._buffer.split(b"\0", 1)
+        return json.loads(message.decode("utf-8"))
+
+    def _call(self, method, session=None, **params):
+        self._next_id += 1
+        message = {"id": self._next_id, "method": method, "params": params}
+        if session!=None:
+            message["sessionId"] = session
+        data = json.dumps(message).encode("utf-8") + b"\0"
+        while data:
+            data = data[os.write(self._input, data):]
+        deadline = time.monotonic() + self.timeout
+        while True:
+            reply = self._read(deadline)
+            if reply.get("id")==self._next_id:
+                if "error" in reply:
+                    raise ScreenshotError(method + " failed: " + reply["error"].get("message", ""))
+                return reply.get("result", {})
+            if "method" in reply:
+                self._events.append(reply["method"])
+
+    def _wait_load(self):
+        #the screenshot is taken of what was rendered when the page does not finish loading in time
+        deadline = time.monotonic() + self.timeout
+        while "Page.loadEventFired" not in self._events:
+            try:
+                reply = self._read(deadline)
+            except ScreenshotTimeout:
+                return
+            if "method" in reply:
+                self._events.append(reply["method"])
+
+    def screenshot(self, png_path, html=None, html_file=None):
+        if html_file==None:
+            html_file = os.path.join(self.temp_path, "page.html")
+            with open(html_file, "w") as f:
+                f.write(html)
+        self._events = []
+        self._call("Page.navigate", session=self._session, url=pathlib.Path(os.path.abspath(html_file)).as_uri())
+        self._wait_load()
+        data = self._call("Page.captureScreenshot", session=self._session, format="png")["data"]
+        with open(png_path, "wb") as f:
+            f.write(base64.b64decode(data))
+
+    def close(self):
+        if self.pid!=None:
+            try:
+                os.kill(self.pid, signal.SIGTERM)
+                for _ in range(50):
+                    if os.waitpid(self.pid, os.WNOHANG)[0]!=0:
+                        break
+                    time.sleep(0.1)
+                else:
+                    os.kill(self.pid, signal.SIGKILL)
+                    os.waitpid(self.pid, 0)
+            except OSError:
+                pass
+            self.pid = None
+        for fd in ("_input", "_output"):
+            if getattr(self, fd, None)!=None:
+                os.close(getattr(self, fd))
+                setattr(self, fd, None)
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+
+class Html2ImageBrowser:
+    #slot of the pool where Chrome can not be driven over a pipe: every screenshot starts the browser
+
+    def __init__(self, flags, timeout):
+        from html2image import Html2Image
+        #chrome stops loading the page after the timeout and takes the screenshot of what was rendered
+        self.temp_path = tempfile.mkdtemp(prefix="html2image")
+        self._hti = Html2Image(temp_path=self.temp_path, size=WINDOW_SIZE, custom_flags=flags + ["--timeout=" + str(int(timeout * 1000))])
+
+    def screenshot(self, png_path, html=None, html_file=None):
+        self._hti.output_path = os.path.dirname(png_path) or "."
+        if html_file!=None:
+            self._hti.screenshot(html_file=html_file, save_as=os.path.basename(png_path))
+        else:
+            self._hti.screenshot(html_str=html, save_as=os.path.basename(png_path))
+
+    def close(self):
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+
+class BrowserPool:
+
+    def __init__(self, size, queue_timeout, timeout):
+        self.size = size
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        #the most recently used browsers are reused first
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.screenshots = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def _create(self):
+        flags = ["--default-background-color=000000", "--hide-scrollbars"]
+        if hasattr(os, "posix_spawnp"):
+            return Browser(flags, self.timeout)
+        return Html2ImageBrowser(flags, self.timeout)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            with self._lock:
+                self.timeouts += 1
+            raise ScreenshotTimeout("Timed out after " + str(self.queue_timeout) + " seconds waiting for a free browser to take the screenshot.")
+
+    def _discard(self, browser):
+        #the slot is freed, the next screenshot starts a new browser in it
+        browser.close()
+        with self._lock:
+            self._created -= 1
+
+    def screenshot(self, png_path, html=None, html_file=None):
+        with metrics.stage("screenshot_wait"):
+            browser = self._acquire()
+        try:
+            with metrics.stage("screenshot"):
+                browser.screenshot(png_path, html, html_file)
+        except Exception:
+            #a browser that failed (crashed, stopped answering) is not reused
+            self._discard(browser)
+            with self._lock:
+                self.failures += 1
+            raise
+        self._idle.put(browser)
+        with self._lock:
+            if os.path.exists(png_path):
+                self.screenshots += 1
+            else:
+                self.failures += 1
+        if not os.path.exists(png_path):
+            raise ScreenshotError("The browser did not produce the screenshot '" + os.path.basename(png_path) + "'.")
+
+    def close(self):
+        #stops the idle browsers and removes their temporary folders
+        while True:
+            try:
+                browser = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(browser)
+
+    def _reset_after_fork(self):
+        #the browsers belong to the parent process, the child starts its own
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "browsers": self._created,
+                "max_browsers": self.size,
+                "idle": self._idle.qsize(),
+                "screenshots": self.screenshots,
+                "timeouts": self.timeouts,
+                "failures": self.failures,
+            }
+
+
+browser_pool = BrowserPool(config.SCREENSHOT_BROWSERS, config.SCREENSHOT_QUEUE_TIMEOUT, config.SCREENSHOT_TIMEOUT)
+atexit.register(browser_pool.close)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=browser_pool._reset_after_fork)
+
+
+def screenshot(png_path, html=None, html_file=None):
+    browser_pool.screenshot(png_path, html, html_file)
+
+
+
+def lime_bars(explanation, class_names=None):
+    #weights of each explained label of a LIME explanation, as drawn by its HTML page
+    if explanation.mode=="regression":
+        return {"Prediction": explanation.as_list()}
+    return {(class_names[label] if class_names!=None else str(label)): explanation.as_list(label=label) for label in explanation.available_labels()}
+
+
+def bars_png(bars, png_path):
+    #bars: {label: [(feature, weight), ...]}. Draws one horizontal bar chart per label
+    fig = new_figure(figsize=(8, max(2, sum(len(v) for v in bars.values()) * 0.4 + len(bars))))
+    axes = fig.subplots(len(bars), 1, squeeze=False)
+    for ax, (label, weights) in zip(axes[:, 0], bars.items()):
+        weights = list(reversed(weights))
+        ax.barh([str(name) for name, _ in weights], [w for _, w in weights], color=["#1f77b4" if w > 0 else "#ff7f0e" for _, w in weights])
+        ax.axvline(0, color="black", linewidth=0.8)
+        ax.set_title(str(label))
+    fig.tight_layout()
+    fig.savefig(png_path, bbox_inches="tight")
+
+
+def tables_png(tables, png_path):
+    #tables: [(title, DataFrame or message), ...]. Draws the tables one under the other
+    heights = [len(t) + 2 if hasattr(t, "columns") else 1.5 for _, t in tables]
+    width = max([len(t.columns) + 1 for _, t in tables if hasattr(t, "columns")] + [6])
+    fig = new_figure(figsize=(min(width * 1.4, 40), sum(heights) * 0.35 + 0.5 * len(tables)))
+    axes = fig.subplots(len(tables), 1, gridspec_kw={"height_ratios": heights}, squeeze=False)
+    for ax, (title, table) in zip(axes[:, 0], tables):
+        ax.axis("off")
+        ax.set_title(title, loc="left", fontweight="bold")
+        if hasattr(table, "columns"):
+            cell_text = [[str(v) for v in row] for row in table.itertuples(index=False)]
+            t = ax.table(cellText=cell_text or None, colLabels=[str(c) for c in table.columns], loc="upper left", cellLoc="center")
+            t.auto_set_font_size(False)
+            t.set_fontsize(9)
+        else:
+            ax.text(0, 0.5, str(table), va="center")
+    fig.savefig(png_path, bbox_inches="tight")
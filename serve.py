@@ -0,0 +1,465 @@
+import os
+import sys
+import json
+import time
+import zlib
+import signal
+import socket
+import _thread
+import threading
+import itertools
+import http.client
+from collections import OrderedDict
+from urllib.parse import quote
+from werkzeug.wrappers import Request
+from werkzeug.wsgi import ClosingIterator
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+## Production entry point of the server. Takes the same arguments as app.py, plus the options --workers=,
+## --threads=, --host=, --port= and --preload= (see the SERVE_* settings in config.py):
+##   python serve.py [model_folder] [upload_folder] [--workers=4] [--preload=*] [--enable=...]
+## The main process imports the application, loads the models and training data listed in SERVE_PRELOAD, and
+## forks the worker processes, which share the preloaded objects copy-on-write. It only supervises them:
+## a worker that exits is started again. Another forked process, the router, listens on the public port and
+## forwards each request to a worker chosen by a hash of its model id, so the model registry, the explainer
+## cache and the prediction cache of a model stay warm in a single worker. When all the threads of that worker
+## are busy, the request goes to the next worker in the order of the model, so a popular model can use several
+## workers under load. The plots of ViewExplanation are routed the same way by their name, so the renders of a
+## plot (see lazyplots.py) happen in one worker. Other requests without a model id go to the workers in turn,
+## except /Cache and /metrics, which are sent to every worker and merged (the metrics get a 'worker' label).
+## The responses of the workers are streamed to the clients as they arrive. The workers are served with waitress when it is installed, and with the threaded werkzeug
+## server otherwise. With a single worker, or where fork is not available, the application is served directly.
+
+#options of serve.py, the other arguments are passed to app.py
+OPTIONS = ("--workers=", "--threads=", "--host=", "--port=", "--preload=")
+options = {}
+_argv = [sys.argv[0]]
+for arg in sys.argv[1:]:
+    option = next((o for o in OPTIONS if arg.startswith(o)), None)
+    if option!=None:
+        options[option[2:-1]] = arg[len(option):]
+    else:
+        _argv.append(arg)
+sys.argv = _argv
+
+import config
+import app
+from modelregistry import get_model
+from datacache import get_training_data
+
+#headers of a single connection, not forwarded by the router. The WSGI server of the router sends the streamed
+#responses without a Content-Length with its own chunked Transfer-Encoding
+HOP_BY_HOP = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers",
+              "transfer-encoding", "upgrade"}
+
+#size of the pieces of the responses copied from the workers to the clients
+STREAM_CHUNK_SIZE = 65536
+
+#path of the plots, routed by their name
+VIEW_PREFIX = "/ViewExplanation/"
+
+#paths answered by every worker
+BROADCAST = ("/Cache", "/metrics")
+
+
+def preload(model_ids, model_folder):
+    if "*" in model_ids:
+        model_ids = sorted(name for name in os.listdir(model_folder) if os.path.isdir(os.path.join(model_folder, name)))
+    for _id in model_ids:
+        start = time.perf_counter()
+        try:
+            get_model(_id, model_folder)
+            get_training_data(_id, model_folder)
+            print("Preloaded the model '" + _id + "' in %.1f s" % (time.perf_counter() - start))
+        except Exception as e:
+            print("The model '" + _id + "' could not be preloaded: " + str(e))
+
+
+## Serving a WSGI application on a listening socket
+
+class InFlight:
+    #WSGI middleware handling at most `threads` requests at the same time, and counting the requests in flight
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.requests = 0
+        self._slots = threading.BoundedSemaphore(threads)
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        self._slots.acquire()
+        with self._lock:
+            self.requests += 1
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        #the slot is released once the body of the response has been sent
+        return ClosingIterator(result, [self._done])
+
+    def _done(self):
+        with self._lock:
+            self.requests -= 1
+        self._slots.release()
+
+
+def _exit_when_idle(in_flight, timeout):
+    #on SIGTERM, the process stops once its requests in flight are finished (or after the timeout)
+    def wait():
+        deadline = time.monotonic() + timeout
+        while in_flight.requests > 0 and time.monotonic() < deadline:
+            time.sleep(0.1)
+        _thread.interrupt_main()
+
+    def handler(signum, frame):
+        threading.Thread(target=wait, name="graceful-exit", daemon=True).start()
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+def serve(wsgi_app, sock, threads, access_log=True):
+    #returns when the process is interrupted
+    in_flight = InFlight(wsgi_app, threads)
+    _exit_when_idle(in_flight, config.SERVE_GRACEFUL_TIMEOUT)
+    try:
+        import waitress
+    except ImportError:
+        waitress = None
+    try:
+        if waitress!=None:
+            waitress.serve(in_flight, sockets=[sock], threads=threads, ident="explainer-libraries")
+        else:
+            handler = WSGIRequestHandler if access_log else _QuietHandler
+            host, port = sock.getsockname()[:2]
+            server = make_server(host, port, in_flight, threaded=True, request_handler=handler, fd=sock.fileno())
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    #the requests are logged once, by the router
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def _listen(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+## Router
+
+class Router:
+
+    def __init__(self, addresses, threads, timeout):
+        #addresses: (host, port) of each worker
+        self.addresses = addresses
+        self.threads = threads
+        self.timeout = timeout
+        self.in_flight = [0] * len(addresses)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._turn = itertools.count()
+
+    def preferences(self, model_id):
+        #workers in the order they are tried for a model (rendezvous hashing): adding a worker only moves
+        #the models it becomes the first choice of
+        if model_id==None:
+            first = next(self._turn) % len(self.addresses)
+            return [(first + i) % len(self.addresses) for i in range(len(self.addresses))]
+        return sorted(range(len(self.addresses)), key=lambda worker: -zlib.crc32((model_id + "/" + str(worker)).encode()))
+
+    def acquire(self, model_id):
+        #the first worker with a free thread, so the requests for a busy model overflow to the next workers
+        #instead of queueing behind each other. When they are all busy, the first choice
+        preferences = self.preferences(model_id)
+        with self._lock:
+            worker = next((w for w in preferences if self.in_flight[w] < self.threads), preferences[0])
+            self.in_flight[worker] += 1
+        return worker
+
+    def release(self, worker):
+        with self._lock:
+            self.in_flight[worker] -= 1
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        #read first, so the form can still be parsed from the cached body
+        body = request.get_data(cache=True)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP | {"content-length"}}
+        headers["X-Forwarded-For"] = request.remote_addr or ""
+        target = _target(environ)
+        try:
+            if request.path in BROADCAST:
+                status, response_headers, data = self._broadcast(request.method, target, headers, body, request.path)
+            else:
+                worker = self.acquire(_route_key(request))
+                try:
+                    status, response_headers, response = self._forward(worker, request.method, target, headers, body)
+                except BaseException:
+                    self.release(worker)
+                    raise
+                start_response(status, response_headers)
+                return self._stream(worker, self._connection(worker), response)
+        except socket.timeout:
+            status, response_headers, data = _error(504, "The worker did not answer within " + str(self.timeout) + " seconds.")
+        except (OSError, http.client.HTTPException) as e:
+            status, response_headers, data = _error(502, "The worker could not be reached: " + str(e))
+        start_response(status, [(k, v) for k, v in response_headers if k.lower()!="content-length"] + [("Content-Length", str(len(data)))])
+        return [data]
+
+    def _stream(self, worker, connection, response):
+        #copies the body of the response of the worker to the client. The worker is released, and its connection
+        #kept for the next request, once the body has been read to the end
+        finished = False
+        try:
+            for chunk in iter(lambda: response.read(STREAM_CHUNK_SIZE), b""):
+                yield chunk
+            finished = True
+        finally:
+            self.release(worker)
+            if not finished or response.will_close:
+                connection.close()
+
+    def _connection(self, worker):
+        connections = getattr(self._local, "connections", None)
+        if connections==None:
+            connections = self._local.connections = {}
+        if worker not in connections:
+            host, port = self.addresses[worker]
+            connections[worker] = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return connections[worker]
+
+    def _forward(self, worker, method, target, headers, body):
+        connection = self._connection(worker)
+        #a connection kept alive may have been closed by the worker since, it is retried once on a new one
+        reused = connection.sock!=None
+        try:
+            connection.request(method, target, body=body, headers=headers)
+            response = connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if not reused:
+                raise
+            connection.request(method, target, body=body, headers=headers)
+            response = connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+        status = str(response.status) + " " + response.reason
+        return status, [(k, v) for k, v in response.getheaders() if k.lower() not in HOP_BY_HOP], response
+
+    def _read(self, worker, method, target, headers, body):
+        status, response_headers, response = self._forward(worker, method, target, headers, body)
+        try:
+            data = response.read()
+        except BaseException:
+            self._connection(worker).close()
+            raise
+        if response.will_close:
+            self._connection(worker).close()
+        return status, response_headers, data
+
+    def _broadcast(self, method, target, headers, body, path):
+        responses = [self._read(worker, method, target, headers, body) for worker in range(len(self.addresses))]
+        failed = next((r for r in responses if not r[0].startswith("200")), None)
+        if failed!=None:
+            return failed
+        if path=="/metrics":
+            text = merge_metrics([data.decode() for _, _, data in responses])
+            return responses[0][0], [("Content-Type", dict(responses[0][1]).get("Content-Type", "text/plain"))], text.encode()
+        merged = {"workers": [dict(json.loads(data), worker=worker) for worker, (_, _, data) in enumerate(responses)]}
+        return responses[0][0], [("Content-Type", "application/json")], json.dumps(merged).encode()
+
+
+def _route_key(request):
+    #the model id of the request, or the name of the plot (without its extension, so the .html and .png of a
+    #plot go to the same worker)
+    if request.path.startswith(VIEW_PREFIX):
+        return os.path.splitext(request.path[len(VIEW_PREFIX):])[0] or None
+    return _model_id(request)
+
+
+def _model_id(request):
+    #the 'id' argument of the query string, the form or the JSON body
+    _id = request.values.get("id")
+    if _id==None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and body.get("id")!=None:
+            _id = str(body["id"])
+    return _id
+
+
+def _target(environ):
+    #path and query string as sent by the client
+    target = environ.get("RAW_URI") or environ.get("REQUEST_URI")
+    if not target:
+        target = quote((environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")).encode("latin-1"))
+        if environ.get("QUERY_STRING"):
+            target += "?" + environ["QUERY_STRING"]
+    return target
+
+
+def _error(code, message):
+    return str(code) + " " + http.client.responses[code], [("Content-Type", "application/json")], json.dumps({"message": message}).encode()
+
+
+def merge_metrics(texts):
+    #the samples of each worker get a 'worker' label, and the samples of a metric are kept after its header
+    families = OrderedDict()
+    for worker, text in enumerate(texts):
+        family = None
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                    family = families.setdefault(parts[2], (OrderedDict(), []))
+                    family[0].setdefault(parts[1], line)
+                continue
+            if family==None:
+                family = families.setdefault("", (OrderedDict(), []))
+            label = 'worker="' + str(worker) + '"'
+            brace, space = line.find("{"), line.find(" ")
+            if brace!=-1 and brace < space:
+                labels = line[brace + 1:]
+                family[1].append(line[:brace] + "{" + label + ("" if labels.startswith("}") else ",") + labels)
+            else:
+                family[1].append(line[:space] + "{" + label + "}" + line[space:])
+    lines = []
+    for headers, samples in families.values():
+        lines.extend(headers.values())
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+## Supervisor
+
+class _Stop(Exception):
+    pass
+
+
+def _stop(signum, frame):
+    raise _Stop()
+
+
+def _fork(target, *args):
+    pid = os.fork()
+    if pid==0:
+        code = 0
+        try:
+            target(*args)
+        except BaseException as e:
+            print("The process " + str(os.getpid()) + " failed: " + repr(e))
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+    return pid
+
+
+def _run_worker(index, sock, others, threads):
+    for other in others:
+        other.close()
+    try:
+        serve(app.app, sock, threads, access_log=False)
+    finally:
+        #the asynchronous jobs started by the worker are stopped with it
+        app.job_manager.shutdown()
+
+
+def _run_router(sock, addresses, others, worker_threads, router_threads):
+    for other in others:
+        other.close()
+    serve(Router(addresses, worker_threads, config.SERVE_TIMEOUT), sock, router_threads)
+
+
+def _terminate(pids, timeout):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + timeout + 5
+    remaining = set(pids)
+    while remaining and time.monotonic() < deadline:
+        for pid in list(remaining):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]!=0:
+                    remaining.discard(pid)
+            except ChildProcessError:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def main():
+    host = options.get("host", config.SERVE_HOST)
+    port = int(options.get("port", config.SERVE_PORT))
+    workers = int(options.get("workers", config.SERVE_WORKERS)) or os.cpu_count() or 1
+    threads = int(options.get("threads", config.SERVE_THREADS))
+    preloaded = [x for x in options["preload"].split(",") if x.strip()] if "preload" in options else config.SERVE_PRELOAD
+    preload(preloaded, app.MODEL_FOLDER)
+
+    public = _listen(host, port)
+    if workers==1 or not hasattr(os, "fork"):
+        print("Serving on " + host + ":" + str(port) + " in a single process")
+        serve(app.app, public, threads)
+        return
+
+    internal = [_listen("127.0.0.1", 0) for _ in range(workers)]
+    addresses = [sock.getsockname()[:2] for sock in internal]
+    sockets = [public] + internal
+    #the router can have a request waiting for every thread of every worker
+    router_threads = workers * threads + 16
+    children = {}
+    started = {}
+
+    def start(role):
+        if role=="router":
+            pid = _fork(_run_router, public, addresses, internal, threads, router_threads)
+        else:
+            pid = _fork(_run_worker, role, internal[role], [s for s in sockets if s is not internal[role]], threads)
+        children[pid] = role
+        started[role] = time.monotonic()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        for index in range(workers):
+            start(index)
+        start("router")
+        print("Serving on " + host + ":" + str(port) + " with " + str(workers) + " worker processes of " + str(threads) + " threads")
+        sys.stdout.flush()
+        while True:
+            pid, status = os.wait()
+            role = children.pop(pid, None)
+            if role==None:
+                continue
+            name = "The router" if role=="router" else "The worker " + str(role)
+            print(name + " (process " + str(pid) + ") exited with status " + str(status) + ", it is started again")
+            #a process failing at startup is not restarted in a tight loop
+            if time.monotonic() - started[role] < 1:
+                time.sleep(1)
+            start(role)
+    except _Stop:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        #the router stops first, then the workers finish the requests it forwarded
+        _terminate([pid for pid, role in children.items() if role=="router"], config.SERVE_GRACEFUL_TIMEOUT)
+        _terminate([pid for pid, role in children.items() if role!="router"], config.SERVE_GRACEFUL_TIMEOUT)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import os
+import math
+import pickle
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import config
+
+## Computes the KernelSHAP values of many instances by splitting the rows into chunks explained by a pool
+## of worker processes. The pool is shared by all the requests of the server process and started once, with
+## the forkserver (or spawn) start method, so the workers are never forked from the threads of the server.
+## The prediction function, the background and the instances of a request are pickled once to a temporary
+## file, each worker loads them the first time it gets a chunk of the request, and the tasks only carry the
+## path of the file and the row ranges of their chunks.
+
+#workers of the shared pool when SHAP_PARALLEL_WORKERS is not set
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    #the pool of the parent process is not usable in a forked child, which starts its own
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+## Worker processes
+
+#explainers of the last requests seen by the worker, by path of their payload
+_worker_jobs = OrderedDict()
+_WORKER_JOBS = 2
+
+
+def _exit_with_parent(parent):
+    parent.join()
+    os._exit(0)
+
+
+def _init_worker():
+    #the workers are not children of the server with forkserver, they stop on their own if it is killed
+    parent = multiprocessing.parent_process()
+    if parent!=None:
+        threading.Thread(target=_exit_with_parent, args=(parent,), daemon=True).start()
+
+
+def _load_job(path):
+    job = _worker_jobs.get(path)
+    if job==None:
+        import shap
+        with open(path, "rb") as f:
+            predic_func, background, X, explainer_kwargs = pickle.load(f)
+        job = _worker_jobs[path] = (shap.KernelExplainer(predic_func, background, **explainer_kwargs), X)
+        while len(_worker_jobs) > _WORKER_JOBS:
+            _worker_jobs.popitem(last=False)
+    else:
+        _worker_jobs.move_to_end(path)
+    return job
+
+
+def _explain_chunk(path, start, stop):
+    explainer, X = _load_job(path)
+    return explainer.shap_values(X.iloc[start:stop] if hasattr(X, "iloc") else X[start:stop], silent=True)
+
+
+## Server process
+
+def _merge(chunks):
+    #multiclass models return a list with the values of each class
+    if isinstance(chunks[0], list):
+        return [np.concatenate([chunk[i] for chunk in chunks], axis=0) for i in range(len(chunks[0]))]
+    return np.concatenate(chunks, axis=0)
+
+
+def _get_context():
+    method = config.SHAP_PARALLEL_START_METHOD
+    if not method:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def max_workers():
+    return config.SHAP_PARALLEL_WORKERS or min(DEFAULT_MAX_WORKERS, os.cpu_count() or 1)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor==None:
+            _executor = ProcessPoolExecutor(max_workers=max_workers(), mp_context=_get_context(), initializer=_init_worker)
+        return _executor
+
+
+def _discard_executor(executor):
+    #a worker died (killed by the OOM killer for instance), the next request starts a new pool
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor!=None:
+        executor.shutdown(wait=True)
+
+
+def _dump_job(predic_func, background, X, explainer_kwargs):
+    fd, path = tempfile.mkstemp(prefix="kernelshap-", suffix=".pkl")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((predic_func, background, X, explainer_kwargs), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def kernel_shap_values(predic_func, background, X, explainer_kwargs=None, n_jobs=None, chunk_size=None, progress=None, explainer=None):
+    #n_jobs: maximum number of chunks of this request computed at the same time by the shared pool
+    #progress: optional function called with the fraction of rows explained after each chunk
+    #explainer: explainer of the request (see explainercache.py), used when the rows are explained in the server process
+    explainer_kwargs = explainer_kwargs or {}
+    workers = max_workers()
+    if n_jobs==None:
+        n_jobs = workers
+    n_jobs = max(1, min(int(n_jobs), workers, len(X)))
+    if chunk_size==None:
+        chunk_size = config.SHAP_CHUNK_SIZE
+    if not chunk_size:
+        #a few chunks per worker keep them all busy when some rows take longer than others
+        chunk_size = max(1, math.ceil(len(X) / (n_jobs * 4)))
+    chunk_size = int(chunk_size)
+
+    path = None
+    if n_jobs > 1:
+        try:
+            path = _dump_job(predic_func, background, X, explainer_kwargs)
+        except Exception:
+            #models that can not be pickled are explained in the server process
+            path = None
+    if path==None:
+        if explainer==None:
+            import shap
+            explainer = shap.KernelExplainer(predic_func, background, **explainer_kwargs)
+        return explainer.shap_values(X)
+
+    try:
+        ranges = [(start, min(start + chunk_size, len(X))) for start in range(0, len(X), chunk_size)]
+        results = [None] * len(ranges)
+        executor = _get_executor()
+        pending = {}
+        submitted = done = 0
+        try:
+            while done < len(ranges):
+                while submitted < len(ranges) and len(pending) < n_jobs:
+                    start, stop = ranges[submitted]
+                    pending[executor.submit(_explain_chunk, path, start, stop)] = submitted
+                    submitted += 1
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[pending.pop(future)] = future.result()
+                    done += 1
+                    if progress!=None:
+                        progress(done / len(ranges))
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+        return _merge(results)
+    finally:
+        os.remove(path)
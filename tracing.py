@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+import config
+
+## Trace spans of the explanation requests. Each request is a root span, and the stages measured by metrics.py
+## (model registry lookup, data load, explainer construction, every call to the prediction function with its
+## number of rows, rendering, artifact writes...) are its child spans, nested as they ran in each thread.
+## Traces are written when TRACE_FILE is set, as Chrome trace events (open the file in chrome://tracing,
+## Perfetto or speedscope), and when TRACE_OTLP_FILE is set, as one OTLP/JSON ExportTraceServiceRequest per line,
+## the format of the OpenTelemetry collector's file exporter. Both files roll over at TRACE_MAX_BYTES, keeping
+## TRACE_BACKUPS older files. A '{pid}' in the file names is replaced by the id of the process, so the worker
+## processes of a server write their own files.
+
+
+def enabled():
+    return bool(config.TRACE_FILE or config.TRACE_OTLP_FILE)
+
+
+class RollingFile:
+    #appends records to a file, renaming it to <path>.1 (and the older ones to .2, .3...) when it grows too large
+
+    def __init__(self, path, header="", max_bytes=None, backups=None):
+        self.path = path
+        self.header = header
+        self.max_bytes = max_bytes if max_bytes!=None else config.TRACE_MAX_BYTES
+        self.backups = backups if backups!=None else config.TRACE_BACKUPS
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                size = None
+            if size!=None and self.max_bytes > 0 and size + len(text) > self.max_bytes and size > len(self.header):
+                self._roll()
+                size = None
+            if size==None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                if size==None:
+                    f.write(self.header)
+                f.write(text)
+
+    def _roll(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.path + "." + str(i)):
+                os.replace(self.path + "." + str(i), self.path + "." + str(i + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def _rolling_file(path, header):
+    path = path.replace("{pid}", str(os.getpid()))
+    with _files_lock:
+        if path not in _files:
+            _files[path] = RollingFile(path, header)
+        return _files[path]
+
+
+class Span:
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.thread = threading.get_native_id() if hasattr(threading, "get_native_id") else threading.get_ident()
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def end(self):
+        self.end_ns = time.time_ns()
+
+
+class Trace:
+
+    def __init__(self, name, **attributes):
+        self.trace_id = os.urandom(16).hex()
+        self.root = Span(name, None, _defined(attributes))
+        self.spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        #the span is a child of the innermost span open in the current thread, or of the root span
+        stack = getattr(self._local, "stack", None)
+        if stack==None:
+            stack = self._local.stack = []
+        span = Span(name, stack[-1].span_id if stack else self.root.span_id, _defined(attributes))
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes["error"] = type(e).__name__
+            raise
+        finally:
+            span.end()
+            stack.pop()
+            with self._lock:
+                self.spans.append(span)
+
+    def current_span_id(self):
+        #innermost span open in the current thread, or the root span
+        stack = getattr(self._local, "stack", None)
+        return stack[-1].span_id if stack else self.root.span_id
+
+    def add_span(self, name, parent_id, start_ns, end_ns, **attributes):
+        #span of work already done by another thread on behalf of the request (e.g. a merged prediction)
+        span = Span(name, parent_id, _defined(attributes))
+        span.start_ns = start_ns
+        span.end_ns = end_ns
+        with self._lock:
+            self.spans.append(span)
+
+    def finish(self, **attributes):
+        self.root.attributes.update(_defined(attributes))
+        self.root.end()
+        with self._lock:
+            spans = [self.root] + self.spans
+        try:
+            if config.TRACE_FILE:
+                _rolling_file(config.TRACE_FILE, "[\n").write("".join(json.dumps(event) + ",\n" for event in self.chrome_events(spans)))
+            if config.TRACE_OTLP_FILE:
+                _rolling_file(config.TRACE_OTLP_FILE, "").write(json.dumps(self.otlp(spans)) + "\n")
+        except OSError as e:
+            print("The trace could not be written: " + str(e))
+
+    def chrome_events(self, spans):
+        #complete ('X') events, in microseconds
+        pid = os.getpid()
+        return [{"name": s.name, "cat": "request" if s is self.root else "stage", "ph": "X", "pid": pid, "tid": s.thread,
+                 "ts": s.start_ns / 1000, "dur": (s.end_ns - s.start_ns) / 1000,
+                 "args": dict(s.attributes, trace_id=self.trace_id)} for s in spans]
+
+    def otlp(self, spans):
+        return {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": config.TRACE_SERVICE_NAME, "process.pid": os.getpid()})},
+            "scopeSpans": [{
+                "scope": {"name": "explainer-libraries"},
+                "spans": [dict({"traceId": self.trace_id, "spanId": s.span_id, "name": s.name,
+                                #SERVER for the request, INTERNAL for its stages
+                                "kind": 2 if s is self.root else 1,
+                                "startTimeUnixNano": str(s.start_ns), "endTimeUnixNano": str(s.end_ns),
+                                "attributes": _otlp_attributes(dict(s.attributes, **{"thread.id": s.thread})),
+                                "status": {"code": 2 if "error" in s.attributes or _is_server_error(s.attributes) else 0}},
+                               **({"parentSpanId": s.parent_id} if s.parent_id!=None else {})) for s in spans],
+            }],
+        }]}
+
+
+def _defined(attributes):
+    return {k: v for k, v in attributes.items() if v!=None}
+
+
+def _is_server_error(attributes):
+    return isinstance(attributes.get("status"), int) and attributes["status"] >= 500
+
+
+def _otlp_attributes(attributes):
+    values = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            value = {"boolValue": value}
+        elif isinstance(value, int):
+            value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            value = {"doubleValue": value}
+        else:
+            value = {"stringValue": str(value)}
+        values.append({"key": key, "value": value})
+    return values
+
+
+def start_trace(name, **attributes):
+    #None when tracing is disabled
+    return Trace(name, **attributes) if enabled() else None
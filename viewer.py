@@ -1,8 +1,21 @@
 from flask_restful import Resource
 from werkzeug.utils import secure_filename
+from lazyplots import render_pending
+from artifactstore import get_store
+import metrics
 
 class ViewExplanation(Resource):
+
+    def __init__(self,upload_folder):
+        self.upload_folder = upload_folder
+
     def get(self, filename):
+        metrics.begin("/ViewExplanation")
+        filename = secure_filename(filename)
+        #plots are rendered the first time they are requested
+        render_pending(self.upload_folder, filename)
+        #path of the file in its shard folder of the upload folder
+        path = get_store(self.upload_folder).resolve(filename)
         return {  
-            "filename": secure_filename(filename),
+            "filename": path if path!=None else filename,
         }
\ No newline at end of file